@@ -1,118 +1,151 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import os
-import requests
+import time
 
-from dotenv import load_dotenv
+import httpx
 
-from stats_calculator import calculate_stock_stats
+import metrics
+from gemini_client import (
+    GOOGLE_API_KEY,
+    StreamError,
+    get_client,
+    normalize_model_name,
+)
+from overload import Overloaded
+from singleflight import flights
+from stats_calculator import calculate_stock_stats, format_indicators
+from ttl_cache import TTLCache
 
-load_dotenv()
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+GOOGLE_MODEL = normalize_model_name(
+    os.getenv("GOOGLE_MODEL"),
+    "gemini-1.5-flash",
+)
+GOOGLE_FALLBACK_MODEL = normalize_model_name(
+    os.getenv("GOOGLE_FALLBACK_MODEL"),
+    "gemini-1.5-flash",
+)
+# Лимит токенов ответа: у основной модели больше, у запасной меньше
+MAX_TOKENS = {GOOGLE_MODEL: 512}
+FALLBACK_MAX_TOKENS = 384
 
+# Данные исторические, поэтому один и тот же промпт можно долго
+# отдавать из кэша
+ANALYSIS_CACHE_ITEMS = int(os.getenv("ANALYSIS_CACHE_ITEMS", "2000"))
+ANALYSIS_CACHE_TTL = float(
+    os.getenv("ANALYSIS_CACHE_TTL", str(30 * 24 * 3600))
+)
+ANALYSIS_CACHE_DB = os.getenv("ANALYSIS_CACHE_DB")
+ANALYSIS_PREWARM_CONCURRENCY = int(
+    os.getenv("ANALYSIS_PREWARM_CONCURRENCY", "2")
+)
+# Потоковая генерация: если между фрагментами ответа прошло больше
+# ANALYSIS_STREAM_STALL секунд, поток считается зависшим
+ANALYSIS_STREAM_STALL = float(os.getenv("ANALYSIS_STREAM_STALL", "5"))
 
-def _normalize_model_name(model: str | None) -> str:
-    if not model:
-        return "gemini-1.5-flash"
-    cleaned = model.strip()
-    if cleaned.startswith("models/"):
-        cleaned = cleaned.split("models/", 1)[1]
-    return cleaned
+analysis_cache = TTLCache(
+    ANALYSIS_CACHE_ITEMS,
+    ANALYSIS_CACHE_TTL,
+    ANALYSIS_CACHE_DB,
+    table="analysis_cache",
+)
+_cache_hits = metrics.counter("analysis_cache_hits_total")
+_cache_misses = metrics.counter("analysis_cache_misses_total")
+_streams = {
+    result: metrics.counter("analysis_stream_total", result=result)
+    for result in ("ok", "failed", "stalled")
+}
 
 
-GOOGLE_MODEL = _normalize_model_name(
-    os.getenv("GOOGLE_MODEL", "gemini-1.5-flash")
-)
-GOOGLE_FALLBACK_MODEL = _normalize_model_name(
-    os.getenv("GOOGLE_FALLBACK_MODEL", "gemini-1.5-flash")
-)
+# Ключ кэша: хэш цепочки моделей и промпта (промпт детерминированно
+# строится из stats)
+def analysis_cache_key(prompt: str) -> str:
+    raw = f"{GOOGLE_MODEL}|{GOOGLE_FALLBACK_MODEL}|{prompt}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
 
-# Аналитика через Google AI Studio (Gemini)
-def generate_ai_analysis(ticker, start_date, end_date):
 
-    stats = None
+def build_analysis_prompt(stats, ticker, start_date, end_date):
+    return (
+        "Дай краткий (3-4 предложения) анализ акции за указанный период. "
+        "Не пиши вступлений. Формат: тренд, волатильность/риски, "
+        "активность, вывод."
+        f"\nТикер: {ticker}\nПериод: {start_date} - {end_date}"
+        f"\nСтарт: ${stats['start_price']:.2f}, конец: "
+        f"${stats['end_price']:.2f}"
+        f"\nИзменение: {stats['price_change_percent']:.1f}%"
+        f"\nМин/макс: ${stats['min_price']:.2f} / "
+        f"${stats['max_price']:.2f}"
+        f"\nСредняя: ${stats['average_price']:.2f}, волатильность: "
+        f"${stats['volatility']:.2f}"
+        f"\nОбъем: {stats['total_volume']:,.0f}, дней: "
+        f"{stats['days_count']}"
+        + (
+            "\n" + format_indicators(stats['indicators'])
+            if stats.get('indicators') else ""
+        )
+    )
+
+# Аналитика через Google AI Studio (Gemini). Если статистика уже
+# посчитана вызывающим кодом, она передается в stats и не считается
+# повторно. С on_text ответ генерируется потоком: on_text(текст)
+# вызывается с накопленным текстом на каждом фрагменте.
+async def generate_ai_analysis(
+    ticker,
+    start_date,
+    end_date,
+    stats=None,
+    on_text=None,
+):
+
     try:
-        stats, _ = calculate_stock_stats(ticker, start_date, end_date)
+        if stats is None:
+            stats, _ = await asyncio.to_thread(
+                calculate_stock_stats,
+                ticker,
+                start_date,
+                end_date,
+            )
         if not stats:
             return "❌ Не удалось получить данные для анализа"
 
         if not GOOGLE_API_KEY:
             return fallback_analysis(stats, ticker)
 
-        prompt = (
-            "Дай краткий (3-4 предложения) анализ акции за указанный период. "
-            "Не пиши вступлений. Формат: тренд, волатильность/риски, "
-            "активность, вывод."
-            f"\nТикер: {ticker}\nПериод: {start_date} - {end_date}"
-            f"\nСтарт: ${stats['start_price']:.2f}, конец: "
-            f"${stats['end_price']:.2f}"
-            f"\nИзменение: {stats['price_change_percent']:.1f}%"
-            f"\nМин/макс: ${stats['min_price']:.2f} / "
-            f"${stats['max_price']:.2f}"
-            f"\nСредняя: ${stats['average_price']:.2f}, волатильность: "
-            f"${stats['volatility']:.2f}"
-            f"\nОбъем: {stats['total_volume']:,.0f}, дней: "
-            f"{stats['days_count']}"
-        )
+        prompt = build_analysis_prompt(stats, ticker, start_date, end_date)
+        cache_key = analysis_cache_key(prompt)
+        cached = analysis_cache.get(cache_key)
+        if cached is not None:
+            _cache_hits.inc()
+            return cached
+        _cache_misses.inc()
 
-        def call_model(model_name: str, max_tokens: int = 160):
-            api_url = (
-                f"https://generativelanguage.googleapis.com/v1beta/models/"
-                f"{model_name}:generateContent?key={GOOGLE_API_KEY}"
+        if on_text is not None:
+            return await _stream_analysis(
+                prompt,
+                cache_key,
+                stats,
+                ticker,
+                on_text,
             )
-            payload = {
-                "contents": [
-                    {"role": "user", "parts": [{"text": prompt}]}
-                ],
-                "generationConfig": {
-                    "temperature": 0.6,
-                    "maxOutputTokens": max_tokens,
-                    "responseModalities": ["TEXT"],
-                },
-            }
-            try:
-                resp = requests.post(api_url, json=payload, timeout=30)
-                if resp.status_code == 200:
-                    result = resp.json()
-                    text = ""
-                    content = result.get("candidates", [{}])[0].get(
-                        "content",
-                        {},
-                    )
-                    for part in content.get("parts", []):
-                        if "text" in part:
-                            text += part["text"]
-                    if text:
-                        return text
-                    # Логируем пустой ответ для дебага
-                    if result.get("candidates"):
-                        finish = result["candidates"][0].get("finishReason")
-                        print(
-                            f"Пустой ответ модели {model_name}, "
-                            f"finishReason={finish}"
-                        )
-                    return None
-                else:
-                    print(f"Ошибка Google AI API ({model_name}): {resp.text}")
-                    return None
-            except Exception as err:
-                print(f"Ошибка запроса к модели {model_name}: {err}")
-                return None
-
-        # Основная модель
-        text = call_model(GOOGLE_MODEL, max_tokens=512)
-        if text:
-            return format_ai_response(text)
 
-        # Ретрай на fallback-модель (обычно flash),
-        # если основная недоступна/пустая
-        if GOOGLE_FALLBACK_MODEL and GOOGLE_FALLBACK_MODEL != GOOGLE_MODEL:
-            text = call_model(GOOGLE_FALLBACK_MODEL, max_tokens=384)
-            if text:
-                return format_ai_response(text)
+        # Одинаковые одновременные запросы ждут один ответ модели
+        analysis = await flights.do(
+            ("analysis", cache_key),
+            _request_analysis,
+            prompt,
+            cache_key,
+        )
+        if analysis:
+            return analysis
 
         return fallback_analysis(stats, ticker)
 
+    except Overloaded as e:
+        # Модель недоступна или бюджет исчерпан: ответ на правилах сразу
+        print(f"AI-анализ пропущен: {e}")
+        return fallback_analysis(stats, ticker)
     except Exception as e:
         print(f"Ошибка AI-анализа: {e}")
         if stats:
@@ -120,6 +153,97 @@ def generate_ai_analysis(ticker, start_date, end_date):
         return "❌ Не удалось сформировать аналитику"
 
 
+# Основная модель, при неудаче/пустом ответе — fallback-модель
+# (обычно flash); повторы с backoff делает клиент. None — модель
+# не ответила.
+async def _request_analysis(prompt, cache_key):
+    text = await get_client().generate_text(
+        [GOOGLE_MODEL, GOOGLE_FALLBACK_MODEL],
+        prompt,
+        temperature=0.6,
+        max_tokens=lambda model: MAX_TOKENS.get(
+            model,
+            FALLBACK_MAX_TOKENS,
+        ),
+        extra_config={"responseModalities": ["TEXT"]},
+    )
+    if not text:
+        return None
+    analysis = format_ai_response(text)
+    # Запасной анализ на правилах не кэшируем — он и так мгновенный
+    analysis_cache.set(cache_key, analysis)
+    return analysis
+
+
+# Потоковый ответ основной модели. Поток не начался (ошибка, пустой
+# ответ) — обычный запрос с повторами и запасной моделью; завис или
+# оборвался на середине — сразу анализ на правилах.
+async def _stream_analysis(prompt, cache_key, stats, ticker, on_text):
+    text = ""
+    try:
+        async for chunk in get_client().stream_text(
+            GOOGLE_MODEL,
+            prompt,
+            temperature=0.6,
+            max_tokens=MAX_TOKENS.get(GOOGLE_MODEL, FALLBACK_MAX_TOKENS),
+            stall_timeout=ANALYSIS_STREAM_STALL,
+            extra_config={"responseModalities": ["TEXT"]},
+        ):
+            text += chunk
+            on_text(format_ai_response(text))
+    except (httpx.HTTPError, StreamError, ValueError, Overloaded) as e:
+        if text:
+            print(f"Поток аналитики прерван: {e!r}")
+            _streams["stalled"].inc()
+            return fallback_analysis(stats, ticker)
+        print(f"Поток аналитики не начался: {e!r}")
+
+    if not text:
+        _streams["failed"].inc()
+        analysis = await flights.do(
+            ("analysis", cache_key),
+            _request_analysis,
+            prompt,
+            cache_key,
+        )
+        return analysis or fallback_analysis(stats, ticker)
+
+    _streams["ok"].inc()
+    analysis = format_ai_response(text)
+    analysis_cache.set(cache_key, analysis)
+    return analysis
+
+
+# Фоновый прогрев кэша аналитики: все тикеры x типовые периоды.
+# Параллельность ограничена, чтобы не выбирать квоту Gemini.
+async def prewarm_analysis_cache(tickers, periods):
+    if not GOOGLE_API_KEY:
+        return 0
+
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(ANALYSIS_PREWARM_CONCURRENCY)
+    warmed = 0
+
+    async def warm(ticker, start_date, end_date):
+        nonlocal warmed
+        async with semaphore:
+            await generate_ai_analysis(ticker, start_date, end_date)
+            warmed += 1
+
+    await asyncio.gather(
+        *(
+            warm(ticker, start_date, end_date)
+            for ticker in tickers
+            for start_date, end_date in periods
+        )
+    )
+    print(
+        f"Кэш аналитики прогрет: {warmed} запросов за "
+        f"{time.perf_counter() - started:.1f} с"
+    )
+    return warmed
+
+
 def format_ai_response(text):
     cleaned_text = text.strip()
     if '```' in cleaned_text:
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from chart_cache import chart_cache
+from chart_generator import CHART_STYLE, generate_stock_chart
+from price_store import get_store
+from stats_calculator import calculate_stock_stats, format_stats_message
+
+# Таблица готовых ответов: данные статичны, а типовых периодов
+# (месяцы, кварталы, полугодия, год) конечное число, поэтому
+# статистику и текст ответа для каждой пары (тикер, период) можно
+# посчитать при старте. Горячие запросы — поиск в словаре.
+# Включается на развертывании: время сборки и объем печатаются в лог.
+ANSWER_TABLE = os.getenv("ANSWER_TABLE", "0") == "1"
+# Графики (PNG) кладутся в chart_cache: ~60 КБ на пару, поэтому
+# CHART_CACHE_ITEMS должен вмещать все пары
+ANSWER_TABLE_CHARTS = os.getenv("ANSWER_TABLE_CHARTS", "0") == "1"
+ANSWER_TABLE_WORKERS = (
+    int(os.getenv("ANSWER_TABLE_WORKERS", "0")) or os.cpu_count() or 1
+)
+
+
+class AnswerEntry:
+    __slots__ = ("stats", "text")
+
+    def __init__(self, stats, text):
+        self.stats = stats
+        self.text = text
+
+
+# Ответы одного тикера по всем периодам (выполняется в процессе пула)
+def _build_ticker(ticker, periods, charts):
+    entries = []
+    for start_date, end_date in periods:
+        stats, _ = calculate_stock_stats(ticker, start_date, end_date)
+        if not stats:
+            continue
+        png = None
+        if charts:
+            png, _ = generate_stock_chart(ticker, start_date, end_date)
+        entries.append((
+            start_date,
+            end_date,
+            stats,
+            format_stats_message(stats, ticker),
+            png,
+        ))
+    return ticker, entries
+
+
+class AnswerTable:
+
+    def __init__(self):
+        self._entries: dict[tuple, AnswerEntry] = {}
+        self.report: dict = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(ticker, start_date, end_date) -> tuple:
+        return str(ticker).strip().upper(), str(start_date), str(end_date)
+
+    def lookup(self, ticker, start_date, end_date) -> AnswerEntry | None:
+        return self._entries.get(self.make_key(ticker, start_date, end_date))
+
+    # Сборка по всем тикерам хранилища параллельно по процессам (по
+    # тикеру на задачу). Возвращает отчет: время, число ответов и
+    # объем в памяти.
+    def build(
+        self,
+        periods,
+        charts: bool = ANSWER_TABLE_CHARTS,
+        workers: int = ANSWER_TABLE_WORKERS,
+    ) -> dict:
+        started = time.perf_counter()
+        # Хранилище открываем до fork — процессы наследуют отображение
+        tickers = get_store().tickers
+        periods = list(periods)
+
+        if workers > 1:
+            context = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(workers, mp_context=context) as pool:
+                results = list(pool.map(
+                    _build_ticker,
+                    tickers,
+                    [periods] * len(tickers),
+                    [charts] * len(tickers),
+                ))
+        else:
+            results = [
+                _build_ticker(ticker, periods, charts) for ticker in tickers
+            ]
+
+        stats_bytes = text_bytes = chart_bytes = 0
+        for ticker, entries in results:
+            for start_date, end_date, stats, text, png in entries:
+                key = self.make_key(ticker, start_date, end_date)
+                self._entries[key] = AnswerEntry(stats, text)
+                stats_bytes += len(pickle.dumps(stats))
+                text_bytes += len(text.encode("utf-8"))
+                if png:
+                    chart_cache.put(
+                        chart_cache.make_key(
+                            ticker,
+                            start_date,
+                            end_date,
+                            CHART_STYLE,
+                        ),
+                        png,
+                    )
+                    chart_bytes += len(png)
+
+        self.report = {
+            'answers': len(self._entries),
+            'tickers': len(tickers),
+            'periods': len(periods),
+            'charts': charts,
+            'workers': workers,
+            'seconds': round(time.perf_counter() - started, 3),
+            'stats_bytes': stats_bytes,
+            'text_bytes': text_bytes,
+            'chart_bytes': chart_bytes,
+        }
+        return self.report
+
+
+answer_table = AnswerTable()
+
+
+# Оценка для развертывания: python answer_table.py [--charts]
+def main():
+    from google_parser import CANONICAL_PERIODS
+
+    parser = argparse.ArgumentParser(description="Таблица готовых ответов")
+    parser.add_argument("--charts", action="store_true")
+    parser.add_argument("--workers", type=int, default=ANSWER_TABLE_WORKERS)
+    args = parser.parse_args()
+
+    report = answer_table.build(CANONICAL_PERIODS, args.charts, args.workers)
+    for name, value in report.items():
+        print(f"{name}: {value}")
+
+
+if __name__ == "__main__":
+    main()
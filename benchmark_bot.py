@@ -0,0 +1,286 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import re
+import resource
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from gemini_stub import BATCH_LINE_RE, GeminiStubServer
+from telegram_stub import TelegramStubServer, fake_update
+
+# Сквозной бенчмарк бота: сообщения из корпуса в виде настоящих
+# telegram.Update проходят через handle_message, ответы уходят в
+# заглушку Bot API, запросы к модели — в заглушку Gemini с заданной
+# задержкой и долей ошибок. Печатает p50/p95/p99 по типам запросов,
+# пропускную способность при N одновременных чатах и память.
+# Запуск: python benchmark_bot.py --chats 16 --rounds 3 --latency-ms 300
+# С --json PATH результат сохраняется как базовая линия для сравнения.
+
+CORPUS_PATH = "query_corpus.txt"
+REQUEST_TYPES = ("graph", "stats", "analysis", "unknown")
+
+_USER_MESSAGE_RE = re.compile(r'Пользователь говорит: "(?P<text>.*)"\.')
+
+
+# Ответ заглушки Gemini: разбор запроса — результат матчера на
+# правилах (как ответила бы модель), аналитика — короткий текст
+def echo_responder(model, payload):
+    from query_matcher import match_query
+
+    prompt = "".join(
+        part.get("text", "")
+        for content in payload.get("contents", [])
+        for part in content.get("parts", [])
+    )
+    found = _USER_MESSAGE_RE.search(prompt)
+    if "JSON-массивом" in prompt:
+        text = json.dumps(
+            [
+                {"id": int(line["id"]), **match_query(line["text"]).as_dict()}
+                for line in BATCH_LINE_RE.finditer(prompt)
+            ],
+            ensure_ascii=False,
+        )
+    elif found:
+        text = json.dumps(
+            match_query(found.group("text")).as_dict(),
+            ensure_ascii=False,
+        )
+    else:
+        text = f"Заглушка {model}: тренд, риски, активность, вывод."
+    return 200, {
+        "candidates": [
+            {
+                "content": {"role": "model", "parts": [{"text": text}]},
+                "finishReason": "STOP",
+            }
+        ]
+    }
+
+
+def load_corpus(path: str) -> list[str]:
+    with open(path, encoding="utf-8") as corpus:
+        return [line.strip() for line in corpus if line.strip()]
+
+
+# Тип запроса для отчета — по разбору на правилах
+def request_kind(text: str) -> str:
+    from query_matcher import MULTI_TICKER_TYPES, match_query
+
+    match = match_query(text)
+    if match.request_type in MULTI_TICKER_TYPES:
+        return match.request_type
+    if not match.tickers or not match.start_date:
+        return "unknown"
+    return match.request_type
+
+
+def percentiles(values) -> dict:
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+    return {
+        "count": len(values),
+        "p50_ms": round(p50, 1),
+        "p95_ms": round(p95, 1),
+        "p99_ms": round(p99, 1),
+    }
+
+
+def _rss_mb(who) -> float:
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+async def run_load(messages, chats: int, telegram_base: str):
+    # Импорт после настройки окружения: модули читают его при импорте
+    import bot as bot_module
+    from telegram import Bot, Update
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    telegram = Bot(
+        "123456:benchmark",
+        base_url=f"{telegram_base}/bot",
+        base_file_url=f"{telegram_base}/file/bot",
+    )
+    await telegram.initialize()
+
+    kinds = {text: request_kind(text) for text in set(messages)}
+    latencies = defaultdict(list)
+    errors = 0
+
+    # Сообщения одного чата идут последовательно, как от пользователя
+    async def chat(chat_id: int, texts):
+        nonlocal errors
+        for update_id, text in texts:
+            update = Update.de_json(
+                fake_update(update_id, chat_id, text),
+                telegram,
+            )
+            started = time.perf_counter()
+            try:
+                await bot_module.handle_message(update, None)
+            except Exception as e:
+                errors += 1
+                print(f"Ошибка обработки '{text}': {e}", file=sys.stderr)
+            latencies[kinds[text]].append(time.perf_counter() - started)
+
+    by_chat = defaultdict(list)
+    for i, text in enumerate(messages):
+        by_chat[i % chats + 1].append((i + 1, text))
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(chat(chat_id, texts) for chat_id, texts in by_chat.items())
+    )
+    elapsed = time.perf_counter() - started
+
+    await telegram.shutdown()
+    await bot_module.close_client()
+    bot_module.executor.shutdown(wait=True)
+    return latencies, elapsed, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк бота")
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--chats", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--jitter-ms", type=float, default=100.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--tg-latency-ms", type=float, default=0.0)
+    parser.add_argument(
+        "--tg-flood-rate",
+        type=int,
+        help="сообщений в секунду на чат до ответа 429 (флуд-контроль)",
+    )
+    parser.add_argument(
+        "--llm-parse",
+        action="store_true",
+        help="разбирать все сообщения через модель",
+    )
+    parser.add_argument(
+        "--parse-batch-ms",
+        help="окно пакетного разбора (PARSE_BATCH_WINDOW_MS, 0 — выкл.)",
+    )
+    parser.add_argument("--json", help="сохранить результат в файл")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    gemini = GeminiStubServer(
+        responder=echo_responder,
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    ).start()
+    telegram = TelegramStubServer(
+        latency=args.tg_latency_ms / 1000,
+        flood_chat_rate=args.tg_flood_rate,
+    ).start()
+
+    # Кэши только в памяти, без подавления повторов и лимита чатов:
+    # каждый прогон начинается с холодного состояния. Расчеты — в пуле
+    # процессов: воркеров очереди задач бенчмарк не запускает, и с
+    # CPU_BACKEND=queue из .env запросы ждали бы их до таймаута.
+    os.environ.update({
+        "CPU_BACKEND": "pool",
+        "BOT_TOKEN": "123456:benchmark",
+        "GOOGLE_API_KEY": "benchmark",
+        "GOOGLE_API_BASE": gemini.base_url,
+        "PARSE_CACHE_DB": "",
+        "ANALYSIS_CACHE_DB": "",
+        "CHART_CACHE_DIR": "",
+        "CHAT_DEBOUNCE_SECONDS": "0",
+        "CHAT_RATE_PER_MIN": "0",
+    })
+    if args.llm_parse:
+        os.environ["LOCAL_PARSE_THRESHOLD"] = "2"
+    if args.parse_batch_ms is not None:
+        os.environ["PARSE_BATCH_WINDOW_MS"] = args.parse_batch_ms
+
+    messages = load_corpus(args.corpus) * args.rounds
+    # Отладочный вывод модулей бота не смешиваем с отчетом
+    output = sys.stdout if args.verbose else io.StringIO()
+    with contextlib.redirect_stdout(output):
+        latencies, elapsed, errors = asyncio.run(
+            run_load(messages, args.chats, telegram.base_url)
+        )
+    gemini.stop()
+    telegram.stop()
+
+    import metrics
+
+    routes = {
+        name: value
+        for name, value in metrics.snapshot().items()
+        if name.startswith(
+            ("parse_route", "overload", "circuit", "outbox_")
+        )
+    }
+    all_latencies = [
+        value for values in latencies.values() for value in values
+    ]
+    result = {
+        "messages": len(messages),
+        "chats": args.chats,
+        "gemini_latency_ms": args.latency_ms,
+        "gemini_error_rate": args.error_rate,
+        "seconds": round(elapsed, 3),
+        "throughput_per_s": round(len(messages) / elapsed, 2),
+        "errors": errors,
+        "all": percentiles(all_latencies),
+        "types": {
+            kind: percentiles(latencies[kind])
+            for kind in (*REQUEST_TYPES, *sorted(latencies))
+            if latencies.get(kind)
+        },
+        "gemini_requests": len(gemini.requests_log),
+        "telegram_calls": len(telegram.calls),
+        "telegram_flood_errors": telegram.flood_errors,
+        "parse_routes": routes,
+        "max_rss_mb": round(_rss_mb(resource.RUSAGE_SELF), 1),
+        "children_max_rss_mb": round(_rss_mb(resource.RUSAGE_CHILDREN), 1),
+    }
+
+    print(
+        f"Сообщений: {result['messages']}, чатов: {args.chats}, "
+        f"Gemini {args.latency_ms:.0f}±{args.jitter_ms:.0f} мс, "
+        f"ошибок Gemini {args.error_rate:.0%}"
+    )
+    print(
+        f"Время: {result['seconds']:.2f} с, пропускная способность: "
+        f"{result['throughput_per_s']:.1f} сообщ./с, ошибок: {errors}"
+    )
+    print(f"{'тип':<10}{'n':>6}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for kind, row in {"all": result["all"], **result["types"]}.items():
+        print(
+            f"{kind:<10}{row['count']:>6}{row['p50_ms']:>10.1f}"
+            f"{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}"
+        )
+    print(
+        f"Запросов к Gemini: {result['gemini_requests']}, "
+        f"вызовов Bot API: {result['telegram_calls']}, "
+        f"отклонено с 429: {result['telegram_flood_errors']}"
+    )
+    print(f"Пути разбора и отказы: {routes}")
+    print(
+        f"Пик RSS: {result['max_rss_mb']:.1f} МБ (бот), "
+        f"{result['children_max_rss_mb']:.1f} МБ (процессы пула)"
+    )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as output:
+            json.dump(result, output, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import argparse
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # noqa: E402
+import numpy as np  # noqa: E402
+
+from chart_generator import generate_stock_chart, lttb  # noqa: E402
+from price_store import get_store  # noqa: E402
+
+# Бенчмарк рендера графиков: прежний pyplot-вариант против шаблонного
+# Figure/Agg. Запуск: python benchmark_charts.py --renders 50
+
+RANGES = [
+    ("AAPL", "2024-03-01", "2024-03-31"),
+    ("NVDA", "2024-01-01", "2024-06-30"),
+    ("MSFT", "2024-01-01", "2024-12-31"),
+    ("ZM", "2024-07-01", "2024-09-30"),
+]
+
+
+# Прежняя реализация (pyplot, tight_layout, bbox_inches='tight')
+def legacy_chart(ticker, start_date, end_date):
+    prices = get_store().range(ticker, start_date, end_date)
+    dates = prices.dates.astype('datetime64[D]')
+
+    plt.figure(figsize=(12, 6))
+    plt.plot(
+        dates,
+        prices.close,
+        linewidth=2,
+        color='blue',
+        marker='o',
+        markersize=3,
+    )
+    plt.title(
+        f'Цены акций {ticker} ({start_date} - {end_date})',
+        fontsize=14,
+        fontweight='bold',
+    )
+    plt.xlabel('Дата')
+    plt.ylabel('Цена закрытия ($)')
+    plt.grid(True, alpha=0.3)
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+
+    buffer = io.BytesIO()
+    plt.savefig(buffer, format='png', dpi=100, bbox_inches='tight')
+    plt.close()
+    return buffer.getvalue()
+
+
+def _renders_per_second(render, renders, threads=1):
+    jobs = [RANGES[i % len(RANGES)] for i in range(renders)]
+    render(*jobs[0])  # прогрев шрифтов и шаблона
+
+    started = time.perf_counter()
+    if threads == 1:
+        for job in jobs:
+            render(*job)
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(lambda job: render(*job), jobs))
+    return renders / (time.perf_counter() - started)
+
+
+def _lttb_per_second(points, threshold, repeats=200):
+    x = np.arange(points, dtype=np.float64)
+    y = np.cumsum(np.random.default_rng(0).normal(size=points))
+    started = time.perf_counter()
+    for _ in range(repeats):
+        lttb(x, y, threshold)
+    return repeats / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--renders", type=int, default=40)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    get_store()
+
+    def new_chart(*job):
+        return generate_stock_chart(*job)[0]
+
+    before = _renders_per_second(legacy_chart, args.renders)
+    after = _renders_per_second(new_chart, args.renders)
+    threaded = _renders_per_second(new_chart, args.renders, args.threads)
+
+    print(f"pyplot (до):               {before:8.1f} рендеров/с")
+    print(f"Figure/Agg шаблон (после): {after:8.1f} рендеров/с")
+    print(
+        f"Figure/Agg, {args.threads} потока:      "
+        f"{threaded:8.1f} рендеров/с"
+    )
+    print(f"Ускорение:                 {after / before:8.2f}x")
+    print(
+        f"LTTB 10000 -> 500 точек:   "
+        f"{_lttb_per_second(10000, 500):8.1f} вызовов/с"
+    )
+
+
+if __name__ == "__main__":
+    main()
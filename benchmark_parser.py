@@ -0,0 +1,134 @@
+import argparse
+import time
+
+from google_parser import fallback_parser
+
+# Микробенчмарк парсера на правилах: прежние подстрочные проверки
+# против предкомпилированного матчера на корпусе реальных сообщений.
+# Запуск: python benchmark_parser.py --repeats 2000
+
+CORPUS_PATH = "query_corpus.txt"
+
+
+# Прежняя реализация fallback_parser (словари пересоздаются на каждый
+# вызов, отдельная проверка `in` на каждый алиас и месяц)
+def legacy_fallback_parser(user_message):
+    companies = {
+        'apple': 'AAPL', 'эпл': 'AAPL',
+        'microsoft': 'MSFT', 'майкрософт': 'MSFT',
+        'google': 'GOOGL', 'гугл': 'GOOGL',
+        'nvidia': 'NVDA', 'нвидиа': 'NVDA',
+        'amd': 'AMD', 'амд': 'AMD',
+        'adobe': 'ADBE', 'адоб': 'ADBE',
+        'cisco': 'CSCO', 'циско': 'CSCO',
+        'salesforce': 'CRM',
+        'uber': 'UBER', 'убер': 'UBER',
+        'zoom': 'ZM', 'зум': 'ZM',
+        'logitech': 'LOGI', 'лоджитек': 'LOGI',
+        'philips': 'PHG', 'филипс': 'PHG',
+        'zi': 'ZI'
+    }
+
+    lower_msg = user_message.lower()
+    ticker = None
+    for company, tkr in companies.items():
+        if company in lower_msg:
+            ticker = tkr
+            break
+
+    start_date, end_date = None, None
+
+    months = {
+        'январ': ('2024-01-01', '2024-01-31'),
+        'феврал': ('2024-02-01', '2024-02-29'),
+        'март': ('2024-03-01', '2024-03-31'),
+        'апрел': ('2024-04-01', '2024-04-30'),
+        'май': ('2024-05-01', '2024-05-31'),
+        'июн': ('2024-06-01', '2024-06-30'),
+        'июл': ('2024-07-01', '2024-07-31'),
+        'август': ('2024-08-01', '2024-08-31'),
+        'сентябр': ('2024-09-01', '2024-09-30'),
+        'октябр': ('2024-10-01', '2024-10-31'),
+        'ноябр': ('2024-11-01', '2024-11-30'),
+        'декабр': ('2024-12-01', '2024-12-31')
+    }
+
+    for month_name, (start, end) in months.items():
+        if month_name in lower_msg:
+            start_date, end_date = start, end
+            break
+
+    if 'перв' in lower_msg and 'полугоди' in lower_msg:
+        start_date, end_date = "2024-01-01", "2024-06-30"
+    elif 'втор' in lower_msg and 'полугоди' in lower_msg:
+        start_date, end_date = "2024-07-01", "2024-12-31"
+    elif '1 квартал' in lower_msg or 'первый квартал' in lower_msg:
+        start_date, end_date = "2024-01-01", "2024-03-31"
+    elif '2 квартал' in lower_msg or 'второй квартал' in lower_msg:
+        start_date, end_date = "2024-04-01", "2024-06-30"
+
+    if start_date is None:
+        start_date, end_date = "2024-01-01", "2024-12-31"
+
+    request_type = "unknown"
+    if any(word in lower_msg for word in ['график', 'покажи']):
+        request_type = "graph"
+    elif 'анализ' in lower_msg or 'аналитика' in lower_msg:
+        request_type = "analysis"
+    elif 'статистик' in lower_msg:
+        request_type = "stats"
+
+    return {
+        "ticker": ticker,
+        "start_date": start_date,
+        "end_date": end_date,
+        "request_type": request_type
+    }
+
+
+def load_corpus(path=CORPUS_PATH):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def _messages_per_second(parser, corpus, repeats):
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for message in corpus:
+            parser(message)
+    return repeats * len(corpus) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeats", type=int, default=1000)
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument(
+        "--diff",
+        action="store_true",
+        help="показать сообщения, где результаты расходятся",
+    )
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    before = _messages_per_second(
+        legacy_fallback_parser, corpus, args.repeats
+    )
+    after = _messages_per_second(fallback_parser, corpus, args.repeats)
+
+    print(f"Сообщений в корпусе: {len(corpus)}")
+    print(f"Подстрочные проверки (до): {before:10.0f} сообщений/с")
+    print(f"Компилированный матчер:    {after:10.0f} сообщений/с")
+    print(f"Ускорение:                 {after / before:10.2f}x")
+
+    if args.diff:
+        for message in corpus:
+            old = legacy_fallback_parser(message)
+            # Сравниваем только поля, которые умел старый парсер
+            new = {key: fallback_parser(message)[key] for key in old}
+            if old != new:
+                print(f"\n{message}\n  до:    {old}\n  после: {new}")
+
+
+if __name__ == "__main__":
+    main()
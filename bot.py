@@ -1,10 +1,12 @@
+import asyncio
+import json
 import logging
 import os
-import sqlite3
+import time
 
-import pandas as pd
 from dotenv import load_dotenv
 from telegram import Update
+from telegram.error import BadRequest, TelegramError
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -13,9 +15,38 @@ from telegram.ext import (
     filters,
 )
 
-from ai_analyzer import generate_ai_analysis
-from chart_generator import generate_stock_chart
-from google_parser import parse_with_google_ai
+from ai_analyzer import generate_ai_analysis, prewarm_analysis_cache
+from answer_table import ANSWER_TABLE, answer_table
+from chart_cache import chart_cache
+from chart_generator import (
+    CHART_STYLE,
+    chart_caption,
+    comparison_caption,
+    generate_comparison_chart,
+    generate_stock_chart,
+)
+from comparison import (
+    DEFAULT_TOP_N,
+    compare_stocks,
+    format_comparison_message,
+)
+from db_bootstrap import bootstrap_database
+from executor import executor
+from job_queue import JOB_QUEUE_DB, JobQueue
+import metrics
+from gemini_client import close_client
+import overload
+from outbox import outbox
+from google_parser import (
+    CANONICAL_PERIODS,
+    parse_cache,
+    parse_with_google_ai,
+)
+from price_store import get_store
+from request_context import RequestContext
+from singleflight import ChatGate, flights
+from webhook_server import METRICS_PORT, run_webhook, start_metrics_server
+from worker import WorkerPool, maintain_queue
 from stats_calculator import calculate_stock_stats, format_stats_message
 
 
@@ -27,29 +58,56 @@ logging.basicConfig(
 load_dotenv()
 
 BOT_TOKEN = os.getenv('BOT_TOKEN')
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '64'))
+ANALYSIS_PREWARM = os.getenv('ANALYSIS_PREWARM', '0') == '1'
+# SQLite-база stocks.db (для внешних выгрузок и отладки): ответы бота
+# ее не читают — цены берутся из prices.bin, — поэтому по умолчанию
+# при старте она не собирается
+STOCKS_DB_BOOTSTRAP = os.getenv('STOCKS_DB_BOOTSTRAP', '0') == '1'
+# Потоковая аналитика: сообщение-заглушка редактируется по мере
+# генерации, не чаще раза в ANALYSIS_EDIT_INTERVAL секунд
+ANALYSIS_STREAM = os.getenv('ANALYSIS_STREAM', '0') == '1'
+ANALYSIS_EDIT_INTERVAL = float(os.getenv('ANALYSIS_EDIT_INTERVAL', '1.0'))
+# Предел длины текста сообщения Telegram
+MESSAGE_LIMIT = 4096
+# polling — getUpdates (одна реплика), webhook — HTTP-прием обновлений
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Адрес Bot API (для локальной заглушки telegram_stub.py)
+TELEGRAM_API_BASE = os.getenv('TELEGRAM_API_BASE')
+# Сколько воркеров очереди задач запускать вместе с ботом при
+# CPU_BACKEND=queue (0 — воркеры запущены отдельно: python worker.py)
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', str(executor.cpu_workers)))
+
+chat_gate = ChatGate()
+chat_limiter = overload.ChatLimiter()
 
 if not BOT_TOKEN:
     logging.error("BOT_TOKEN не найден в переменных окружения")
 
 
-# Инициализирую базы данных
+# Проверяю CSV с данными; stocks.db собирается только при
+# STOCKS_DB_BOOTSTRAP=1 (пересборка только при изменении CSV)
 def init_database():
     data_path = "tech_stocks_2024_cleaned.csv"
     
     if not os.path.exists(data_path):
         logging.error(f"CSV с данными не найден: {data_path}")
         raise FileNotFoundError(f"Не найден файл данных: {data_path}")
-
-    conn = sqlite3.connect('stocks.db')
-    df = pd.read_csv(data_path)
-    df.to_sql('stock_prices', conn, if_exists='replace', index=False)
-    conn.close()
-    print("База данных создана")
+    if not STOCKS_DB_BOOTSTRAP:
+        return
+
+    summary = bootstrap_database(data_path)
+    logging.info(
+        f"База данных готова: {summary['action']}, "
+        f"строк загружено {summary['rows']}, "
+        f"{summary['seconds'] * 1000:.1f} мс"
+    )
 
 
 # Команда /start
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
+    await outbox.reply_text(
+        update.message,
         "Привет! Я бот для анализа акций технологических компаний за "
         "2024 год! 📈\n\n"
         "Для начала напиши запрос, например:\n"
@@ -61,114 +119,429 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # Команда /help
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
+    await outbox.reply_text(
+        update.message,
         "Я понимаю запросы на естественном языке:\n"
         "• График [компания] за [период]\n"
         "• Анализ [компания] за [период]\n"
-        "• Статистика [компания] за [период]\n\n"
+        "• Статистика [компания] за [период]\n"
+        "• Сравни [компании] за [период]\n"
+        "• Топ-5 по росту за [период]\n\n"
         "Пример: 'Покажи график Apple за март 2024'"
     )
 
-# Формирование ответа на запрос
+# Отправка графика: повторные запросы обслуживаются по Telegram file_id
+# или из кэша PNG, отрисовка — только при промахе
+async def send_chart(update: Update, ticker, start_date, end_date):
+    await send_cached_chart(
+        update,
+        chart_cache.make_key(ticker, start_date, end_date, CHART_STYLE),
+        chart_caption(ticker, start_date, end_date),
+        generate_stock_chart,
+        ticker,
+        start_date,
+        end_date,
+    )
+
+
+async def send_cached_chart(update: Update, key, caption, render, *args):
+    file_id = chart_cache.get_file_id(key)
+    if file_id:
+        try:
+            with metrics.span('upload', source='file_id'):
+                await outbox.reply_photo(update.message, file_id, caption)
+            return
+        except BadRequest as e:
+            logging.warning(f"file_id графика устарел: {e}")
+            chart_cache.forget_file_id(key)
+
+    png = chart_cache.get(key)
+    if png is None:
+        # Вместо сообщения "Строю график..." — статус в шапке чата
+        outbox.chat_action(update.message, "upload_photo")
+        # Одновременные запросы того же графика ждут одну отрисовку
+        with metrics.span('chart'):
+            png, chart_message = await flights.do(
+                ('chart', key),
+                executor.run_cpu,
+                'chart',
+                render,
+                *args,
+            )
+        if not png:
+            outbox.reply_text(update.message, f"❌ {chart_message}")
+            return
+        chart_cache.put(key, png)
+
+    with metrics.span('upload', source='png'):
+        message = await outbox.reply_photo(update.message, png, caption)
+    if message.photo:
+        chart_cache.set_file_id(key, message.photo[-1].file_id)
+
+
+# Сравнение нескольких тикеров (или топ по всем тикерам): рейтинг
+# одним векторным проходом по матрице цен (в потоке, как статистика)
+# и общий график
+async def send_comparison(update: Update, ctx: RequestContext):
+    start_date = ctx.start_date
+    end_date = ctx.end_date
+    limit = None
+    if ctx.request_type == 'top':
+        limit = ctx.top_n or DEFAULT_TOP_N
+    tickers = tuple(ctx.tickers)
+
+    with metrics.span('compare'):
+        rows, message = await flights.do(
+            ('compare', tickers, start_date, end_date, ctx.rank_by, limit),
+            executor.run_io,
+            'stats',
+            compare_stocks,
+            tickers,
+            start_date,
+            end_date,
+            ctx.rank_by,
+            limit,
+        )
+    if not rows:
+        outbox.reply_text(update.message, message)
+        return
+    # Текст уходит в фоне, пока готовится график
+    outbox.reply_text(
+        update.message,
+        format_comparison_message(rows, start_date, end_date, ctx.rank_by),
+    )
+
+    names = [row['ticker'] for row in rows]
+    await send_cached_chart(
+        update,
+        chart_cache.make_key(
+            'compare:' + ','.join(names),
+            start_date,
+            end_date,
+            CHART_STYLE,
+        ),
+        comparison_caption(names, start_date, end_date),
+        generate_comparison_chart,
+        names,
+        start_date,
+        end_date,
+    )
+
+
+# Статистика запроса (считается один раз на сообщение и один раз на
+# все одновременные сообщения с тем же тикером и периодом). Типовые
+# периоды берутся из таблицы готовых ответов, если она собрана.
+# Расчет — поиск по индексу, поэтому идет в потоке (run_io), а не в
+# пуле процессов: сериализация дороже самого расчета. Пул процессов
+# остается для отрисовки графиков.
+async def get_request_stats(ctx: RequestContext):
+    entry = answer_table.lookup(ctx.ticker, ctx.start_date, ctx.end_date)
+    if entry is not None:
+        ctx.set('stats_text', entry.text)
+        return entry.stats, "✅ Статистика рассчитана"
+    with metrics.span('stats'):
+        return await ctx.artifact(
+            'stats',
+            lambda: flights.do(
+                ('stats', ctx.ticker, ctx.start_date, ctx.end_date),
+                executor.run_io,
+                'stats',
+                calculate_stock_stats,
+                ctx.ticker,
+                ctx.start_date,
+                ctx.end_date,
+            ),
+        )
+
+
+# Сообщение, которое дописывается по мере генерации текста: правки
+# идут в фоне не чаще interval секунд, промежуточные тексты между
+# правками пропускаются (в Telegram уходит только последний). message —
+# отправка из очереди outbox; повторы после RetryAfter делает очередь.
+class StreamingReply:
+
+    def __init__(self, message, interval: float = ANALYSIS_EDIT_INTERVAL):
+        self.message = message
+        self.interval = interval
+        self._text = None
+        self._sent = None
+        self._next_edit = 0.0
+        self._editing = False
+        self._task: asyncio.Task | None = None
+
+    def update(self, text: str):
+        self._text = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        loop = asyncio.get_running_loop()
+        delay = self._next_edit - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self._edit(self._text + " ▌")
+
+    async def _edit(self, text: str):
+        text = text[:MESSAGE_LIMIT]
+        if text == self._sent:
+            return
+        loop = asyncio.get_running_loop()
+        self._editing = True
+        try:
+            await outbox.edit_text(self.message, text)
+            self._sent = text
+        except TelegramError as e:
+            logging.warning(f"Не удалось обновить сообщение: {e}")
+        finally:
+            self._next_edit = loop.time() + self.interval
+            self._editing = False
+
+    # Итоговый текст: ожидающая правка отменяется, начатая —
+    # дожидается, чтобы не перезаписать итог
+    async def finish(self, text: str):
+        if self._task is not None and not self._task.done():
+            if self._editing:
+                await self._task
+            else:
+                self._task.cancel()
+        await self._edit(text)
+
+
+# AI-аналитика заменяет текст сообщения-заглушки: при ANALYSIS_STREAM
+# по мере генерации, иначе — целиком. Если заглушка еще в очереди,
+# вместо нее сразу уходит готовый текст.
+async def send_analysis(update: Update, ctx: RequestContext, stats):
+    placeholder = outbox.reply_text(
+        update.message,
+        "🧠 Генерирую AI-аналитику...",
+    )
+    streaming = StreamingReply(placeholder) if ANALYSIS_STREAM else None
+
+    analysis_budget = stage_deadline(ctx, overload.ANALYSIS_BUDGET_SECONDS)
+    with metrics.span('analysis'), analysis_budget:
+        analysis_text = await executor.run_io(
+            'analysis',
+            generate_ai_analysis,
+            ctx.ticker,
+            ctx.start_date,
+            ctx.end_date,
+            stats=stats,
+            on_text=streaming.update if streaming else None,
+        )
+    ctx.set('analysis', analysis_text)
+    if streaming:
+        await streaming.finish(analysis_text)
+    else:
+        outbox.edit_text(placeholder, analysis_text)
+
+
+# Текст статистики: готовый из таблицы ответов или форматированный
+def request_stats_text(ctx: RequestContext, stats):
+    return ctx.get('stats_text') or format_stats_message(stats, ctx.ticker)
+
+
+# Входящее сообщение: повтор того же запроса в чате в течение окна
+# отбрасывается, сверх лимита сообщений чата — короткий отказ,
+# одновременно обрабатывается ограниченное число сообщений одного чата
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    arrived = time.perf_counter()
     user_message = update.message.text
+    chat_id = update.effective_chat.id
+    message_key = parse_cache.normalize(user_message)
+
+    if chat_gate.is_duplicate(chat_id, message_key):
+        logging.info(f"Повтор запроса в чате {chat_id} пропущен")
+        return
+    if not chat_limiter.allow(chat_id):
+        logging.info(f"Лимит сообщений в чате {chat_id}")
+        outbox.reply_text(
+            update.message,
+            "⏳ Слишком много запросов, попробуй через минуту",
+        )
+        return
+
+    async with chat_gate.slot(chat_id):
+        # Ожидание слота чата тоже входит в бюджеты и длительность
+        ctx = RequestContext(user_message, chat_id, arrived)
+        status = 'ok'
+        with metrics.collect_spans() as spans:
+            try:
+                await answer_message(update, ctx, message_key)
+                # Ответы уходят в фоне; запрос завершен, когда доставлены
+                with metrics.span('deliver'):
+                    await outbox.drain(chat_id)
+            except Exception:
+                status = 'error'
+                raise
+            finally:
+                log_request(ctx, spans, status)
+
+
+# Итог запроса: гистограмма полной длительности по типу и одна
+# структурированная строка лога с таймингами этапов
+def log_request(ctx: RequestContext, spans, status):
+    elapsed = ctx.elapsed()
+    metrics.histogram(
+        'request_seconds',
+        type=ctx.request_type,
+        status=status,
+    ).observe(elapsed)
+    logging.info(json.dumps(
+        {
+            'event': 'request',
+            'chat_id': ctx.chat_id,
+            'type': ctx.request_type,
+            'ticker': ctx.ticker,
+            'status': status,
+            'ms': round(elapsed * 1000, 1),
+            'spans': spans,
+        },
+        ensure_ascii=False,
+    ))
+
+
+# Крайний срок этапа: бюджет отсчитывается от прихода сообщения, так
+# что ожидание в очередях тоже расходует его
+def stage_deadline(ctx: RequestContext, budget: float):
+    return overload.deadline(time.monotonic() + budget - ctx.elapsed())
 
-    await update.message.reply_chat_action(action="typing")
-    parsed_query = parse_with_google_ai(user_message)
 
-    ticker = parsed_query.get('ticker')
-    start_date = parsed_query.get('start_date')
-    end_date = parsed_query.get('end_date')
-    request_type = parsed_query.get('request_type', 'unknown')
+# Формирование ответа на запрос
+async def answer_message(update: Update, ctx: RequestContext, message_key):
+    user_message = ctx.user_message
+
+    outbox.chat_action(update.message, "typing")
+    parse_budget = stage_deadline(ctx, overload.PARSE_BUDGET_SECONDS)
+    with metrics.span('parse'), parse_budget:
+        parsed = await flights.do(
+            ('parse', message_key),
+            executor.run_io,
+            'parse',
+            parse_with_google_ai,
+            user_message,
+        )
+    ctx.parsed = dict(parsed)
+
+    ticker = ctx.ticker
+    start_date = ctx.start_date
+    end_date = ctx.end_date
+    request_type = ctx.request_type
 
     response = "🤖 Анализирую через AI...\n\n"
     response += f"Тикер: {ticker or 'не указан'}\n"
     response += f"Период: {start_date or '?'} - {end_date or '?'}\n"
     response += f"Тип запроса: {request_type}\n\n"
 
-    if ticker and start_date:
+    if request_type in ('compare', 'top') and start_date:
+        await send_comparison(update, ctx)
+
+    elif ticker and start_date:
         # Для графиков
         if request_type == 'graph':
-            await update.message.reply_text("Строю график...")
-            filename, chart_message = generate_stock_chart(
-                ticker,
-                start_date,
-                end_date,
-            )
-
-            if filename and os.path.exists(filename):
-                with open(filename, 'rb') as photo:
-                    await update.message.reply_photo(
-                        photo=photo,
-                        caption=chart_message,
-                    )
-                os.remove(filename)
-            else:
-                await update.message.reply_text(f"❌ {chart_message}")
-
-        # Для статистики
-        elif request_type == 'stats':
-            stats, stats_message = calculate_stock_stats(
-                ticker,
-                start_date,
-                end_date,
-            )
-            if stats:
-                stats_text = format_stats_message(stats, ticker)
-                await update.message.reply_text(stats_text)
-            else:
-                await update.message.reply_text(f"❌ {stats_message}")
+            await send_chart(update, ticker, start_date, end_date)
 
         # Для аналитики (в начале сводка статистики)
         elif request_type == 'analysis':
-            stats, stats_message = calculate_stock_stats(
-                ticker,
-                start_date,
-                end_date,
-            )
+            stats, stats_message = await get_request_stats(ctx)
             if stats:
 
-                stats_text = format_stats_message(stats, ticker)
-                await update.message.reply_text(stats_text)
-
-                await update.message.reply_chat_action(action="typing")
-                await update.message.reply_text("🧠 Генерирую AI-аналитику...")
-
-                analysis_text = generate_ai_analysis(
-                    ticker,
-                    start_date,
-                    end_date,
-                )
-                await update.message.reply_text(analysis_text)
+                # Сводка уходит в фоне, пока генерируется аналитика
+                stats_text = request_stats_text(ctx, stats)
+                outbox.reply_text(update.message, stats_text)
+                await send_analysis(update, ctx, stats)
             else:
-                await update.message.reply_text(f"❌ {stats_message}")
+                outbox.reply_text(update.message, f"❌ {stats_message}")
 
+        # Для статистики (и по умолчанию)
         else:
-            stats, stats_message = calculate_stock_stats(
-                ticker,
-                start_date,
-                end_date,
-            )
+            stats, stats_message = await get_request_stats(ctx)
             if stats:
-                stats_text = format_stats_message(stats, ticker)
-                await update.message.reply_text(stats_text)
+                stats_text = request_stats_text(ctx, stats)
+                outbox.reply_text(update.message, stats_text)
             else:
-                await update.message.reply_text(f"❌ {stats_message}")
+                outbox.reply_text(update.message, f"❌ {stats_message}")
 
-    elif parsed_query.get('ticker'):
+    elif ctx.ticker:
         response += (
             "✅ Запрос распознан! Уточни что хочешь:\n"
             "• 'график Apple за март'\n"
             "• 'статистика Tesla'\n"
             "• 'анализ NVIDIA'"
         )
-        await update.message.reply_text(response)
+        outbox.reply_text(update.message, response)
     else:
         response += (
             "❌ Укажи компанию: Apple, Microsoft, Google, NVIDIA, AMD, Adobe, "
             "Cisco, Salesforce, Uber, Zoom, Logitech, Philips, ZI"
         )
-        await update.message.reply_text(response)
+        outbox.reply_text(update.message, response)
+
+
+# Обслуживание очереди задач при CPU_BACKEND=queue: упавшие воркеры
+# перезапускаются, их задачи возвращаются в очередь, брошенные строки
+# удаляются
+async def maintain_job_queue(job_workers):
+    queue = JobQueue(JOB_QUEUE_DB)
+    while True:
+        await asyncio.sleep(1)
+        try:
+            restarted, requeued = await asyncio.to_thread(
+                maintain_queue,
+                job_workers,
+                queue,
+            )
+        except Exception as e:
+            logging.error(f"Ошибка обслуживания очереди задач: {e}")
+            continue
+        if restarted or requeued:
+            logging.warning(
+                f"Перезапущено воркеров: {restarted}, "
+                f"возвращено зависших задач: {requeued}"
+            )
+
+
+# Фоновые задачи после старта приложения
+async def post_init(app: Application):
+    if METRICS_PORT:
+        app.bot_data['metrics_server'] = await start_metrics_server()
+        logging.info(f"Метрики: http://127.0.0.1:{METRICS_PORT}/metrics")
+    if ANALYSIS_PREWARM:
+        app.bot_data['prewarm_task'] = asyncio.create_task(
+            prewarm_analysis_cache(get_store().tickers, CANONICAL_PERIODS)
+        )
+    if executor.cpu_backend == 'queue':
+        app.bot_data['job_queue_task'] = asyncio.create_task(
+            maintain_job_queue(app.bot_data.get('job_workers'))
+        )
+
+
+# Остановка пулов исполнения и HTTP-клиента при завершении бота
+async def shutdown_executor(app: Application):
+    for name in ('prewarm_task', 'job_queue_task'):
+        task = app.bot_data.get(name)
+        if task is not None:
+            task.cancel()
+    metrics_server = app.bot_data.get('metrics_server')
+    if metrics_server is not None:
+        metrics_server.close()
+    logging.info(f"Метрики стадий: {executor.snapshot()}")
+    routes = {
+        name: value
+        for name, value in metrics.snapshot().items()
+        if name.startswith((
+            'parse_route',
+            'singleflight',
+            'chat_',
+            'overload',
+            'circuit',
+        ))
+    }
+    logging.info(f"Пути разбора, дедупликация и отказы: {routes}")
+    executor.shutdown(wait=False)
+    job_workers = app.bot_data.get('job_workers')
+    if job_workers is not None:
+        await asyncio.to_thread(job_workers.stop)
+    await close_client()
 
 
 # Основная функция
@@ -180,7 +553,31 @@ def main():
             return
 
         init_database()
-        app = Application.builder().token(BOT_TOKEN).build()
+        # Собираем/открываем бинарный файл цен до старта пулов
+        # процессов, дальше все процессы только отображают его в память
+        get_store()
+        if ANSWER_TABLE:
+            report = answer_table.build(CANONICAL_PERIODS)
+            logging.info(f"Таблица готовых ответов собрана: {report}")
+        job_workers = None
+        if executor.cpu_backend == 'queue' and JOB_WORKERS > 0:
+            job_workers = WorkerPool(JOB_WORKERS)
+            logging.info(f"Запущено воркеров очереди задач: {JOB_WORKERS}")
+        builder = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .concurrent_updates(CONCURRENT_UPDATES)
+            .post_init(post_init)
+            .post_shutdown(shutdown_executor)
+        )
+        if TELEGRAM_API_BASE:
+            builder = builder.base_url(f"{TELEGRAM_API_BASE}/bot")
+            builder = builder.base_file_url(f"{TELEGRAM_API_BASE}/file/bot")
+        if BOT_MODE == 'webhook':
+            # Обновления приходят в наш HTTP-сервер, Updater не нужен
+            builder = builder.updater(None)
+        app = builder.build()
+        app.bot_data['job_workers'] = job_workers
 
         app.add_handler(CommandHandler("start", start_command))
         app.add_handler(CommandHandler("help", help_command))
@@ -188,8 +585,11 @@ def main():
             MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message)
         )
 
-        logging.info("Бот запущен на сервере...")
-        app.run_polling()
+        logging.info(f"Бот запущен на сервере ({BOT_MODE})...")
+        if BOT_MODE == 'webhook':
+            asyncio.run(run_webhook(app))
+        else:
+            app.run_polling()
     except Exception as e:
         logging.error(f"Ошибка запуска бота: {e}")
 
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+
+CHART_CACHE_ITEMS = int(os.getenv("CHART_CACHE_ITEMS", "256"))
+CHART_CACHE_BYTES = int(os.getenv("CHART_CACHE_BYTES", str(64 * 2 ** 20)))
+CHART_CACHE_DIR = os.getenv("CHART_CACHE_DIR")
+
+
+# LRU-кэш отрисованных PNG по ключу (ticker, start, end, style) с
+# ограничением по числу элементов и суммарному размеру. Опционально
+# дублирует PNG на диск, чтобы кэш переживал рестарт. Отдельно хранит
+# Telegram file_id уже загруженных картинок.
+class ChartCache:
+
+    def __init__(
+        self,
+        max_items: int = CHART_CACHE_ITEMS,
+        max_bytes: int = CHART_CACHE_BYTES,
+        disk_dir: str | None = CHART_CACHE_DIR,
+    ):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._items: OrderedDict[tuple, bytes] = OrderedDict()
+        self._file_ids: OrderedDict[tuple, str] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._hits = metrics.counter("chart_cache_hits_total", layer="memory")
+        self._disk_hits = metrics.counter(
+            "chart_cache_hits_total",
+            layer="disk",
+        )
+        self._file_id_hits = metrics.counter(
+            "chart_cache_hits_total",
+            layer="file_id",
+        )
+        self._misses = metrics.counter("chart_cache_misses_total")
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(ticker, start_date, end_date, style) -> tuple:
+        return (
+            str(ticker).strip().upper(),
+            str(start_date),
+            str(end_date),
+            style,
+        )
+
+    def _disk_path(self, key: tuple) -> str:
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, f"{digest}.png")
+
+    def get(self, key: tuple) -> bytes | None:
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+                self._hits.inc()
+                return data
+
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), "rb") as f:
+                    data = f.read()
+            except OSError:
+                data = None
+            if data:
+                self._disk_hits.inc()
+                self._remember(key, data)
+                return data
+
+        self._misses.inc()
+        return None
+
+    def put(self, key: tuple, data: bytes):
+        self._remember(key, data)
+        if self.disk_dir:
+            # Пишем во временный файл и переименовываем атомарно
+            path = self._disk_path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Не удалось сохранить график в кэш: {e}")
+
+    def _remember(self, key: tuple, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._items[key] = data
+            self._size += len(data)
+            while self._items and (
+                len(self._items) > self.max_items
+                or self._size > self.max_bytes
+            ):
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get_file_id(self, key: tuple) -> str | None:
+        with self._lock:
+            file_id = self._file_ids.get(key)
+            if file_id is not None:
+                self._file_ids.move_to_end(key)
+                self._file_id_hits.inc()
+            return file_id
+
+    def set_file_id(self, key: tuple, file_id: str):
+        with self._lock:
+            self._file_ids[key] = file_id
+            self._file_ids.move_to_end(key)
+            while len(self._file_ids) > self.max_items * 4:
+                self._file_ids.popitem(last=False)
+
+    def forget_file_id(self, key: tuple):
+        with self._lock:
+            self._file_ids.pop(key, None)
+
+
+chart_cache = ChartCache()
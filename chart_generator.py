@@ -1,60 +1,265 @@
-import sqlite3
+import io
+import os
+import threading
 
-import matplotlib.pyplot as plt
-import pandas as pd
+import matplotlib.dates as mdates
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 
+from comparison import get_matrix
+from indicators import BOLLINGER_PERIOD, get_indicators
+from price_store import date_to_day, get_store
+
+# Версия оформления графика — входит в ключ кэша картинок
+CHART_STYLE = "line-v3"
+# Длинные ряды прореживаются LTTB до этого числа точек
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "500"))
+
+_templates = threading.local()
+
+
+def chart_caption(ticker, start_date, end_date):
+    return f"📈 График {ticker} за период {start_date} - {end_date}"
 
-def generate_stock_chart(ticker, start_date, end_date):
-    # Генерация графика цен акций (сохраняется как изображение)
-    try:
-        conn = sqlite3.connect('stocks.db')
 
-        query = """
-        SELECT Date, Close
-        FROM stock_prices
-        WHERE Ticker = ? AND Date BETWEEN ? AND ?
-        ORDER BY Date
-        """
+def comparison_caption(tickers, start_date, end_date):
+    return (
+        f"📈 Сравнение {', '.join(tickers)} "
+        f"за период {start_date} - {end_date}"
+    )
 
-        df = pd.read_sql_query(
-            query, conn, params=[ticker, start_date, end_date]
+
+# Largest-Triangle-Three-Buckets: оставляет threshold точек, сохраняя
+# форму ряда (экстремумы не теряются, в отличие от шага через n).
+def lttb(x, y, threshold):
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return x, y
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    prev = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Среднее следующего бакета (для последнего — последняя точка)
+        if i + 2 < len(edges):
+            next_lo, next_hi = edges[i + 1], edges[i + 2]
+        else:
+            next_lo, next_hi = n - 1, n
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+
+        area = np.abs(
+            (x[prev] - avg_x) * (y[lo:hi] - y[prev])
+            - (x[prev] - x[lo:hi]) * (avg_y - y[prev])
         )
-        conn.close()
+        prev = lo + int(np.argmax(area))
+        selected[i + 1] = prev
+
+    return x[selected], y[selected]
 
-        if df.empty:
-            return None, "❌ Данные не найдены для указанного периода"
 
-        df['Date'] = pd.to_datetime(df['Date'])
+# Шаблон графика: фигура, оси, линия и оформление создаются один раз
+# на поток, при отрисовке меняются только данные и заголовок. Без
+# pyplot — у каждого потока/процесса своя фигура и свой Agg-canvas.
+class _ChartTemplate:
 
-        plt.figure(figsize=(12, 6))
-        plt.plot(
-            df['Date'],
-            df['Close'],
+    def __init__(self):
+        self.figure = Figure(figsize=(12, 6), dpi=100)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot()
+        (self.line,) = self.ax.plot(
+            [],
+            [],
             linewidth=2,
             color='blue',
             marker='o',
             markersize=3,
+            label='Цена закрытия',
         )
-        plt.title(
-            f'Цены акций {ticker} ({start_date} - {end_date})',
-            fontsize=14,
-            fontweight='bold',
+        # Наложения индикаторов: SMA и полосы Боллинджера
+        (self.sma_line,) = self.ax.plot(
+            [],
+            [],
+            linewidth=1.5,
+            color='orange',
+            label=f'SMA {BOLLINGER_PERIOD}',
+        )
+        self.band_lines = [
+            self.ax.plot(
+                [],
+                [],
+                linewidth=1,
+                color='gray',
+                linestyle='--',
+                label=label,
+            )[0]
+            for label in (f'Боллинджер {BOLLINGER_PERIOD}, ±2σ', '_lower')
+        ]
+        self.ax.legend(loc='upper left')
+        self.ax.set_xlabel('Дата')
+        self.ax.set_ylabel('Цена закрытия ($)')
+        self.ax.grid(True, alpha=0.3)
+        locator = mdates.AutoDateLocator()
+        self.ax.xaxis.set_major_locator(locator)
+        self.ax.xaxis.set_major_formatter(mdates.AutoDateFormatter(locator))
+        self.ax.tick_params(axis='x', labelrotation=45)
+        # Фиксированные поля вместо tight_layout на каждый рендер
+        self.figure.subplots_adjust(
+            left=0.07,
+            right=0.98,
+            top=0.92,
+            bottom=0.16,
         )
-        plt.xlabel('Дата')
-        plt.ylabel('Цена закрытия ($)')
-        plt.grid(True, alpha=0.3)
-        plt.xticks(rotation=45)
-        plt.tight_layout()
 
-        filename = f"chart_{ticker}_{start_date}_{end_date}.png"
-        plt.savefig(filename, dpi=100, bbox_inches='tight')
-        plt.close()
+    # overlays — (x, y) для SMA, верхней и нижней полосы или None
+    def render(self, x, y, title, overlays=None) -> bytes:
+        self.line.set_data(x, y)
+        lines = (self.sma_line, *self.band_lines)
+        for line, data in zip(lines, overlays or [None] * len(lines)):
+            line.set_data(*(data if data is not None else ([], [])))
+        self.ax.set_title(title, fontsize=14, fontweight='bold')
+        self.ax.relim()
+        self.ax.autoscale_view()
+
+        buffer = io.BytesIO()
+        self.canvas.print_png(buffer)
+        return buffer.getvalue()
+
+
+# Шаблон графика сравнения: линии изменения цены в % от начала
+# периода, по линии на тикер. Линии создаются по мере надобности и
+# переиспользуются, лишние скрываются.
+class _OverlayTemplate:
+
+    def __init__(self):
+        self.figure = Figure(figsize=(12, 6), dpi=100)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot()
+        self.lines = []
+        self.ax.axhline(0, color='gray', linewidth=1, alpha=0.6)
+        self.ax.set_xlabel('Дата')
+        self.ax.set_ylabel('Изменение цены (%)')
+        self.ax.grid(True, alpha=0.3)
+        locator = mdates.AutoDateLocator()
+        self.ax.xaxis.set_major_locator(locator)
+        self.ax.xaxis.set_major_formatter(mdates.AutoDateFormatter(locator))
+        self.ax.tick_params(axis='x', labelrotation=45)
+        self.figure.subplots_adjust(
+            left=0.07,
+            right=0.98,
+            top=0.92,
+            bottom=0.16,
+        )
+
+    def render(self, series, title) -> bytes:
+        while len(self.lines) < len(series):
+            (line,) = self.ax.plot([], [], linewidth=2)
+            self.lines.append(line)
+        for line, (label, x, y) in zip(self.lines, series):
+            line.set_data(x, y)
+            line.set_label(label)
+            line.set_visible(True)
+        for line in self.lines[len(series):]:
+            line.set_visible(False)
+            line.set_label('_hidden')
+
+        self.ax.legend(loc='upper left', ncols=min(len(series), 5))
+        self.ax.set_title(title, fontsize=14, fontweight='bold')
+        self.ax.relim(visible_only=True)
+        self.ax.autoscale_view()
+
+        buffer = io.BytesIO()
+        self.canvas.print_png(buffer)
+        return buffer.getvalue()
+
 
-        return (
-            filename,
-            f"📈 График {ticker} за период {start_date} - {end_date}",
+def _template(kind="chart", factory=_ChartTemplate):
+    template = getattr(_templates, kind, None)
+    if template is None:
+        template = factory()
+        setattr(_templates, kind, template)
+    return template
+
+
+# Линии SMA и полос Боллинджера за период: срезы предрасчитанных
+# рядов индикаторов
+def _indicator_overlays(ticker, start_day, end_day):
+    indicators = get_indicators(get_store(), ticker)
+    lo, hi = indicators.bounds(int(start_day), int(end_day))
+    x = indicators.dates[lo:hi].astype(np.float64)
+    overlays = []
+    for values in (
+        indicators.bollinger_middle,
+        indicators.bollinger_upper,
+        indicators.bollinger_lower,
+    ):
+        y = values[lo:hi]
+        valid = ~np.isnan(y)
+        overlays.append(lttb(x[valid], y[valid], CHART_MAX_POINTS))
+    return overlays
+
+
+def generate_stock_chart(ticker, start_date, end_date):
+    # Генерация графика цен акций (PNG в памяти, без временных файлов)
+    try:
+        prices = get_store().range(ticker, start_date, end_date)
+
+        if prices is None or len(prices) == 0:
+            return None, "❌ Данные не найдены для указанного периода"
+
+        # Эпоха matplotlib — 1970-01-01, поэтому дни и есть даты графика
+        x = prices.dates.astype(np.float64)
+        x, y = lttb(x, prices.close, CHART_MAX_POINTS)
+
+        png = _template().render(
+            x,
+            y,
+            f'Цены акций {ticker} ({start_date} - {end_date})',
+            _indicator_overlays(ticker, prices.dates[0], prices.dates[-1]),
         )
+        return png, chart_caption(ticker, start_date, end_date)
 
     except Exception as e:
         print(f"Ошибка генерации графика: {e}")
         return None, f"❌ Ошибка при построении графика: {e}"
+
+
+# График сравнения нескольких тикеров (изменение в % от начала периода)
+def generate_comparison_chart(tickers, start_date, end_date):
+    try:
+        matrix = get_matrix(get_store())
+        start_day = date_to_day(start_date)
+        end_day = (
+            date_to_day(end_date) if end_date else int(matrix.dates[-1])
+        )
+        rows, lo, hi = matrix.window(tickers, start_day, end_day)
+        close = matrix.close[rows, lo:hi]
+        x_all = matrix.dates[lo:hi].astype(np.float64)
+
+        series = []
+        for row, prices in zip(rows, close):
+            valid = ~np.isnan(prices)
+            if not valid.any():
+                continue
+            y = prices[valid]
+            x, y = lttb(x_all[valid], y / y[0] * 100 - 100, CHART_MAX_POINTS)
+            series.append((matrix.tickers[row], x, y))
+
+        if not series:
+            return None, "❌ Данные не найдены для указанного периода"
+
+        names = [name for name, _, _ in series]
+        png = _template("overlay", _OverlayTemplate).render(
+            series,
+            f'Сравнение акций ({start_date} - {end_date})',
+        )
+        return png, comparison_caption(names, start_date, end_date)
+
+    except Exception as e:
+        print(f"Ошибка генерации графика сравнения: {e}")
+        return None, f"❌ Ошибка при построении графика: {e}"
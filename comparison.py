@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import weakref
+
+import numpy as np
+
+from price_store import PriceStore, date_to_day, day_to_date, get_store
+
+# Сколько тикеров показывать в топе по умолчанию
+DEFAULT_TOP_N = 5
+
+RANK_TITLES = {
+    'growth': "по росту",
+    'decline': "по падению",
+    'volatility': "по волатильности",
+    'volume': "по объему торгов",
+}
+
+
+# Выровненная матрица цен всех тикеров: строки — тикеры, столбцы —
+# объединение торговых дат, пропуски — NaN. Строится один раз на
+# хранилище, запрос по N тикерам — срез столбцов и векторные
+# редукции по строкам. Ряды берутся по одной строке на дату
+# (store.daily), как в статистике тикера.
+class PriceMatrix:
+
+    def __init__(self, store: PriceStore):
+        self.tickers = store.tickers
+        self.rows = {ticker: i for i, ticker in enumerate(self.tickers)}
+        series = [store.daily(ticker) for ticker in self.tickers]
+        self.dates = np.unique(np.concatenate([p.dates for p in series]))
+
+        shape = (len(self.tickers), len(self.dates))
+        self.close = np.full(shape, np.nan)
+        self.volume = np.zeros(shape)
+        for row, prices in enumerate(series):
+            columns = np.searchsorted(self.dates, prices.dates)
+            self.close[row, columns] = prices.close
+            self.volume[row, columns] = prices.volume
+
+    # Строки тикеров (неизвестные пропускаются) и столбцы [lo, hi)
+    def window(self, tickers, start_day: int, end_day: int):
+        rows = [self.rows[t] for t in tickers if t in self.rows]
+        lo = int(np.searchsorted(self.dates, start_day, side="left"))
+        hi = int(np.searchsorted(self.dates, end_day, side="right"))
+        return np.asarray(rows, dtype=np.int64), lo, max(lo, hi)
+
+
+_matrices: weakref.WeakKeyDictionary[PriceStore, PriceMatrix] = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_matrix(store: PriceStore) -> PriceMatrix:
+    matrix = _matrices.get(store)
+    if matrix is None:
+        matrix = PriceMatrix(store)
+        _matrices[store] = matrix
+    return matrix
+
+
+# Статистика N тикеров за период одним проходом по матрице.
+# Возвращает строки в формате calculate_stock_stats (плюс ticker и
+# относительная волатильность), отсортированные по rank_by.
+def compute_comparison(matrix: PriceMatrix, tickers, start_day, end_day):
+    rows, lo, hi = matrix.window(tickers, start_day, end_day)
+    close = matrix.close[rows, lo:hi]
+    volume = matrix.volume[rows, lo:hi]
+    valid = ~np.isnan(close)
+    counts = valid.sum(axis=1)
+    present = counts > 0
+    if not present.any():
+        return []
+
+    rows, close, volume, valid, counts = (
+        rows[present],
+        close[present],
+        volume[present],
+        valid[present],
+        counts[present],
+    )
+    width = close.shape[1]
+    index = np.arange(len(rows))
+    first = valid.argmax(axis=1)
+    last = width - 1 - valid[:, ::-1].argmax(axis=1)
+    start_price = close[index, first]
+    end_price = close[index, last]
+
+    average = np.nanmean(close, axis=1)
+    # Выборочное std (ddof=1), как у pandas; для одного дня — NaN
+    squares = np.nansum((close - average[:, None]) ** 2, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        volatility = np.sqrt(squares / (counts - 1))
+    volatility[counts < 2] = np.nan
+
+    change = end_price - start_price
+    low = np.nanmin(close, axis=1)
+    high = np.nanmax(close, axis=1)
+    total_volume = volume.sum(axis=1)
+    result = []
+    for i, row in enumerate(rows):
+        result.append({
+            'ticker': matrix.tickers[row],
+            'period_start': day_to_date(matrix.dates[lo + first[i]]),
+            'period_end': day_to_date(matrix.dates[lo + last[i]]),
+            'start_price': start_price[i],
+            'end_price': end_price[i],
+            'price_change': change[i],
+            'price_change_percent': change[i] / start_price[i] * 100,
+            'average_price': average[i],
+            'min_price': low[i],
+            'max_price': high[i],
+            'volatility': volatility[i],
+            'volatility_percent': volatility[i] / average[i] * 100,
+            'total_volume': total_volume[i],
+            'days_count': int(counts[i]),
+        })
+    return result
+
+
+def rank_rows(rows, rank_by: str | None):
+    key, reverse = {
+        'decline': ('price_change_percent', False),
+        'volatility': ('volatility_percent', True),
+        'volume': ('total_volume', True),
+    }.get(rank_by, ('price_change_percent', True))
+
+    # NaN (один торговый день) — в конец списка
+    def sort_key(row):
+        value = row[key]
+        if np.isnan(value):
+            return 1, 0.0
+        return 0, -value if reverse else value
+
+    return sorted(rows, key=sort_key)
+
+
+# Сравнение тикеров (пустой список — все тикеры) за период.
+# Возвращает (строки рейтинга, сообщение), как calculate_stock_stats.
+def compare_stocks(tickers, start_date, end_date, rank_by=None, limit=None):
+
+    try:
+        store = get_store()
+        matrix = get_matrix(store)
+        tickers = [str(t).strip().upper() for t in tickers or []]
+        if not tickers:
+            tickers = matrix.tickers
+
+        start_day = date_to_day(start_date)
+        end_day = (
+            date_to_day(end_date) if end_date else int(matrix.dates[-1])
+        )
+        rows = rank_rows(
+            compute_comparison(matrix, tickers, start_day, end_day),
+            rank_by,
+        )
+        if not rows:
+            return None, "❌ Данные не найдены"
+        if limit:
+            rows = rows[:limit]
+        return rows, "✅ Сравнение рассчитано"
+
+    except Exception as e:
+        print(f"Ошибка сравнения: {e}")
+        return None, f"❌ Ошибка расчета: {e}"
+
+
+# Рейтинг в виде сообщения: по строке на тикер
+def format_comparison_message(rows, start_date, end_date, rank_by=None):
+
+    if not rows:
+        return "❌ Не удалось сравнить акции"
+
+    title = RANK_TITLES.get(rank_by, RANK_TITLES['growth'])
+    message = f"🏁 Сравнение {title}\n"
+    message += f"Период: {start_date} - {end_date}\n\n"
+    for place, row in enumerate(rows, 1):
+        trend = "🟢" if row['price_change'] > 0 else (
+            "🔴" if row['price_change'] < 0 else "⚪"
+        )
+        message += (
+            f"{place}. {trend} {row['ticker']}: "
+            f"{row['price_change_percent']:+.1f}% "
+            f"(${row['start_price']:.2f} → ${row['end_price']:.2f}), "
+            f"волатильность {row['volatility_percent']:.1f}%, "
+            f"объем {row['total_volume']:,.0f}\n"
+        )
+    return message.rstrip()
@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+DB_PATH = "stocks.db"
+DATA_PATH = "tech_stocks_2024_cleaned.csv"
+SCHEMA_VERSION = "2"
+CHUNK_ROWS = int(os.getenv("DB_CHUNK_ROWS", "5000"))
+
+PRICE_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+CSV_COLUMNS = ["Date", *PRICE_COLUMNS, "Ticker"]
+CSV_DTYPES = {col: "float64" for col in PRICE_COLUMNS}
+CSV_DTYPES.update({"Date": "str", "Ticker": "str"})
+
+# date — число дней от 1970-01-01, тикер хранится один раз в tickers
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingest_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tickers (
+    id INTEGER PRIMARY KEY,
+    symbol TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS stock_prices (
+    ticker_id INTEGER NOT NULL REFERENCES tickers(id),
+    date INTEGER NOT NULL,
+    open REAL,
+    high REAL,
+    low REAL,
+    close REAL,
+    volume REAL
+);
+CREATE INDEX IF NOT EXISTS idx_stock_prices_ticker_date
+    ON stock_prices (ticker_id, date);
+CREATE VIEW IF NOT EXISTS stock_prices_view AS
+    SELECT t.symbol AS Ticker, date(p.date * 86400, 'unixepoch') AS Date,
+           p.open AS Open, p.high AS High, p.low AS Low,
+           p.close AS Close, p.volume AS Volume
+    FROM stock_prices p JOIN tickers t ON t.id = p.ticker_id;
+"""
+
+
+def _read_meta(conn: sqlite3.Connection) -> dict[str, str]:
+    try:
+        return dict(conn.execute("SELECT key, value FROM ingest_meta"))
+    except sqlite3.OperationalError:
+        return {}
+
+
+def _write_meta(conn: sqlite3.Connection, meta: dict):
+    conn.executemany(
+        "INSERT OR REPLACE INTO ingest_meta (key, value) VALUES (?, ?)",
+        [(key, str(value)) for key, value in meta.items()],
+    )
+
+
+# Хэш всего файла и (если задан prefix_size) хэш его первых байт за
+# один проход
+def _hash_file(path: str, prefix_size: int | None = None):
+    full = hashlib.sha256()
+    prefix_digest = None
+    read = 0
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(1 << 20)
+            if not block:
+                break
+            end = read + len(block)
+            if prefix_size is not None and read < prefix_size <= end:
+                prefix = full.copy()
+                prefix.update(block[: prefix_size - read])
+                prefix_digest = prefix.hexdigest()
+            full.update(block)
+            read = end
+    return full.hexdigest(), prefix_digest
+
+
+def _ends_with_newline(path: str, offset: int) -> bool:
+    if offset == 0:
+        return True
+    with open(path, "rb") as f:
+        f.seek(offset - 1)
+        return f.read(1) == b"\n"
+
+
+# Пересоздание схемы внутри транзакции перестройки: executescript
+# перед выполнением фиксирует транзакцию, поэтому DDL идет через
+# execute после явного BEGIN (sqlite3 сам открывает транзакцию только
+# перед INSERT/UPDATE/DELETE). Если загрузка CSV упадет, откатятся и
+# удаление таблиц — старые данные останутся на месте.
+def _reset_schema(conn: sqlite3.Connection):
+    if not conn.in_transaction:
+        conn.execute("BEGIN")
+    for statement in (
+        "DROP VIEW IF EXISTS stock_prices_view",
+        "DROP TABLE IF EXISTS stock_prices",
+        "DROP TABLE IF EXISTS tickers",
+        "DROP TABLE IF EXISTS ingest_meta",
+        *SCHEMA.split(";"),
+    ):
+        if statement.strip():
+            conn.execute(statement)
+
+
+def _ticker_ids(conn: sqlite3.Connection, symbols) -> dict[str, int]:
+    conn.executemany(
+        "INSERT OR IGNORE INTO tickers (symbol) VALUES (?)",
+        [(symbol,) for symbol in symbols],
+    )
+    return dict(conn.execute("SELECT symbol, id FROM tickers"))
+
+
+# Загрузка CSV кусками с типизированными колонками. offset > 0 —
+# дописанный хвост файла (без заголовка).
+def _ingest(conn: sqlite3.Connection, path: str, offset: int = 0) -> int:
+    with open(path, "rb") as f:
+        header = f.readline().decode("utf-8").strip().split(",")
+        if offset:
+            f.seek(offset)
+        source = io.TextIOWrapper(f, encoding="utf-8", newline="")
+        chunks = pd.read_csv(
+            source,
+            header=None,
+            names=header,
+            usecols=CSV_COLUMNS,
+            dtype=CSV_DTYPES,
+            chunksize=CHUNK_ROWS,
+        )
+
+        rows = 0
+        ticker_ids: dict[str, int] = {}
+        for chunk in chunks:
+            if chunk.empty:
+                continue
+            symbols = chunk["Ticker"].unique()
+            if any(symbol not in ticker_ids for symbol in symbols):
+                ticker_ids = _ticker_ids(conn, symbols)
+
+            days = (
+                chunk["Date"].to_numpy(dtype="U10")
+                .astype("datetime64[D]")
+                .astype(np.int64)
+            )
+            records = zip(
+                chunk["Ticker"].map(ticker_ids).tolist(),
+                days.tolist(),
+                *(chunk[col].tolist() for col in PRICE_COLUMNS),
+            )
+            conn.executemany(
+                "INSERT INTO stock_prices "
+                "(ticker_id, date, open, high, low, close, volume) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                records,
+            )
+            rows += len(chunk)
+        return rows
+
+
+# Инициализация stocks.db: пропускается, если CSV не менялся,
+# дописывает только новые строки, если файл был дополнен, и
+# перестраивает таблицу в остальных случаях. Возвращает сводку
+# {"action", "rows", "seconds"}.
+def bootstrap_database(data_path: str = DATA_PATH, db_path: str = DB_PATH):
+    started = time.perf_counter()
+    if not os.path.exists(data_path):
+        raise FileNotFoundError(f"Не найден файл данных: {data_path}")
+
+    stat = os.stat(data_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        meta = _read_meta(conn)
+        same_schema = meta.get("schema_version") == SCHEMA_VERSION
+        old_size = int(meta.get("size", -1)) if same_schema else -1
+
+        if (
+            same_schema
+            and old_size == stat.st_size
+            and meta.get("mtime_ns") == str(stat.st_mtime_ns)
+        ):
+            return _summary("skip", 0, started)
+
+        prefix_size = old_size if 0 < old_size <= stat.st_size else None
+        digest, prefix_digest = _hash_file(data_path, prefix_size)
+        fingerprint = {
+            "schema_version": SCHEMA_VERSION,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": digest,
+        }
+
+        with conn:
+            if same_schema and digest == meta.get("sha256"):
+                # Содержимое то же (например, новый mtime после деплоя)
+                _write_meta(conn, fingerprint)
+                return _summary("skip", 0, started)
+
+            if (
+                same_schema
+                and prefix_digest is not None
+                and prefix_digest == meta.get("sha256")
+                and _ends_with_newline(data_path, old_size)
+            ):
+                rows = _ingest(conn, data_path, offset=old_size)
+                _write_meta(conn, fingerprint)
+                return _summary("append", rows, started)
+
+            _reset_schema(conn)
+            rows = _ingest(conn, data_path)
+            _write_meta(conn, fingerprint)
+        conn.execute("ANALYZE")
+        return _summary("rebuild", rows, started)
+    finally:
+        conn.close()
+
+
+def _summary(action: str, rows: int, started: float) -> dict:
+    return {
+        "action": action,
+        "rows": rows,
+        "seconds": time.perf_counter() - started,
+    }
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import metrics
+from job_queue import JOB_QUEUE_DB, JobClient, JobQueue
+
+
+def _parse_limits(raw: str | None) -> dict[str, int]:
+
+    # Формат: "chart=2,analysis=4"
+
+    limits = {}
+    if not raw:
+        return limits
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        stage, value = item.split("=", 1)
+        try:
+            limits[stage.strip()] = max(1, int(value))
+        except ValueError:
+            print(f"Некорректный лимит стадии: {item}")
+    return limits
+
+
+# Лимиты одновременных задач на стадию обработки
+DEFAULT_STAGE_LIMITS = {
+    "parse": 16,
+    "stats": 8,
+    "chart": 4,
+    "analysis": 8,
+}
+STAGE_LIMITS = {
+    **DEFAULT_STAGE_LIMITS,
+    **_parse_limits(os.getenv("STAGE_LIMITS")),
+}
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", "0")) or min(os.cpu_count() or 1, 4)
+IO_WORKERS = int(os.getenv("IO_WORKERS", "32"))
+# pool — пул процессов внутри бота, queue — очередь задач в sqlite,
+# которую разбирают процессы worker.py
+CPU_BACKEND = os.getenv("CPU_BACKEND", "pool")
+
+
+class _StageMetrics:
+    def __init__(self, stage: str):
+        self.queued = metrics.gauge("stage_queue_depth", stage=stage)
+        self.running = metrics.gauge("stage_running", stage=stage)
+        self.completed = metrics.counter("stage_completed_total", stage=stage)
+        self.failed = metrics.counter("stage_failed_total", stage=stage)
+        self.wait_seconds = metrics.counter(
+            "stage_wait_seconds_total",
+            stage=stage,
+        )
+        self.run_seconds = metrics.counter(
+            "stage_run_seconds_total",
+            stage=stage,
+        )
+        self.wait_latency = metrics.histogram(
+            "stage_wait_seconds",
+            stage=stage,
+        )
+        self.run_latency = metrics.histogram(
+            "stage_run_seconds",
+            stage=stage,
+        )
+
+
+# Слой исполнения: CPU-задачи (графики, статистика) уходят в пул
+# процессов, блокирующий I/O — в пул потоков, корутины выполняются
+# прямо в цикле событий. Каждая стадия ограничена своим семафором,
+# поэтому медленный Gemini у одного пользователя не занимает
+# слоты, нужные для графиков другого.
+class StageExecutor:
+
+    def __init__(
+        self,
+        cpu_workers: int = CPU_WORKERS,
+        io_workers: int = IO_WORKERS,
+        limits: dict[str, int] | None = None,
+        cpu_backend: str = CPU_BACKEND,
+    ):
+        self.cpu_workers = cpu_workers
+        self.cpu_backend = cpu_backend
+        self.io_workers = io_workers
+        self.limits = dict(limits or STAGE_LIMITS)
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._metrics: dict[str, _StageMetrics] = {}
+        self._cpu_pool: ProcessPoolExecutor | None = None
+        self._io_pool: ThreadPoolExecutor | None = None
+        self._job_client: JobClient | None = None
+
+    def _stage(self, stage: str):
+        if stage not in self._semaphores:
+            self._semaphores[stage] = asyncio.Semaphore(
+                self.limits.get(stage, 4)
+            )
+            self._metrics[stage] = _StageMetrics(stage)
+        return self._semaphores[stage], self._metrics[stage]
+
+    def _get_cpu_pool(self) -> ProcessPoolExecutor:
+        if self._cpu_pool is None:
+            self._cpu_pool = ProcessPoolExecutor(max_workers=self.cpu_workers)
+        return self._cpu_pool
+
+    def _get_job_client(self) -> JobClient:
+        if self._job_client is None:
+            queue = JobQueue(JOB_QUEUE_DB)
+            self._job_client = JobClient(queue)
+            depth = metrics.gauge("job_queue_depth")
+            metrics.register_collector(lambda: depth.set(queue.depth()))
+        return self._job_client
+
+    def _get_io_pool(self) -> ThreadPoolExecutor:
+        if self._io_pool is None:
+            self._io_pool = ThreadPoolExecutor(
+                max_workers=self.io_workers,
+                thread_name_prefix="io-stage",
+            )
+        return self._io_pool
+
+    async def _run(self, stage: str, make_awaitable):
+        semaphore, stage_metrics = self._stage(stage)
+
+        queued_at = time.perf_counter()
+        stage_metrics.queued.inc()
+        try:
+            await semaphore.acquire()
+        finally:
+            stage_metrics.queued.dec()
+
+        started_at = time.perf_counter()
+        stage_metrics.wait_seconds.inc(started_at - queued_at)
+        stage_metrics.wait_latency.observe(started_at - queued_at)
+        stage_metrics.running.inc()
+        try:
+            result = await make_awaitable()
+        except Exception:
+            stage_metrics.failed.inc()
+            raise
+        else:
+            stage_metrics.completed.inc()
+            return result
+        finally:
+            stage_metrics.running.dec()
+            run_seconds = time.perf_counter() - started_at
+            stage_metrics.run_seconds.inc(run_seconds)
+            stage_metrics.run_latency.observe(run_seconds)
+            semaphore.release()
+
+    # CPU-задача в пуле процессов или в очереди задач (func — функция
+    # уровня модуля, аргументы должны быть pickle-able)
+    async def run_cpu(self, stage: str, func, *args, **kwargs):
+        if self.cpu_backend == "queue":
+            client = self._get_job_client()
+            return await self._run(
+                stage,
+                lambda: client.run(stage, func, *args, **kwargs),
+            )
+
+        loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs)
+        return await self._run(
+            stage,
+            lambda: loop.run_in_executor(self._get_cpu_pool(), call),
+        )
+
+    # I/O-задача: корутина ожидается в цикле, синхронная функция
+    # выполняется в пуле потоков
+    async def run_io(self, stage: str, func, *args, **kwargs):
+        if asyncio.iscoroutinefunction(func):
+            return await self._run(stage, lambda: func(*args, **kwargs))
+
+        loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs)
+        return await self._run(
+            stage,
+            lambda: loop.run_in_executor(self._get_io_pool(), call),
+        )
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        return {
+            stage: {
+                "limit": self.limits.get(stage, 4),
+                "queued": m.queued.value,
+                "running": m.running.value,
+                "completed": m.completed.value,
+                "failed": m.failed.value,
+                "wait_seconds": m.wait_seconds.value,
+                "run_seconds": m.run_seconds.value,
+            }
+            for stage, m in self._metrics.items()
+        }
+
+    def shutdown(self, wait: bool = True):
+        if self._cpu_pool is not None:
+            self._cpu_pool.shutdown(wait=wait, cancel_futures=not wait)
+            self._cpu_pool = None
+        if self._io_pool is not None:
+            self._io_pool.shutdown(wait=wait, cancel_futures=not wait)
+            self._io_pool = None
+
+
+executor = StageExecutor()
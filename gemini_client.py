@@ -0,0 +1,417 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+import os
+import random
+import time
+
+import httpx
+from dotenv import load_dotenv
+
+import metrics
+import overload
+
+load_dotenv()
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+GOOGLE_API_BASE = os.getenv(
+    "GOOGLE_API_BASE",
+    "https://generativelanguage.googleapis.com/v1beta",
+).rstrip("/")
+
+GOOGLE_TIMEOUT = float(os.getenv("GOOGLE_TIMEOUT", "30"))
+GOOGLE_RETRIES = int(os.getenv("GOOGLE_RETRIES", "2"))
+GOOGLE_BACKOFF_BASE = float(os.getenv("GOOGLE_BACKOFF_BASE", "0.25"))
+GOOGLE_BACKOFF_MAX = float(os.getenv("GOOGLE_BACKOFF_MAX", "4"))
+GOOGLE_MAX_CONNECTIONS = int(os.getenv("GOOGLE_MAX_CONNECTIONS", "20"))
+# Одновременных запросов к моделям на процесс; остальные ждут слот в
+# пределах бюджета запроса
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+# Коды ответа, при которых имеет смысл повторить запрос к той же модели
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+def normalize_model_name(model: str | None, default: str) -> str:
+
+    # Убирает префикс models/ и пробелы, если имя модели скопировано из
+    # ListModels.
+
+    if not model:
+        return default
+    cleaned = model.strip()
+    if cleaned.startswith("models/"):
+        cleaned = cleaned.split("models/", 1)[1]
+    return cleaned
+
+
+def _parse_timeouts(raw: str | None) -> dict[str, float]:
+
+    # Формат: "gemini-2.0-flash=15,gemini-2.0-flash-lite-001=8"
+
+    timeouts = {}
+    if not raw:
+        return timeouts
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        model, value = item.split("=", 1)
+        try:
+            timeouts[normalize_model_name(model, model)] = float(value)
+        except ValueError:
+            print(f"Некорректный таймаут модели: {item}")
+    return timeouts
+
+
+GOOGLE_MODEL_TIMEOUTS = _parse_timeouts(os.getenv("GOOGLE_MODEL_TIMEOUTS"))
+
+
+# Склеивает текстовые части первого кандидата ответа generateContent
+def extract_text(api_response: dict) -> str:
+    text = ""
+    candidates = api_response.get("candidates") or [{}]
+    for part in candidates[0].get("content", {}).get("parts", []):
+        if "text" in part:
+            text += part["text"]
+    return text
+
+
+class StreamError(RuntimeError):
+    pass
+
+
+# Тело generateContent с одним текстовым промптом
+def text_payload(prompt, temperature, max_tokens, extra_config=None):
+    return {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "generationConfig": {
+            "temperature": temperature,
+            "maxOutputTokens": max_tokens,
+            **(extra_config or {}),
+        },
+    }
+
+
+# Длительность попытки запроса к модели по коду ответа
+def _observe_request(model: str, status, started: float):
+    metrics.histogram(
+        "llm_request_seconds",
+        model=model,
+        status=str(status),
+    ).observe(time.perf_counter() - started)
+
+
+# Токены запроса и ответа из usageMetadata
+def _observe_usage(model: str, api_response: dict):
+    usage = api_response.get("usageMetadata") or {}
+    for kind, field in (
+        ("prompt", "promptTokenCount"),
+        ("output", "candidatesTokenCount"),
+    ):
+        if field in usage:
+            metrics.histogram(
+                "llm_tokens",
+                buckets=metrics.TOKEN_BUCKETS,
+                model=model,
+                kind=kind,
+            ).observe(usage[field])
+
+
+# Ответ дала не основная модель
+def _fallback_used(model: str):
+    metrics.counter("llm_fallback_total", model=model).inc()
+
+
+# Строки потока, но не дольше остатка бюджета запроса: read-таймаут
+# ограничивает только паузу между фрагментами, а не весь поток
+async def _budget_lines(resp: httpx.Response):
+    lines = resp.aiter_lines()
+    left = overload.remaining()
+    if left is None:
+        async for line in lines:
+            yield line
+        return
+    deadline = asyncio.get_running_loop().time() + left
+    while True:
+        try:
+            async with asyncio.timeout_at(deadline):
+                line = await anext(lines)
+        except StopAsyncIteration:
+            return
+        except TimeoutError:
+            raise overload.shed(
+                "budget",
+                "поток ответа не уложился в бюджет",
+            ) from None
+        yield line
+
+
+# Асинхронный клиент Gemini с общим пулом соединений (HTTP/2 и
+# keep-alive), таймаутами по моделям и повторами с jittered backoff.
+class GeminiClient:
+
+    def __init__(
+        self,
+        api_key: str | None = GOOGLE_API_KEY,
+        base_url: str = GOOGLE_API_BASE,
+        timeouts: dict[str, float] | None = None,
+        default_timeout: float = GOOGLE_TIMEOUT,
+        retries: int = GOOGLE_RETRIES,
+        backoff_base: float = GOOGLE_BACKOFF_BASE,
+        backoff_max: float = GOOGLE_BACKOFF_MAX,
+        max_connections: int = GOOGLE_MAX_CONNECTIONS,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.timeouts = dict(
+            GOOGLE_MODEL_TIMEOUTS if timeouts is None else timeouts
+        )
+        self.default_timeout = default_timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._http = httpx.AsyncClient(
+            http2=True,
+            headers={"x-goog-api-key": api_key or ""},
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=120,
+            ),
+        )
+
+    def timeout_for(self, model: str) -> float:
+        return self.timeouts.get(model, self.default_timeout)
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": равномерно от 0 до экспоненциального потолка
+        ceiling = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return random.uniform(0, ceiling)
+
+    # Таймаут запроса к модели, урезанный до остатка бюджета запроса
+    def _timeout(self, model: str) -> float:
+        timeout = self.timeout_for(model)
+        left = overload.remaining()
+        if left is None:
+            return timeout
+        if left <= 0:
+            raise overload.shed("budget", "бюджет запроса исчерпан")
+        return min(timeout, left)
+
+    # Слот глобального лимита запросов к моделям; ждать его дольше
+    # остатка бюджета запроса нет смысла
+    @contextlib.asynccontextmanager
+    async def _slot(self):
+        left = overload.remaining()
+        if left is not None and left <= 0:
+            raise overload.shed("budget", "бюджет запроса исчерпан")
+        try:
+            await asyncio.wait_for(self._slots.acquire(), left)
+        except asyncio.TimeoutError:
+            raise overload.shed(
+                "budget",
+                "нет свободного слота LLM в пределах бюджета",
+            ) from None
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    async def _post(self, model: str, payload: dict) -> httpx.Response:
+        url = f"{self.base_url}/models/{model}:generateContent"
+        async with self._slot():
+            return await self._http.post(
+                url,
+                json=payload,
+                timeout=self._timeout(model),
+            )
+
+    # Запрос generateContent с перебором моделей. payload — словарь или
+    # функция model -> словарь (например, разный maxOutputTokens).
+    # Возвращает (ответ, модель) или (None, None), если все попытки
+    # неудачны. Модели с разомкнутым автоматом пропускаются; если
+    # бюджет запроса исчерпан — overload.Overloaded.
+    async def generate(self, models, payload, retries: int | None = None):
+        retries = self.retries if retries is None else retries
+        attempt = 0
+
+        models = list(dict.fromkeys(m for m in models if m))
+        for model in models:
+            body = payload(model) if callable(payload) else payload
+            circuit = overload.breaker(model)
+
+            for _ in range(retries + 1):
+                if attempt:
+                    delay = self._backoff(attempt - 1)
+                    left = overload.remaining()
+                    if left is not None and delay >= left:
+                        raise overload.shed("budget", "нет времени на повтор")
+                    await asyncio.sleep(delay)
+                if not circuit.allow():
+                    overload.shed("circuit", model)
+                    print(f"Модель {model} отключена автоматом, пропускаю")
+                    break
+                attempt += 1
+
+                started = time.perf_counter()
+                try:
+                    resp = await self._post(model, body)
+                except httpx.HTTPError as err:
+                    circuit.failure()
+                    _observe_request(model, "error", started)
+                    print(f"Ошибка запроса к модели {model}: {err!r}")
+                    continue
+
+                _observe_request(model, resp.status_code, started)
+                if resp.status_code in RETRYABLE_STATUSES:
+                    circuit.failure()
+                else:
+                    circuit.success()
+                if resp.status_code == 200:
+                    result = resp.json()
+                    _observe_usage(model, result)
+                    if model != models[0]:
+                        _fallback_used(model)
+                    return result, model
+
+                print(
+                    f"Ошибка Google AI API ({model}, "
+                    f"{resp.status_code}): {resp.text[:500]}"
+                )
+                if resp.status_code not in RETRYABLE_STATUSES:
+                    break
+
+        return None, None
+
+    # Текст ответа или None, если ни одна модель не вернула текст
+    async def generate_text(
+        self,
+        models,
+        prompt: str,
+        temperature: float,
+        max_tokens,
+        retries: int | None = None,
+        extra_config: dict | None = None,
+    ) -> str | None:
+
+        def build_payload(model: str) -> dict:
+            tokens = max_tokens(model) if callable(max_tokens) else max_tokens
+            return text_payload(prompt, temperature, tokens, extra_config)
+
+        models = list(dict.fromkeys(m for m in models if m))
+        for model in models:
+            result, _ = await self.generate(
+                [model],
+                build_payload,
+                retries=retries,
+            )
+            if result is None:
+                continue
+            text = extract_text(result)
+            if text:
+                if model != models[0]:
+                    _fallback_used(model)
+                return text
+            # Логируем пустой ответ для дебага
+            if result.get("candidates"):
+                finish = result["candidates"][0].get("finishReason")
+                print(f"Пустой ответ модели {model}, finishReason={finish}")
+        return None
+
+    # Потоковый ответ streamGenerateContent (SSE): отдает текстовые
+    # фрагменты по мере генерации. Пауза между фрагментами дольше
+    # stall_timeout — httpx.ReadTimeout, ответ не 200 — StreamError.
+    async def stream_text(
+        self,
+        model: str,
+        prompt: str,
+        temperature: float,
+        max_tokens: int,
+        stall_timeout: float,
+        extra_config: dict | None = None,
+    ):
+        url = f"{self.base_url}/models/{model}:streamGenerateContent"
+        circuit = overload.breaker(model)
+        if not circuit.allow():
+            raise overload.shed("circuit", f"модель {model} отключена")
+        started = time.perf_counter()
+        first = True
+        usage = {}
+        async with self._slot():
+            timeout = self._timeout(model)
+            try:
+                async with self._http.stream(
+                    "POST",
+                    url,
+                    params={"alt": "sse"},
+                    json=text_payload(
+                        prompt,
+                        temperature,
+                        max_tokens,
+                        extra_config,
+                    ),
+                    timeout=httpx.Timeout(
+                        timeout,
+                        read=min(stall_timeout, timeout),
+                    ),
+                ) as resp:
+                    if resp.status_code != 200:
+                        body = (await resp.aread())[:500]
+                        _observe_request(model, resp.status_code, started)
+                        if resp.status_code in RETRYABLE_STATUSES:
+                            circuit.failure()
+                        raise StreamError(
+                            f"{model}, {resp.status_code}: {body!r}"
+                        )
+
+                    async for line in _budget_lines(resp):
+                        if not line.startswith("data:"):
+                            continue
+                        chunk = json.loads(line[5:])
+                        # usageMetadata в каждом фрагменте — нарастающий
+                        # итог
+                        usage = chunk
+                        text = extract_text(chunk)
+                        if not text:
+                            continue
+                        if first:
+                            first = False
+                            metrics.histogram(
+                                "llm_first_chunk_seconds",
+                                model=model,
+                            ).observe(time.perf_counter() - started)
+                        yield text
+            except httpx.HTTPError:
+                circuit.failure()
+                raise
+        circuit.success()
+        _observe_request(model, "stream", started)
+        _observe_usage(model, usage)
+
+    async def aclose(self):
+        await self._http.aclose()
+
+
+# Один клиент на цикл событий: пул соединений httpx привязан к циклу,
+# в котором был создан.
+_clients: dict[asyncio.AbstractEventLoop, GeminiClient] = {}
+
+
+def get_client() -> GeminiClient:
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        for stale_loop in [lp for lp in _clients if lp.is_closed()]:
+            del _clients[stale_loop]
+        client = GeminiClient()
+        _clients[loop] = client
+    return client
+
+
+async def close_client():
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Локальная заглушка Gemini API для проверки клиента без сети.
+# Запуск: python gemini_stub.py --port 8085, затем
+# GOOGLE_API_BASE=http://127.0.0.1:8085/v1beta python bot.py
+# Задержка ответа и доля ошибок 503 задаются для нагрузочных тестов:
+# python gemini_stub.py --latency-ms 400 --jitter-ms 200 --error-rate 0.05
+
+_PATH_RE = re.compile(r"^/v1beta/models/(?P<model>[^/:]+):(?P<method>\w+)")
+# Строка сообщения в пакетном промпте разбора: 1. "текст"
+BATCH_LINE_RE = re.compile(r'^(?P<id>\d+)\. "(?P<text>.*)"$', re.M)
+
+
+def default_responder(model: str, payload: dict) -> tuple[int, dict]:
+    prompt = ""
+    for content in payload.get("contents", []):
+        for part in content.get("parts", []):
+            prompt += part.get("text", "")
+
+    if "JSON-массивом" in prompt:
+        count = len(BATCH_LINE_RE.findall(prompt))
+        text = json.dumps([
+            {
+                "id": number,
+                "ticker": "AAPL",
+                "start_date": "2024-03-01",
+                "end_date": "2024-03-31",
+                "request_type": "graph",
+            }
+            for number in range(1, count + 1)
+        ])
+    elif "Ответь ТОЛЬКО JSON" in prompt:
+        text = (
+            '{"ticker": "AAPL", "start_date": "2024-03-01", '
+            '"end_date": "2024-03-31", "request_type": "graph"}'
+        )
+    else:
+        text = f"Заглушка {model}: тренд, риски, активность, вывод."
+
+    return 200, {
+        "candidates": [
+            {
+                "content": {"role": "model", "parts": [{"text": text}]},
+                "finishReason": "STOP",
+            }
+        ]
+    }
+
+
+class GeminiStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address=("127.0.0.1", 0),
+        responder=None,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        seed=None,
+        chunk_delay: float = 0.05,
+        stall_after: int | None = None,
+    ):
+        super().__init__(address, _StubHandler)
+        self.responder = responder or default_responder
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        # streamGenerateContent: пауза между фрагментами и номер
+        # фрагмента, после которого поток зависает (None — не зависает)
+        self.chunk_delay = chunk_delay
+        self.stall_after = stall_after
+        self.requests_log: list[tuple[str, dict]] = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    # Задержка ответа (latency ± jitter секунд) и признак ошибки 503
+    def sample(self) -> tuple[float, bool]:
+        with self._lock:
+            delay = self.latency + self._random.uniform(
+                -self.jitter,
+                self.jitter,
+            )
+            failed = self._random.random() < self.error_rate
+        return max(delay, 0.0), failed
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1beta"
+
+    def start(self) -> "GeminiStubServer":
+        self._thread = threading.Thread(
+            target=self.serve_forever,
+            name="gemini-stub",
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        match = _PATH_RE.match(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if not match:
+            self._send(404, {"error": {"message": "not found"}})
+            return
+
+        payload = json.loads(body or b"{}")
+        model = match.group("model")
+        self.server.requests_log.append((model, payload))
+        delay, failed = self.server.sample()
+        if delay:
+            time.sleep(delay)
+        if failed:
+            self._send(503, {
+                "error": {
+                    "code": 503,
+                    "message": "The model is overloaded.",
+                    "status": "UNAVAILABLE",
+                }
+            })
+            return
+        status, response = self.server.responder(model, payload)
+        if match.group("method") == "streamGenerateContent" and status == 200:
+            self._stream(response)
+            return
+        self._send(status, response)
+
+    # Ответ потоком SSE: текст первого кандидата режется на фрагменты
+    # по несколько слов, каждый — отдельное событие data:
+    def _stream(self, response: dict):
+        parts = response["candidates"][0]["content"]["parts"]
+        words = "".join(part.get("text", "") for part in parts).split(" ")
+        chunks = [
+            " ".join(words[i:i + 3]) + (" " if i + 3 < len(words) else "")
+            for i in range(0, len(words), 3)
+        ]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for number, chunk in enumerate(chunks):
+            if number == self.server.stall_after:
+                time.sleep(3600)
+            event = {
+                "candidates": [{
+                    "content": {"role": "model", "parts": [{"text": chunk}]},
+                }],
+            }
+            data = f"data: {json.dumps(event, ensure_ascii=False)}\r\n\r\n"
+            self._write_chunk(data.encode("utf-8"))
+            time.sleep(self.server.chunk_delay)
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send(self, status: int, response: dict):
+        data = json.dumps(response, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка Gemini API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8085)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = GeminiStubServer(
+        (args.host, args.port),
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        error_rate=args.error_rate,
+    )
+    print(f"Заглушка Gemini слушает {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
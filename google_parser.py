@@ -3,208 +3,293 @@ from __future__ import annotations
 import json
 import os
 import re
+import time
+
+import metrics
+from gemini_client import (
+    GOOGLE_API_KEY,
+    extract_text,
+    get_client,
+    normalize_model_name,
+)
+from micro_batch import MicroBatcher
+from parse_cache import ParseCache
+from query_matcher import (
+    ALL_ALIASES,
+    HALF_RANGES,
+    MONTH_RANGES,
+    MULTI_TICKER_TYPES,
+    QUARTER_RANGES,
+    YEAR_RANGE,
+    match_query,
+)
 
-import requests
-from dotenv import load_dotenv
+GOOGLE_MODEL = normalize_model_name(
+    os.getenv("GOOGLE_MODEL"),
+    "gemini-2.0-flash-latest",
+)
+# Парсер быстро уходит в fallback, поэтому повторяем не больше раза
+PARSER_RETRIES = int(os.getenv("PARSER_RETRIES", "1"))
+# Порог уверенности разбора правилами, с которого LLM не вызывается
+# (1.0 — только полностью однозначные запросы, >1 — всегда LLM)
+LOCAL_PARSE_THRESHOLD = float(os.getenv("LOCAL_PARSE_THRESHOLD", "1.0"))
+# Сообщения, пришедшие к LLM-разбору в пределах окна, уходят в модель
+# одним запросом (0 — без батчинга)
+PARSE_BATCH_WINDOW_MS = float(os.getenv("PARSE_BATCH_WINDOW_MS", "30"))
+PARSE_BATCH_MAX = int(os.getenv("PARSE_BATCH_MAX", "8"))
+# Бюджет токенов ответа на одно сообщение
+PARSE_MAX_TOKENS = 200
+
+PARSE_INSTRUCTIONS = (
+    "Извлеки структуру запроса об акциях технологических компаний "
+    "за 2024 год. Ключи: "
+    "ticker (тикер), tickers (список тикеров для сравнения), "
+    "start_date (YYYY-MM-DD), end_date (YYYY-MM-DD), "
+    "request_type (graph|stats|analysis|compare|top), "
+    "top_n (размер топа), rank_by (growth|decline|volatility|volume). "
+    "Если чего-то нет в сообщении, оставь пустую строку или null."
+)
 
-load_dotenv()
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+# Каким путем разобран запрос: local — правила, cache — кэш ответов
+# LLM, llm — модель, fallback — правила после отказа/ошибки модели
+_routes = {
+    path: metrics.counter("parse_route_total", path=path)
+    for path in ("local", "cache", "llm", "fallback")
+}
 
+#Парсинг пользовательского запроса через Google AI Studio (Gemini).
+# Однозначные запросы разбираются правилами без обращения к LLM.
+async def parse_with_google_ai(user_message):
 
-def _normalize_model_name(model: str | None) -> str:
+    match = match_query(user_message)
+    if match.confidence() >= LOCAL_PARSE_THRESHOLD:
+        _routes["local"].inc()
+        return match.as_dict()
 
-    #Убирает префикс models/ и пробелы, если имя модели скопировано из ListModels.
+    if not GOOGLE_API_KEY:
+        print("GOOGLE_API_KEY не задан, используем fallback парсер")
+        _routes["fallback"].inc()
+        return match.as_dict()
 
-    if not model:
-        return "gemini-2.0-flash-latest"
-    cleaned = model.strip()
-    if cleaned.startswith("models/"):
-        cleaned = cleaned.split("models/", 1)[1]
-    return cleaned
+    cached = parse_cache.get(user_message)
+    if cached is not None:
+        _routes["cache"].inc()
+        return cached
 
+    try:
+        if PARSE_BATCH_WINDOW_MS > 0:
+            # Пакет живет по сроку своего первого сообщения
+            return await parse_batcher.submit((user_message, match))
+        return await _parse_one(user_message, match)
 
-GOOGLE_MODEL = _normalize_model_name(
-    os.getenv("GOOGLE_MODEL", "gemini-2.0-flash-latest")
-)
+    except Exception as e:
+        print(f"Ошибка запроса к Google AI Studio: {e}")
+        _routes["fallback"].inc()
+        return match.as_dict()
 
-#Парсинг пользовательского запроса через Google AI Studio (Gemini).
-def parse_with_google_ai(user_message):
 
-    if not GOOGLE_API_KEY:
-        print("GOOGLE_API_KEY не задан, используем fallback парсер")
-        return fallback_parser(user_message)
+def _parse_payload(text: str, max_tokens: int) -> dict:
+    return {
+        "contents": [{"role": "user", "parts": [{"text": text}]}],
+        "generationConfig": {
+            "temperature": 0.1,
+            "maxOutputTokens": max_tokens,
+        },
+    }
+
 
-    api_url = (
-        f"https://generativelanguage.googleapis.com/v1beta/models/"
-        f"{GOOGLE_MODEL}:generateContent?key={GOOGLE_API_KEY}"
+# Разбор одного сообщения отдельным запросом к модели
+async def _parse_one(user_message, match):
+    prompt = (
+        PARSE_INSTRUCTIONS + " Ответь ТОЛЬКО JSON без пояснений.\n"
+        f'Пользователь говорит: "{user_message}". Верни только JSON.'
     )
 
-    system_prompt = (
-        "Извлеки структуру запроса об акциях технологических компаний "
-        "за 2024 год. Ответь ТОЛЬКО JSON без пояснений. Ключи: "
-        "ticker (тикер), start_date (YYYY-MM-DD), end_date (YYYY-MM-DD), "
-        "request_type (graph|stats|analysis). "
-        "Если чего-то нет в сообщении, оставь пустую строку или null."
+    print("Отправляю запрос к Google AI Studio...")
+    started = time.perf_counter()
+    result, _ = await get_client().generate(
+        [GOOGLE_MODEL],
+        _parse_payload(prompt, PARSE_MAX_TOKENS),
+        retries=PARSER_RETRIES,
+    )
+    if result is None:
+        _routes["fallback"].inc()
+        return match.as_dict()
+
+    print(f"Ответ от Google: {result}")
+    return _accept_parsed(
+        user_message,
+        _extract_json(result),
+        match,
+        time.perf_counter() - started,
     )
-    user_prompt = f'Пользователь говорит: "{user_message}". Верни только JSON.'
-
-    payload = {
-        "contents": [
-            {
-                "role": "user",
-                "parts": [{"text": system_prompt + "\n" + user_prompt}],
-            }
-        ],
-        "generationConfig": {"temperature": 0.1, "maxOutputTokens": 200},
-    }
 
-    try:
-        print("Отправляю запрос к Google AI Studio...")
-        response = requests.post(api_url, json=payload, timeout=30)
-        print(f"Статус ответа: {response.status_code}")
-
-        if response.status_code == 200:
-            result = response.json()
-            print(f"Ответ от Google: {result}")
-            return normalize_parsed_result(
-                user_message,
-                parse_google_response(result, user_message),
-            )
-
-        print(f"Ошибка Google AI API: {response.text}")
-        return fallback_parser(user_message)
 
+# Ответ модели по одному сообщению: нормализация и кэш или, если
+# ответа нет/он битый, разбор правилами
+def _accept_parsed(user_message, parsed, match, latency):
+    if not isinstance(parsed, dict):
+        _routes["fallback"].inc()
+        return match.as_dict()
+
+    _routes["llm"].inc()
+    normalized = normalize_parsed_result(user_message, parsed, match)
+    # В кэш — только реальные ответы модели, не fallback
+    parse_cache.put(user_message, normalized, latency)
+    return normalized
+
+
+# Пакет сообщений одним запросом: модель возвращает JSON-массив
+# объектов с номером сообщения id. Сообщение без корректного объекта
+# в ответе разбирается правилами.
+async def _parse_batch(items):
+    if len(items) == 1:
+        return [await _parse_one(*items[0])]
+
+    lines = "\n".join(
+        f'{number}. "{user_message}"'
+        for number, (user_message, _) in enumerate(items, 1)
+    )
+    prompt = (
+        PARSE_INSTRUCTIONS + " Ответь ТОЛЬКО JSON-массивом без пояснений: "
+        "по объекту на каждое сообщение, в том же порядке, с ключом id "
+        "(номер сообщения).\nСообщения пользователей:\n" + lines
+    )
+
+    print(f"Отправляю пакет из {len(items)} запросов к Google AI Studio...")
+    started = time.perf_counter()
+    try:
+        result, _ = await get_client().generate(
+            [GOOGLE_MODEL],
+            _parse_payload(prompt, PARSE_MAX_TOKENS * len(items)),
+            retries=PARSER_RETRIES,
+        )
     except Exception as e:
-        print(f"Ошибка запроса к Google AI Studio: {e}")
-        return fallback_parser(user_message)
+        print(f"Ошибка пакетного запроса к Google AI Studio: {e}")
+        result = None
+    latency = time.perf_counter() - started
+
+    answers = _extract_json_array(result) if result is not None else []
+    by_id = {}
+    for position, answer in enumerate(answers, 1):
+        if not isinstance(answer, dict):
+            continue
+        try:
+            number = int(answer.get("id") or position)
+        except (TypeError, ValueError):
+            number = position
+        by_id.setdefault(number, answer)
+
+    return [
+        _accept_parsed(user_message, by_id.get(number), match, latency)
+        for number, (user_message, match) in enumerate(items, 1)
+    ]
+
+
+parse_batcher = MicroBatcher(
+    _parse_batch,
+    PARSE_BATCH_WINDOW_MS / 1000,
+    PARSE_BATCH_MAX,
+    name="parse",
+)
 
 
-# Извлечение JSON-блока из ответа Gemini.
-def parse_google_response(api_response, original_message):
+# JSON-массив из ответа Gemini ([] если его нет/он битый)
+def _extract_json_array(api_response) -> list:
+    text = extract_text(api_response)
+    start, end = text.find("["), text.rfind("]")
+    if start < 0 or end < start:
+        return []
+    try:
+        answers = json.loads(text[start:end + 1])
+    except ValueError as e:
+        print(f"Ошибка парсинга пакетного ответа Google: {e}")
+        return []
+    return answers if isinstance(answers, list) else []
+
+
+# JSON-блок из ответа Gemini или None, если его нет/он битый
+def _extract_json(api_response):
 
     try:
-        candidates = api_response.get("candidates", [])
-        if not candidates:
-            return fallback_parser(original_message)
+        if not api_response.get("candidates"):
+            return None
 
-        text = ""
-        for part in candidates[0].get("content", {}).get("parts", []):
-            if "text" in part:
-                text += part["text"]
+        text = extract_text(api_response)
 
         print(f"Сгенерированный текст: {text}")
 
         json_match = re.search(r"\{[^}]*\}", text)
         if not json_match:
-            return fallback_parser(original_message)
+            return None
 
         parsed_data = json.loads(json_match.group())
-        return parsed_data
+        return parsed_data if isinstance(parsed_data, dict) else None
 
     except Exception as e:
         print(f"Ошибка парсинга ответа Google: {e}")
+        return None
+
+
+# Извлечение JSON-блока из ответа Gemini.
+def parse_google_response(api_response, original_message):
+
+    parsed_data = _extract_json(api_response)
+    if parsed_data is None:
         return fallback_parser(original_message)
+    return parsed_data
 
 # Гарантирует наличие ключей, добавляя дефолты из fallback.
-def normalize_parsed_result(user_message, parsed_data):
+# match — уже готовый разбор правилами, если он есть.
+def normalize_parsed_result(user_message, parsed_data, match=None):
 
-    base = fallback_parser(user_message)
     if not isinstance(parsed_data, dict):
-        return base
+        return fallback_parser(user_message)
 
-    return {
-        "ticker": (
-            parsed_data.get("ticker")
-            or parsed_data.get("symbol")
-            or base["ticker"]
-        ),
+    result = {
+        "ticker": parsed_data.get("ticker") or parsed_data.get("symbol"),
         "start_date": (
-            parsed_data.get("start_date")
-            or parsed_data.get("from")
-            or base["start_date"]
-        ),
-        "end_date": (
-            parsed_data.get("end_date")
-            or parsed_data.get("to")
-            or base["end_date"]
+            parsed_data.get("start_date") or parsed_data.get("from")
         ),
+        "end_date": parsed_data.get("end_date") or parsed_data.get("to"),
         "request_type": (
-            parsed_data.get("request_type")
-            or parsed_data.get("type")
-            or base["request_type"]
+            parsed_data.get("request_type") or parsed_data.get("type")
         ),
     }
+    if match is None:
+        match = match_query(user_message)
+    base = match.as_dict()
+    # Правила нужны только для пропущенных моделью полей
+    for key, value in result.items():
+        if not value:
+            result[key] = base[key]
+    # Сравнение и топ правила распознают надежнее модели
+    if match.request_type in MULTI_TICKER_TYPES:
+        result["request_type"] = match.request_type
+
+    tickers = parsed_data.get("tickers")
+    if isinstance(tickers, str):
+        tickers = tickers.split(",")
+    if not isinstance(tickers, list):
+        tickers = base["tickers"]
+    result["tickers"] = [str(t).strip().upper() for t in tickers if t]
+    top_n = str(parsed_data.get("top_n") or "")
+    result["top_n"] = int(top_n) if top_n.isdigit() else base["top_n"]
+    result["rank_by"] = parsed_data.get("rank_by") or base["rank_by"]
+    return result
+
+
+# Типовые периоды 2024 года: месяцы, кварталы, полугодия и весь год
+CANONICAL_PERIODS = [
+    *MONTH_RANGES.values(),
+    *QUARTER_RANGES,
+    *HALF_RANGES,
+    YEAR_RANGE,
+]
+
+parse_cache = ParseCache(ALL_ALIASES)
 
 #Простой парсер на правилах, если не сработает парсинг AI.
+# Один проход предкомпилированного матчера (см. query_matcher).
 def fallback_parser(user_message):
-    companies = {
-        'apple': 'AAPL', 'эпл': 'AAPL',
-        'microsoft': 'MSFT', 'майкрософт': 'MSFT',
-        'google': 'GOOGL', 'гугл': 'GOOGL',
-        'nvidia': 'NVDA', 'нвидиа': 'NVDA',
-        'amd': 'AMD', 'амд': 'AMD',
-        'adobe': 'ADBE', 'адоб': 'ADBE',
-        'cisco': 'CSCO', 'циско': 'CSCO',
-        'salesforce': 'CRM',
-        'uber': 'UBER', 'убер': 'UBER',
-        'zoom': 'ZM', 'зум': 'ZM',
-        'logitech': 'LOGI', 'лоджитек': 'LOGI',
-        'philips': 'PHG', 'филипс': 'PHG',
-        'zi': 'ZI'
-    }
-
-    lower_msg = user_message.lower()
-    ticker = None
-    for company, tkr in companies.items():
-        if company in lower_msg:
-            ticker = tkr
-            break
-
-    start_date, end_date = None, None
-
-    months = {
-        'январ': ('2024-01-01', '2024-01-31'),
-        'феврал': ('2024-02-01', '2024-02-29'),
-        'март': ('2024-03-01', '2024-03-31'),
-        'апрел': ('2024-04-01', '2024-04-30'),
-        'май': ('2024-05-01', '2024-05-31'),
-        'июн': ('2024-06-01', '2024-06-30'),
-        'июл': ('2024-07-01', '2024-07-31'),
-        'август': ('2024-08-01', '2024-08-31'),
-        'сентябр': ('2024-09-01', '2024-09-30'),
-        'октябр': ('2024-10-01', '2024-10-31'),
-        'ноябр': ('2024-11-01', '2024-11-30'),
-        'декабр': ('2024-12-01', '2024-12-31')
-    }
-
-    for month_name, (start, end) in months.items():
-        if month_name in lower_msg:
-            start_date, end_date = start, end
-            break
-
-    if 'перв' in lower_msg and 'полугоди' in lower_msg:
-        start_date, end_date = "2024-01-01", "2024-06-30"
-    elif 'втор' in lower_msg and 'полугоди' in lower_msg:
-        start_date, end_date = "2024-07-01", "2024-12-31"
-    elif '1 квартал' in lower_msg or 'первый квартал' in lower_msg:
-        start_date, end_date = "2024-01-01", "2024-03-31"
-    elif '2 квартал' in lower_msg or 'второй квартал' in lower_msg:
-        start_date, end_date = "2024-04-01", "2024-06-30"
-
-    if start_date is None:
-        start_date, end_date = "2024-01-01", "2024-12-31"
-
-    request_type = "unknown"
-    if any(word in lower_msg for word in ['график', 'покажи']):
-        request_type = "graph"
-    elif 'анализ' in lower_msg or 'аналитика' in lower_msg:
-        request_type = "analysis"
-    elif 'статистик' in lower_msg:
-        request_type = "stats"
-
-    return {
-        "ticker": ticker,
-        "start_date": start_date,
-        "end_date": end_date,
-        "request_type": request_type
-    }
+    return match_query(user_message).as_dict()
@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import weakref
+
+import numpy as np
+
+from comparison import get_matrix
+from price_store import PriceStore, TickerPrices
+
+# Параметры индикаторов
+SMA_PERIODS = (20, 50)
+EMA_FAST = 12
+EMA_SLOW = 26
+MACD_SIGNAL = 9
+RSI_PERIOD = 14
+BOLLINGER_PERIOD = 20
+BOLLINGER_WIDTH = 2.0
+ATR_PERIOD = 14
+BETA_WINDOW = 60
+TRADING_DAYS = 252
+
+# EMA считается блоками: внутри блока — векторно через cumsum, между
+# блоками переносится последнее значение (степени (1 - alpha) в
+# пределах блока не переполняют float64)
+_EMA_BLOCK = 256
+
+
+# Экспоненциальное среднее (adjust=False, первое значение — x[0])
+def ema(values: np.ndarray, alpha: float) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    out = np.empty_like(values)
+    if not len(values):
+        return out
+    prev = values[0]
+    for start in range(0, len(values), _EMA_BLOCK):
+        chunk = values[start:start + _EMA_BLOCK]
+        decay = (1.0 - alpha) ** np.arange(1, len(chunk) + 1)
+        block = decay * (prev + alpha * np.cumsum(chunk / decay))
+        out[start:start + len(chunk)] = block
+        prev = block[-1]
+    return out
+
+
+# Скользящее среднее и стандартное отклонение (ddof=0) по окну
+# period через префиксные суммы; первые period - 1 значений — NaN
+def rolling_mean_std(values: np.ndarray, period: int):
+    values = np.asarray(values, dtype=np.float64)
+    mean = np.full(len(values), np.nan)
+    std = np.full(len(values), np.nan)
+    if len(values) < period:
+        return mean, std
+    shift = values[0]
+    shifted = values - shift
+    s1 = np.concatenate(([0.0], np.cumsum(shifted)))
+    s2 = np.concatenate(([0.0], np.cumsum(shifted * shifted)))
+    w1 = s1[period:] - s1[:-period]
+    w2 = s2[period:] - s2[:-period]
+    mean[period - 1:] = w1 / period + shift
+    std[period - 1:] = np.sqrt(np.maximum(w2 / period - (w1 / period) ** 2, 0))
+    return mean, std
+
+
+# Префиксные суммы с нулем в начале (для сумм по [lo, hi) за O(1))
+def _prefix(values: np.ndarray) -> np.ndarray:
+    return np.concatenate(([0.0], np.cumsum(values)))
+
+
+# Дневная доходность равновзвешенного индекса всех тикеров по датам
+# матрицы цен (первый день — NaN)
+def market_returns(store: PriceStore):
+    market = _markets.get(store)
+    if market is None:
+        matrix = get_matrix(store)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            returns = matrix.close[:, 1:] / matrix.close[:, :-1] - 1
+        has_any = ~np.isnan(returns).all(axis=0)
+        daily = np.full(returns.shape[1], np.nan)
+        daily[has_any] = np.nanmean(returns[:, has_any], axis=0)
+        market = matrix.dates, np.concatenate(([np.nan], daily))
+        _markets[store] = market
+    return market
+
+
+# Индикаторы тикера по всему ряду, посчитанные один раз: значения за
+# любой период — срез массивов, суммы доходностей — префиксные суммы.
+# Ряд — store.daily (одна строка на дату), тот же, что у статистики
+# и матрицы цен сравнения.
+class Indicators:
+
+    def __init__(self, prices: TickerPrices, market_dates, market):
+        self.dates = prices.dates
+        close = prices.close
+        high = prices.high
+        low = prices.low
+        self.close = close
+
+        self.sma = {
+            period: rolling_mean_std(close, period)[0]
+            for period in SMA_PERIODS
+        }
+        self.ema_fast = ema(close, 2 / (EMA_FAST + 1))
+        self.ema_slow = ema(close, 2 / (EMA_SLOW + 1))
+        self.macd = self.ema_fast - self.ema_slow
+        self.macd_signal = ema(self.macd, 2 / (MACD_SIGNAL + 1))
+        self.macd_hist = self.macd - self.macd_signal
+
+        # RSI и ATR — сглаживание Уайлдера (alpha = 1 / period)
+        delta = np.diff(close, prepend=close[0])
+        gain = ema(np.maximum(delta, 0), 1 / RSI_PERIOD)
+        loss = ema(np.maximum(-delta, 0), 1 / RSI_PERIOD)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.rsi = np.where(
+                loss > 0,
+                100 - 100 / (1 + gain / loss),
+                np.where(gain > 0, 100.0, 50.0),
+            )
+        self.rsi[:RSI_PERIOD] = np.nan
+
+        middle, std = rolling_mean_std(close, BOLLINGER_PERIOD)
+        self.bollinger_middle = middle
+        self.bollinger_upper = middle + BOLLINGER_WIDTH * std
+        self.bollinger_lower = middle - BOLLINGER_WIDTH * std
+
+        prev_close = np.concatenate(([close[0]], close[:-1]))
+        true_range = np.maximum.reduce([
+            high - low,
+            np.abs(high - prev_close),
+            np.abs(low - prev_close),
+        ])
+        self.atr = ema(true_range, 1 / ATR_PERIOD)
+        self.atr[:ATR_PERIOD - 1] = np.nan
+
+        # Доходность дня i — к закрытию дня i - 1 (для первого — 0,
+        # в суммы по периоду она не попадает)
+        returns = np.zeros(len(close))
+        returns[1:] = close[1:] / close[:-1] - 1
+        self.returns = returns
+        self.returns_sum = _prefix(returns)
+        self.returns_sq_sum = _prefix(returns * returns)
+
+        # Скользящая бета к равновзвешенному индексу на окне BETA_WINDOW
+        columns = np.searchsorted(market_dates, self.dates)
+        index_returns = np.nan_to_num(market[columns])
+        index_returns[0] = 0.0
+        n = BETA_WINDOW
+        self.beta = np.full(len(close), np.nan)
+        if len(close) > n:
+            s_r = _prefix(returns)
+            s_m = _prefix(index_returns)
+            s_rm = _prefix(returns * index_returns)
+            s_mm = _prefix(index_returns * index_returns)
+            # Окно из n доходностей, заканчивающееся на дне i (i >= n)
+            hi = np.arange(n + 1, len(close) + 1)
+            lo = hi - n
+            sum_r = s_r[hi] - s_r[lo]
+            sum_m = s_m[hi] - s_m[lo]
+            cov = (s_rm[hi] - s_rm[lo]) - sum_r * sum_m / n
+            var = (s_mm[hi] - s_mm[lo]) - sum_m * sum_m / n
+            with np.errstate(invalid="ignore", divide="ignore"):
+                self.beta[n:] = np.where(var > 0, cov / var, np.nan)
+
+    def bounds(self, start_day: int, end_day: int) -> tuple[int, int]:
+        lo = int(np.searchsorted(self.dates, start_day, side="left"))
+        hi = int(np.searchsorted(self.dates, end_day, side="right"))
+        return lo, max(lo, hi)
+
+    # Сводка индикаторов строк [lo, hi): значения на конец периода,
+    # максимальная просадка и коэффициент Шарпа за период
+    def summary(self, lo: int, hi: int) -> dict | None:
+        if hi <= lo:
+            return None
+        last = hi - 1
+
+        close = self.close[lo:hi]
+        peaks = np.maximum.accumulate(close)
+        drawdown = float(np.min(close / peaks - 1)) * 100
+
+        # Доходности внутри периода: дни lo + 1 .. hi - 1
+        n = hi - lo - 1
+        sharpe = np.nan
+        if n > 1:
+            s1 = self.returns_sum[hi] - self.returns_sum[lo + 1]
+            s2 = self.returns_sq_sum[hi] - self.returns_sq_sum[lo + 1]
+            mean = s1 / n
+            variance = max((s2 - s1 * mean) / (n - 1), 0.0)
+            if variance > 0:
+                sharpe = mean / np.sqrt(variance) * np.sqrt(TRADING_DAYS)
+
+        return {
+            **{
+                f'sma_{period}': values[last]
+                for period, values in self.sma.items()
+            },
+            f'ema_{EMA_FAST}': self.ema_fast[last],
+            f'ema_{EMA_SLOW}': self.ema_slow[last],
+            'macd': self.macd[last],
+            'macd_signal': self.macd_signal[last],
+            'macd_hist': self.macd_hist[last],
+            'rsi': self.rsi[last],
+            'bollinger_upper': self.bollinger_upper[last],
+            'bollinger_lower': self.bollinger_lower[last],
+            'atr': self.atr[last],
+            'max_drawdown_percent': drawdown,
+            'sharpe': sharpe,
+            'beta': self.beta[last],
+        }
+
+    def summary_for_days(self, start_day: int, end_day: int):
+        return self.summary(*self.bounds(start_day, end_day))
+
+
+# Индикаторы строятся лениво, по одному набору на тикер хранилища
+_indicators: weakref.WeakKeyDictionary[
+    PriceStore, dict[str, Indicators]
+] = weakref.WeakKeyDictionary()
+_markets: weakref.WeakKeyDictionary[PriceStore, tuple] = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_indicators(store: PriceStore, ticker: str) -> Indicators | None:
+    prices = store.daily(ticker)
+    if prices is None or len(prices) == 0:
+        return None
+    ticker = str(ticker).strip().upper()
+    by_ticker = _indicators.setdefault(store, {})
+    indicators = by_ticker.get(ticker)
+    if indicators is None:
+        indicators = Indicators(prices, *market_returns(store))
+        by_ticker[ticker] = indicators
+    return indicators
@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import asyncio
+import importlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+import metrics
+
+# Очередь тяжелых задач (графики, статистика) в sqlite: фронтенд бота
+# кладет задачу, процессы worker.py забирают ее, выполняют и пишут
+# результат обратно. Внешний брокер не нужен, воркеры могут жить
+# как в отдельном сервисе, так и в дочерних процессах бота.
+# Аргументы и результаты сериализуются pickle — файл очереди должен
+# быть доступен только самому боту.
+JOB_QUEUE_DB = os.getenv("JOB_QUEUE_DB", "jobs.db")
+# Сколько фронтенд ждет результат задачи
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "120"))
+# Задача, которую воркер держит дольше, считается потерянной (воркер
+# упал) и возвращается в очередь — заметно раньше JOB_TIMEOUT, чтобы
+# повторный запуск еще кто-то ждал
+JOB_REQUEUE_SECONDS = float(
+    os.getenv("JOB_REQUEUE_SECONDS", str(JOB_TIMEOUT / 4))
+)
+JOB_POLL_MIN = 0.002
+JOB_POLL_MAX = 0.05
+
+
+class JobError(RuntimeError):
+    pass
+
+
+# "module:function" для функции уровня модуля и обратно
+def func_path(func) -> str:
+    return f"{func.__module__}:{func.__qualname__}"
+
+
+def resolve_func(path: str):
+    module_name, name = path.split(":", 1)
+    obj = importlib.import_module(module_name)
+    for part in name.split("."):
+        obj = getattr(obj, part)
+    return obj
+
+
+class JobQueue:
+
+    def __init__(self, db_path: str = JOB_QUEUE_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "stage TEXT NOT NULL, func TEXT NOT NULL, "
+                "payload BLOB NOT NULL, status TEXT NOT NULL, "
+                "result BLOB, error TEXT, worker TEXT, "
+                "created REAL NOT NULL, claimed REAL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_jobs_status "
+                "ON jobs (status, id)"
+            )
+
+    # Соединение на поток (sqlite-соединения нельзя делить между
+    # потоками, а после fork — между процессами)
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        pid = getattr(self._local, "pid", None)
+        if conn is None or pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def submit(self, stage: str, func, args=(), kwargs=None) -> int:
+        payload = pickle.dumps((args, kwargs or {}))
+        with self._conn() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (stage, func, payload, status, created) "
+                "VALUES (?, ?, ?, 'queued', ?)",
+                (stage, func_path(func), payload, time.time()),
+            )
+        return cursor.lastrowid
+
+    # Следующая задача для воркера: (id, функция, payload) или None
+    def claim(self, worker: str):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, func, payload FROM jobs "
+                "WHERE status = 'queued' ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, "
+                    "claimed = ? WHERE id = ?",
+                    (worker, time.time(), row[0]),
+                )
+        return row
+
+    def finish(self, job_id: int, result=None, error: str | None = None):
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ? "
+                "WHERE id = ?",
+                (
+                    "failed" if error else "done",
+                    None if error else pickle.dumps(result),
+                    error,
+                    job_id,
+                ),
+            )
+
+    # Готовые задачи из job_ids: [(id, статус, результат, ошибка)].
+    # Забранные результаты удаляются из очереди.
+    def collect(self, job_ids) -> list[tuple]:
+        if not job_ids:
+            return []
+        marks = ",".join("?" * len(job_ids))
+        with self._conn() as conn:
+            rows = conn.execute(
+                f"SELECT id, status, result, error FROM jobs "
+                f"WHERE id IN ({marks}) AND status IN ('done', 'failed')",
+                list(job_ids),
+            ).fetchall()
+            conn.executemany(
+                "DELETE FROM jobs WHERE id = ?",
+                [(row[0],) for row in rows],
+            )
+        return rows
+
+    # Возврат в очередь задач упавших воркеров; строки старше
+    # 2 * JOB_TIMEOUT (их никто уже не ждет: фронтенд перезапустился)
+    # удаляются
+    def requeue_stale(self, timeout: float = JOB_REQUEUE_SECONDS) -> int:
+        now = time.time()
+        with self._conn() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL "
+                "WHERE status = 'running' AND claimed < ?",
+                (now - timeout,),
+            )
+            conn.execute(
+                "DELETE FROM jobs WHERE created < ?",
+                (now - 2 * JOB_TIMEOUT,),
+            )
+        return cursor.rowcount
+
+    # Возврат в очередь задач воркера, процесс которого завершился
+    def requeue_worker(self, worker: str) -> int:
+        with self._conn() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL "
+                "WHERE status = 'running' AND worker = ?",
+                (worker,),
+            )
+        return cursor.rowcount
+
+    # Задача, результат которой больше не нужен (ожидание отменено или
+    # истекло): удаляется, даже если воркер уже ее выполняет
+    def cancel(self, job_id: int):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def depth(self) -> int:
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued'"
+        ).fetchone()[0]
+
+
+# Сторона фронтенда: задача отправляется в очередь, результат
+# ожидается как обычная корутина (не дольше JOB_TIMEOUT). Готовые
+# результаты собирает одна фоновая задача на все ожидающие вызовы.
+class JobClient:
+
+    def __init__(self, queue: JobQueue):
+        self.queue = queue
+        self._waiters: dict[int, asyncio.Future] = {}
+        self._poller: asyncio.Task | None = None
+
+    async def run(self, stage: str, func, *args, **kwargs):
+        metrics.counter("jobs_submitted_total", stage=stage).inc()
+        job_id = await asyncio.to_thread(
+            self.queue.submit,
+            stage,
+            func,
+            args,
+            kwargs,
+        )
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[job_id] = future
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll())
+        try:
+            return await asyncio.wait_for(future, JOB_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._cancel(job_id)
+            metrics.counter("jobs_failed_total", stage=stage).inc()
+            raise JobError(
+                f"задача {job_id} не выполнена за {JOB_TIMEOUT:g} с"
+            ) from None
+        except asyncio.CancelledError:
+            self._cancel(job_id)
+            raise
+        except JobError:
+            metrics.counter("jobs_failed_total", stage=stage).inc()
+            raise
+
+    # Удаление строки без ожидания: вызывается и из отменяемой задачи
+    def _cancel(self, job_id: int):
+        self._waiters.pop(job_id, None)
+        asyncio.get_running_loop().run_in_executor(
+            None,
+            self.queue.cancel,
+            job_id,
+        )
+
+    async def _poll(self):
+        delay = JOB_POLL_MIN
+        while self._waiters:
+            rows = await asyncio.to_thread(
+                self.queue.collect,
+                list(self._waiters),
+            )
+            for job_id, status, result, error in rows:
+                future = self._waiters.pop(job_id, None)
+                if future is None or future.done():
+                    continue
+                if status == "done":
+                    future.set_result(pickle.loads(result))
+                else:
+                    future.set_exception(JobError(error))
+            # Отмененные ожидания больше не опрашиваем
+            for job_id, future in list(self._waiters.items()):
+                if future.done():
+                    del self._waiters[job_id]
+            delay = JOB_POLL_MIN if rows else min(delay * 2, JOB_POLL_MAX)
+            await asyncio.sleep(delay)
@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+
+
+# Простой реестр метрик процесса: счетчики, gauge и гистограммы с
+# метками. Метрика идентифицируется именем и набором меток, например
+# counter("stage_completed_total", stage="chart").
+_lock = threading.Lock()
+_registry: dict[tuple, "_Metric"] = {}
+# Функции, обновляющие gauge перед выдачей метрик (глубина очередей)
+_collectors: list = []
+
+# Границы бакетов по умолчанию — секунды
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, labels: dict):
+        self.name = name
+        self.labels = labels
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float):
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self._value -= amount
+
+
+# Гистограмма: число наблюдений в каждом бакете (<= границы), сумма
+# и количество — как histogram в Prometheus
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, labels: dict, buckets=LATENCY_BUCKETS):
+        super().__init__(name, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._value += value
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    # Накопленные значения по бакетам: [(граница, число <= границы)]
+    def cumulative(self) -> list[tuple[float, int]]:
+        with self._lock:
+            counts = list(self._counts)
+        result = []
+        total = 0
+        for bound, count in zip((*self.buckets, float("inf")), counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+def _get(cls, name: str, labels: dict, **options):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        metric = _registry.get(key)
+        if metric is None:
+            metric = cls(name, dict(labels), **options)
+            _registry[key] = metric
+        elif not isinstance(metric, cls):
+            raise TypeError(
+                f"Метрика {name} уже зарегистрирована как {metric.kind}"
+            )
+        return metric
+
+
+def counter(name: str, **labels) -> Counter:
+    return _get(Counter, name, labels)
+
+
+def gauge(name: str, **labels) -> Gauge:
+    return _get(Gauge, name, labels)
+
+
+def histogram(name: str, buckets=LATENCY_BUCKETS, **labels) -> Histogram:
+    return _get(Histogram, name, labels, buckets=buckets)
+
+
+def register_collector(func):
+    _collectors.append(func)
+    return func
+
+
+def _collect() -> list[_Metric]:
+    for func in list(_collectors):
+        try:
+            func()
+        except Exception as e:
+            print(f"Ошибка сборщика метрик: {e}")
+    with _lock:
+        return list(_registry.values())
+
+
+def _label_str(labels: dict, sep: str = ",", quote: bool = False) -> str:
+    return sep.join(
+        f'{k}="{v}"' if quote else f"{k}={v}"
+        for k, v in sorted(labels.items())
+    )
+
+
+# Снимок всех метрик: {"name{label=value}": значение}; для гистограмм
+# — сумма и количество наблюдений
+def snapshot() -> dict[str, float]:
+    result = {}
+    for metric in _collect():
+        suffix = f"{{{_label_str(metric.labels)}}}" if metric.labels else ""
+        if isinstance(metric, Histogram):
+            result[f"{metric.name}_sum{suffix}"] = metric.value
+            result[f"{metric.name}_count{suffix}"] = metric.count
+        else:
+            result[f"{metric.name}{suffix}"] = metric.value
+    return result
+
+
+def _sample(name: str, labels: dict, value) -> str:
+    if labels:
+        return f"{name}{{{_label_str(labels, quote=True)}}} {value}"
+    return f"{name} {value}"
+
+
+# Все метрики в текстовом формате Prometheus (для /metrics)
+def render_prometheus() -> str:
+    by_name: dict[str, list[_Metric]] = {}
+    for metric in _collect():
+        by_name.setdefault(metric.name, []).append(metric)
+
+    lines = []
+    for name in sorted(by_name):
+        family = by_name[name]
+        lines.append(f"# TYPE {name} {family[0].kind}")
+        for metric in family:
+            if not isinstance(metric, Histogram):
+                lines.append(_sample(name, metric.labels, metric.value))
+                continue
+            for bound, count in metric.cumulative():
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = {**metric.labels, "le": le}
+                lines.append(_sample(f"{name}_bucket", bucket_labels, count))
+            lines.append(_sample(f"{name}_sum", metric.labels, metric.value))
+            lines.append(_sample(f"{name}_count", metric.labels, metric.count))
+    return "\n".join(lines) + "\n"
+
+
+# Тайминги этапов текущего запроса: span() пишет длительность в
+# гистограмму span_seconds и, если запрос собирает спаны
+# (collect_spans), в его список. Контекст наследуют задачи asyncio.
+_spans: contextvars.ContextVar[list | None] = contextvars.ContextVar(
+    "spans",
+    default=None,
+)
+
+
+@contextlib.contextmanager
+def collect_spans():
+    spans: list = []
+    token = _spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _spans.reset(token)
+
+
+@contextlib.contextmanager
+def span(name: str, **labels):
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        histogram("span_seconds", span=name, **labels).observe(elapsed)
+        spans = _spans.get()
+        if spans is not None:
+            spans.append({
+                "span": name,
+                **labels,
+                "ms": round(elapsed * 1000, 2),
+                "status": status,
+            })
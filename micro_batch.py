@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+
+import metrics
+
+
+# Микробатчинг: элементы, пришедшие в течение window секунд (или
+# пока их не наберется max_size), обрабатываются одним вызовом
+# func(items) -> results той же длины; каждый ожидающий получает
+# свой результат. Исключение func получают все ожидающие пакета.
+# Пакет выполняется в контексте (contextvars) своего первого элемента
+# — например, со сроком его запроса, — как бы пакет ни закрылся.
+class MicroBatcher:
+
+    def __init__(self, func, window: float, max_size: int, name: str):
+        self.func = func
+        self.window = window
+        self.max_size = max(1, max_size)
+        self._pending: list[tuple[object, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._context: contextvars.Context | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self._sizes = metrics.histogram(
+            "batch_size",
+            buckets=(1, 2, 4, 8, 16, 32, 64),
+            batch=name,
+        )
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if not self._pending:
+            self._context = contextvars.copy_context()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        context, self._context = self._context, None
+        if not batch:
+            return
+        self._sizes.observe(len(batch))
+        task = asyncio.get_running_loop().create_task(
+            self._run(batch),
+            context=context,
+        )
+        # Ссылка на задачу, чтобы ее не собрал сборщик мусора
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        error = None
+        try:
+            results = await self.func([item for item, _ in batch])
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            if len(results) != len(batch):
+                error = RuntimeError(
+                    f"пакет из {len(batch)} элементов: "
+                    f"{len(results)} результатов"
+                )
+        except Exception as e:
+            error = e
+        finally:
+            # Ожидающие без результата (ошибка, нехватка результатов,
+            # отмена задачи) не должны зависнуть
+            for _, future in batch:
+                if not future.done():
+                    if error is None:
+                        future.cancel()
+                    else:
+                        future.set_exception(error)
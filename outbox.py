@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import io
+import itertools
+import logging
+import os
+import time
+
+from telegram.error import RetryAfter
+
+import metrics
+from overload import TokenBucket
+
+# Исходящие сообщения Telegram идут через очередь с учетом лимитов
+# Bot API: не больше ~1 сообщения в секунду в чат (с небольшим
+# запасом) и ~30 в секунду на бота. Сообщения одного чата уходят по
+# порядку, разных чатов — параллельно; обработчик не ждет доставки,
+# если ему не нужен ответ Telegram.
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+OUTBOX_CHAT_BURST = float(os.getenv("OUTBOX_CHAT_BURST", "3"))
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))
+# Повторов после RetryAfter (флуд-контроль Telegram)
+OUTBOX_RETRIES = int(os.getenv("OUTBOX_RETRIES", "3"))
+# Сколько чатов держать в памяти; сверх — удаляются простаивающие
+OUTBOX_MAX_CHATS = 10000
+
+# Приоритеты: сообщения и правки раньше индикатора "печатает"
+PRIORITY_MESSAGE = 0
+PRIORITY_ACTION = 1
+
+_sent = {
+    kind: metrics.counter("outbox_sent_total", kind=kind)
+    for kind in ("text", "photo", "edit", "action")
+}
+_merged = metrics.counter("outbox_merged_total")
+_dropped = metrics.counter("outbox_dropped_total")
+_retry_after = metrics.counter("outbox_retry_after_total")
+_queued = metrics.gauge("outbox_queued")
+_wait = metrics.histogram("outbox_wait_seconds")
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = getattr(error.retry_after, "total_seconds", None)
+    return retry_after() if retry_after else float(error.retry_after)
+
+
+# Отправка в очереди: await возвращает ответ Telegram (Message).
+# Пока она не ушла, ее текст можно заменить — так статус "Генерирую..."
+# и итоговый ответ становятся одним сообщением.
+class Delivery:
+
+    def __init__(self, kind: str, priority: int, seq: int, **fields):
+        self.kind = kind
+        self.priority = priority
+        self.seq = seq
+        self.fields = fields
+        self.started = False
+        self.enqueued = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+        # Исключение логируется очередью; неожиданное не попадет в
+        # "exception was never retrieved"
+        self.future.add_done_callback(
+            lambda f: f.cancelled() or f.exception()
+        )
+
+    def __lt__(self, other: Delivery) -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def __await__(self):
+        return asyncio.shield(self.future).__await__()
+
+
+class _Chat:
+    __slots__ = ("queue", "bucket", "task", "edits", "action")
+
+    def __init__(self):
+        self.queue: list[Delivery] = []
+        self.bucket = TokenBucket(OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST)
+        self.task: asyncio.Task | None = None
+        # Ожидающая правка по сообщению (id отправки) и индикатор
+        self.edits: dict[int, Delivery] = {}
+        self.action: Delivery | None = None
+
+
+class Outbox:
+
+    def __init__(
+        self,
+        global_rate: float = OUTBOX_GLOBAL_RATE,
+        max_chats: int = OUTBOX_MAX_CHATS,
+    ):
+        self._global = TokenBucket(global_rate, global_rate)
+        self.max_chats = max_chats
+        self._chats: dict[int, _Chat] = {}
+        self._seq = itertools.count()
+
+    def reply_text(self, message, text: str) -> Delivery:
+        return self._put(message, "text", PRIORITY_MESSAGE, text=text)
+
+    def reply_photo(self, message, photo, caption: str) -> Delivery:
+        return self._put(
+            message,
+            "photo",
+            PRIORITY_MESSAGE,
+            photo=photo,
+            caption=caption,
+        )
+
+    # Правка отправленного (или еще ждущего в очереди) сообщения.
+    # Не ушедшее сообщение получает новый текст вместо правки,
+    # несколько ожидающих правок схлопываются в последнюю.
+    def edit_text(self, target: Delivery, text: str) -> Delivery:
+        chat = self._chats.get(target.fields["chat_id"])
+        if not target.started:
+            target.fields["text"] = text
+            _merged.inc()
+            return target
+        pending = chat.edits.get(id(target)) if chat else None
+        if pending is not None and not pending.started:
+            pending.fields["text"] = text
+            _merged.inc()
+            return pending
+        edit = self._put(
+            target.fields["message"],
+            "edit",
+            PRIORITY_MESSAGE,
+            text=text,
+            target=target,
+        )
+        self._chats[edit.fields["chat_id"]].edits[id(target)] = edit
+        return edit
+
+    # Индикатор "печатает"/"отправляет фото": не больше одного в
+    # очереди чата; отбрасывается, если за ним есть сообщения или
+    # лимит чата исчерпан
+    def chat_action(self, message, action: str):
+        chat = self._chats.get(message.chat_id)
+        if chat is not None and chat.action is not None:
+            _dropped.inc()
+            return
+        delivery = self._put(
+            message,
+            "action",
+            PRIORITY_ACTION,
+            action=action,
+        )
+        self._chats[message.chat_id].action = delivery
+
+    # Дождаться отправки всего, что поставлено в очередь чата
+    async def drain(self, chat_id):
+        chat = self._chats.get(chat_id)
+        if chat is not None and chat.task is not None:
+            await asyncio.shield(chat.task)
+
+    def _put(self, message, kind, priority, **fields) -> Delivery:
+        chat_id = message.chat_id
+        delivery = Delivery(
+            kind,
+            priority,
+            next(self._seq),
+            message=message,
+            chat_id=chat_id,
+            **fields,
+        )
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            if len(self._chats) >= self.max_chats:
+                self._prune()
+            chat = self._chats[chat_id] = _Chat()
+        heapq.heappush(chat.queue, delivery)
+        _queued.inc()
+        if chat.task is None or chat.task.done():
+            chat.task = asyncio.create_task(self._drain_chat(chat))
+        return delivery
+
+    # Удаляет простаивающие чаты, чей лимит успел восстановиться
+    def _prune(self):
+        now = time.monotonic()
+        refill = OUTBOX_CHAT_BURST / OUTBOX_CHAT_RATE
+        self._chats = {
+            chat_id: chat
+            for chat_id, chat in self._chats.items()
+            if (chat.task is not None and not chat.task.done())
+            or now - chat.bucket.updated < refill
+        }
+
+    # Отправка очереди чата по одной, пока она не опустеет
+    async def _drain_chat(self, chat: _Chat):
+        while chat.queue:
+            delivery = heapq.heappop(chat.queue)
+            _queued.dec()
+            if delivery.kind == "action":
+                chat.action = None
+                if chat.queue or not self._ready(chat):
+                    _dropped.inc()
+                    delivery.future.set_result(None)
+                    continue
+            else:
+                await self._take(chat.bucket)
+                await self._take(self._global)
+            delivery.started = True
+            if delivery.kind == "edit":
+                chat.edits.pop(id(delivery.fields["target"]), None)
+            _wait.observe(time.monotonic() - delivery.enqueued)
+            await self._deliver(delivery)
+
+    # Индикатор не тратит лимит чата, но уходит, только если он есть
+    def _ready(self, chat: _Chat) -> bool:
+        now = time.monotonic()
+        bucket = chat.bucket
+        tokens = bucket.tokens + (now - bucket.updated) * bucket.rate
+        return tokens >= 1 and self._global.take(now)
+
+    @staticmethod
+    async def _take(bucket: TokenBucket):
+        while not bucket.take(time.monotonic()):
+            await asyncio.sleep((1 - bucket.tokens) / bucket.rate)
+
+    async def _deliver(self, delivery: Delivery):
+        for attempt in range(OUTBOX_RETRIES + 1):
+            try:
+                result = await self._call(delivery)
+            except RetryAfter as e:
+                _retry_after.inc()
+                if attempt == OUTBOX_RETRIES:
+                    self._fail(delivery, e)
+                    return
+                # Флуд-контроль держит весь чат: ждем здесь же
+                await asyncio.sleep(retry_after_seconds(e))
+            except Exception as e:
+                self._fail(delivery, e)
+                return
+            else:
+                _sent[delivery.kind].inc()
+                delivery.future.set_result(result)
+                return
+
+    @staticmethod
+    async def _call(delivery: Delivery):
+        fields = delivery.fields
+        message = fields["message"]
+        if delivery.kind == "text":
+            return await message.reply_text(fields["text"])
+        if delivery.kind == "photo":
+            photo = fields["photo"]
+            if isinstance(photo, bytes):
+                photo = io.BytesIO(photo)
+            return await message.reply_photo(
+                photo=photo,
+                caption=fields["caption"],
+            )
+        if delivery.kind == "edit":
+            sent = await fields["target"]
+            if fields["target"].fields.get("text") == fields["text"]:
+                return sent
+            result = await sent.edit_text(fields["text"])
+            fields["target"].fields["text"] = fields["text"]
+            return result
+        return await message.reply_chat_action(action=fields["action"])
+
+    @staticmethod
+    def _fail(delivery: Delivery, error: Exception):
+        logging.warning(
+            f"Не удалось отправить {delivery.kind} в чат "
+            f"{delivery.fields['chat_id']}: {error!r}"
+        )
+        delivery.future.set_exception(error)
+
+
+outbox = Outbox()
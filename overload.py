@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import os
+import threading
+import time
+
+import metrics
+
+# Защита от перегрузки: лимит сообщений на чат (token bucket),
+# автомат размыкания на модель и бюджет времени запроса. Когда бюджет
+# исчерпан или модель "лежит", бот сразу отвечает правилами
+# (fallback_parser / fallback_analysis), а не ждет таймаутов Gemini.
+CHAT_RATE_PER_MIN = float(os.getenv("CHAT_RATE_PER_MIN", "20"))
+CHAT_BURST = float(os.getenv("CHAT_BURST", "5"))
+# Подряд неудачных запросов к модели до размыкания и пауза до пробного
+CIRCUIT_FAILURES = int(os.getenv("CIRCUIT_FAILURES", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+# Бюджеты от прихода сообщения: после них LLM не вызывается
+PARSE_BUDGET_SECONDS = float(os.getenv("PARSE_BUDGET_SECONDS", "3"))
+ANALYSIS_BUDGET_SECONDS = float(os.getenv("ANALYSIS_BUDGET_SECONDS", "15"))
+
+_shed = {
+    reason: metrics.counter("overload_shed_total", reason=reason)
+    for reason in ("chat_rate", "budget", "circuit")
+}
+
+
+# Запрос к модели отклонен без обращения к ней
+class Overloaded(RuntimeError):
+    pass
+
+
+def shed(reason: str, message: str):
+    _shed[reason].inc()
+    return Overloaded(message)
+
+
+# Token bucket: rate токенов в секунду, не больше burst в запасе
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(
+            self.burst,
+            self.tokens + (now - self.updated) * self.rate,
+        )
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+# Лимит сообщений на чат. Полные (давно молчащие) ведра удаляются,
+# когда чатов становится больше max_chats.
+class ChatLimiter:
+
+    def __init__(
+        self,
+        per_minute: float = CHAT_RATE_PER_MIN,
+        burst: float = CHAT_BURST,
+        max_chats: int = 10000,
+    ):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.max_chats = max_chats
+        self._buckets: dict = {}
+
+    def allow(self, chat_id) -> bool:
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= self.max_chats:
+                self._prune(now)
+            bucket = TokenBucket(self.rate, self.burst)
+            self._buckets[chat_id] = bucket
+        if bucket.take(now):
+            return True
+        _shed["chat_rate"].inc()
+        return False
+
+    def _prune(self, now: float):
+        refill = self.burst / self.rate
+        self._buckets = {
+            chat_id: bucket
+            for chat_id, bucket in self._buckets.items()
+            if now - bucket.updated < refill
+        }
+
+
+# Автомат размыкания модели: после failures неудач подряд запросы не
+# отправляются reset секунд, затем пропускается один пробный; его
+# успех замыкает автомат, неудача — размыкает снова.
+class CircuitBreaker:
+
+    def __init__(
+        self,
+        name: str,
+        failures: int = CIRCUIT_FAILURES,
+        reset: float = CIRCUIT_RESET_SECONDS,
+    ):
+        self.name = name
+        self.failures = failures
+        self.reset = reset
+        self.state = "closed"
+        self._count = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._probe_at = 0.0
+        self._lock = threading.Lock()
+        self._gauge = metrics.gauge("circuit_open", model=name)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if self.state == "open":
+                if now - self._opened_at < self.reset:
+                    return False
+                self.state = "half_open"
+                self._probing = False
+            # Пробный запрос, который так и не завершился (отменен),
+            # через reset секунд уступает место следующему
+            if self._probing and now - self._probe_at < self.reset:
+                return False
+            self._probing = True
+            self._probe_at = now
+            return True
+
+    def success(self):
+        with self._lock:
+            self.state = "closed"
+            self._count = 0
+            self._probing = False
+            self._gauge.set(0)
+
+    def failure(self):
+        with self._lock:
+            self._count += 1
+            if self.state == "half_open" or self._count >= self.failures:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probing = False
+                self._gauge.set(1)
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(model: str) -> CircuitBreaker:
+    with _breakers_lock:
+        circuit = _breakers.get(model)
+        if circuit is None:
+            circuit = CircuitBreaker(model)
+            _breakers[model] = circuit
+        return circuit
+
+
+# Крайний срок текущего запроса (time.monotonic) — наследуется
+# задачами asyncio, созданными внутри deadline()
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar(
+    "deadline",
+    default=None,
+)
+
+
+@contextlib.contextmanager
+def deadline(at: float):
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(at, current))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+# Остаток бюджета в секундах или None, если срока нет
+def remaining() -> float | None:
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
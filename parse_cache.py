@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import os
+import re
+
+import metrics
+from ttl_cache import TTLCache
+
+PARSE_CACHE_ITEMS = int(os.getenv("PARSE_CACHE_ITEMS", "5000"))
+PARSE_CACHE_TTL = float(os.getenv("PARSE_CACHE_TTL", str(7 * 24 * 3600)))
+PARSE_CACHE_DB = os.getenv("PARSE_CACHE_DB")
+
+_WORD_RE = re.compile(r"[0-9a-zа-яё]+")
+# Двухбуквенные алиасы (zi) сравниваются только целым словом, остальные
+# — по началу слова, чтобы "эпла", "гугла", "нвидии" совпадали
+_MIN_PREFIX_ALIAS = 3
+
+
+# Нормализатор сообщений: нижний регистр, без пунктуации и лишних
+# пробелов, алиасы компаний заменены тикером.
+# "График Эпла за март!" и "график apple  за март" дают один ключ.
+class MessageNormalizer:
+
+    def __init__(self, aliases: dict[str, str]):
+        self.aliases = aliases
+        self.tickers = {ticker.lower(): ticker for ticker in aliases.values()}
+        self._words: dict[str, str] = {}
+
+    def _canonical_word(self, word: str) -> str:
+        cached = self._words.get(word)
+        if cached is not None:
+            return cached
+        canonical = self.tickers.get(word, word)
+        if canonical == word:
+            for alias, ticker in self.aliases.items():
+                if word == alias or (
+                    len(alias) >= _MIN_PREFIX_ALIAS and word.startswith(alias)
+                ):
+                    canonical = ticker
+                    break
+        if len(self._words) < 50000:
+            self._words[word] = canonical
+        return canonical
+
+    def __call__(self, user_message: str) -> str:
+        words = _WORD_RE.findall(user_message.lower().replace("ё", "е"))
+        return " ".join(self._canonical_word(word) for word in words)
+
+
+# Кэш результатов разбора запросов: попадание не ходит в LLM вовсе.
+# Экономия времени считается по скользящему среднему латентности LLM.
+class ParseCache:
+
+    def __init__(
+        self,
+        aliases: dict[str, str],
+        max_items: int = PARSE_CACHE_ITEMS,
+        ttl: float = PARSE_CACHE_TTL,
+        db_path: str | None = PARSE_CACHE_DB,
+    ):
+        self.normalize = MessageNormalizer(aliases)
+        self._cache = TTLCache(max_items, ttl, db_path, table="parse_cache")
+        self._hits = metrics.counter("parse_cache_hits_total")
+        self._misses = metrics.counter("parse_cache_misses_total")
+        self._saved = metrics.counter("parse_cache_saved_seconds_total")
+        self._llm_latency = 0.0
+
+    def get(self, user_message: str) -> dict | None:
+        result = self._cache.get(self.normalize(user_message))
+        if result is None:
+            self._misses.inc()
+            return None
+        self._hits.inc()
+        self._saved.inc(self._llm_latency)
+        return dict(result)
+
+    def put(self, user_message: str, result: dict, llm_seconds: float):
+        # EWMA латентности LLM для оценки сэкономленного времени
+        if self._llm_latency:
+            self._llm_latency = 0.8 * self._llm_latency + 0.2 * llm_seconds
+        else:
+            self._llm_latency = llm_seconds
+        self._cache.set(self.normalize(user_message), dict(result))
+
+    def stats(self) -> dict[str, float]:
+        hits, misses = self._hits.value, self._misses.value
+        total = hits + misses
+        return {
+            "size": len(self._cache),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+            "saved_seconds": self._saved.value,
+            "llm_latency_ewma": self._llm_latency,
+        }
+
@@ -0,0 +1,319 @@
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+import threading
+
+import numpy as np
+
+DATA_PATH = "tech_stocks_2024_cleaned.csv"
+PRICE_COLUMNS = ("Open", "High", "Low", "Close", "Volume")
+
+# Бинарная копия CSV для mmap: все процессы читают одни и те же
+# страницы файла без разбора CSV и без копий в памяти
+BINARY_PATH = os.getenv("PRICES_BIN_PATH", "prices.bin")
+BINARY_MAGIC = b"TSPRICE\0"
+BINARY_VERSION = 1
+# Выравнивание колонок в файле (под кэш-линию и float64)
+_ALIGN = 64
+_HEADER = struct.Struct("<8sII")
+
+
+# Перевод 'YYYY-MM-DD[ ...]' в число дней от 1970-01-01
+def date_to_day(value: str) -> int:
+    return int(np.datetime64(str(value)[:10], "D").astype(np.int64))
+
+
+def day_to_date(day: int) -> str:
+    return str(np.datetime64(int(day), "D"))
+
+
+# Цены одного тикера: непрерывные массивы, отсортированные по дате.
+# dates — int64 дни, labels — исходные строки дат из CSV,
+# open/high/low/close/volume — float64.
+class TickerPrices:
+    __slots__ = ("dates", "labels", "open", "high", "low", "close", "volume")
+
+    def __init__(self, dates, labels, open, high, low, close, volume):
+        self.dates = dates
+        self.labels = labels
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    # Исходная строка даты (в бинарном формате хранится байтами)
+    def label(self, index: int) -> str:
+        value = self.labels[index]
+        return value.decode() if isinstance(value, bytes) else str(value)
+
+    # Индексы [lo, hi) строк в диапазоне дат включительно
+    def bounds(self, start_day: int, end_day: int) -> tuple[int, int]:
+        lo = int(np.searchsorted(self.dates, start_day, side="left"))
+        hi = int(np.searchsorted(self.dates, end_day, side="right"))
+        return lo, max(lo, hi)
+
+    # Срез без копирования: все поля — view исходных массивов
+    def slice(self, lo: int, hi: int) -> "TickerPrices":
+        return TickerPrices(*(getattr(self, f)[lo:hi] for f in self.__slots__))
+
+    # Одна строка на дату: в CSV есть дни, выгруженные дважды (та же
+    # цена, чуть другой объем); остается последняя строка дня. Без
+    # повторов возвращает себя, без копий.
+    def unique_dates(self) -> "TickerPrices":
+        dates = self.dates
+        keep = np.ones(len(dates), dtype=bool)
+        keep[:-1] = dates[1:] != dates[:-1]
+        if keep.all():
+            return self
+        return TickerPrices(*(getattr(self, f)[keep] for f in self.__slots__))
+
+
+# Хранилище цен в памяти: CSV читается один раз, дальше запросы по
+# диапазону — это бинарный поиск и срез массивов.
+class PriceStore:
+
+    def __init__(self, tickers: dict[str, TickerPrices]):
+        self._tickers = tickers
+        self._daily: dict[str, TickerPrices] = {}
+        # Отпечаток CSV, из которого собраны данные (для бинарного файла)
+        self.source: dict | None = None
+
+    @classmethod
+    def from_csv(cls, path: str = DATA_PATH) -> "PriceStore":
+        # pandas нужен только для сборки из CSV, при готовом бинарном
+        # файле его импорт не тормозит старт
+        import pandas as pd
+
+        df = pd.read_csv(
+            path,
+            usecols=["Date", "Ticker", *PRICE_COLUMNS],
+            dtype={col: "float64" for col in PRICE_COLUMNS},
+        )
+        return cls.from_frame(df)
+
+    @classmethod
+    def from_frame(cls, df) -> "PriceStore":
+        labels = df["Date"].astype(str).to_numpy()
+        days = (
+            labels.astype("U10").astype("datetime64[D]").astype(np.int64)
+        )
+
+        tickers = {}
+        for ticker, idx in df.groupby("Ticker", sort=True).indices.items():
+            order = idx[np.argsort(days[idx], kind="stable")]
+            tickers[ticker] = TickerPrices(
+                np.ascontiguousarray(days[order]),
+                labels[order],
+                *(
+                    np.ascontiguousarray(
+                        df[col].to_numpy(dtype=np.float64)[order]
+                    )
+                    for col in PRICE_COLUMNS
+                ),
+            )
+        return cls(tickers)
+
+    # Хранилище поверх mmap бинарного файла: массивы — read-only view
+    # страниц файла, общих для всех процессов
+    @classmethod
+    def from_binary(cls, path: str = BINARY_PATH) -> "PriceStore":
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = read_binary_header(buffer)
+        if header is None:
+            raise ValueError(f"Неподдерживаемый формат файла цен: {path}")
+
+        columns = {
+            name: np.frombuffer(
+                buffer,
+                dtype=np.dtype(spec["dtype"]),
+                count=header["rows"],
+                offset=spec["offset"],
+            )
+            for name, spec in header["columns"].items()
+        }
+        tickers = {}
+        for ticker, (start, count) in header["tickers"].items():
+            stop = start + count
+            tickers[ticker] = TickerPrices(
+                columns["date"][start:stop],
+                columns["label"][start:stop],
+                *(columns[col][start:stop] for col in PRICE_COLUMNS),
+            )
+        store = cls(tickers)
+        store.source = header.get("source")
+        return store
+
+    # Запись в бинарный формат: заголовок (magic, версия, длина JSON)
+    # + JSON-схема с индексом тикеров + колонки фиксированной ширины,
+    # строки сгруппированы по тикерам и отсортированы по дате
+    def write_binary(self, path: str = BINARY_PATH, source=None):
+        order = sorted(self._tickers)
+        parts = [self._tickers[ticker] for ticker in order]
+        rows = sum(len(prices) for prices in parts)
+        label_width = max(
+            (len(prices.label(i)) for prices in parts
+             for i in range(len(prices))),
+            default=1,
+        )
+
+        arrays = {
+            "date": np.concatenate([p.dates for p in parts]).astype("<i8"),
+            "label": np.concatenate(
+                [np.asarray(p.labels, dtype=str) for p in parts]
+            ).astype(f"S{label_width}"),
+        }
+        for col in PRICE_COLUMNS:
+            arrays[col] = np.concatenate(
+                [getattr(p, col.lower()) for p in parts]
+            ).astype("<f8")
+
+        tickers = {}
+        start = 0
+        for ticker, prices in zip(order, parts):
+            tickers[ticker] = [start, len(prices)]
+            start += len(prices)
+
+        # Смещения колонок зависят от длины заголовка, а она — от
+        # смещений; заголовок дополняется пробелами до выравнивания
+        columns = {name: {"dtype": a.dtype.str} for name, a in arrays.items()}
+        header = {
+            "version": BINARY_VERSION,
+            "rows": rows,
+            "columns": columns,
+            "tickers": tickers,
+            "source": source,
+        }
+        reserve = _ALIGN
+        while True:
+            offset = _aligned(_HEADER.size + reserve)
+            for name, array in arrays.items():
+                columns[name]["offset"] = offset
+                offset = _aligned(offset + array.nbytes)
+            meta = json.dumps(header, ensure_ascii=False).encode("utf-8")
+            if len(meta) <= reserve:
+                break
+            reserve = _aligned(len(meta))
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, reserve))
+            f.write(meta.ljust(reserve))
+            for name, array in arrays.items():
+                f.seek(columns[name]["offset"])
+                f.write(array.tobytes())
+        os.replace(tmp_path, path)
+
+    @property
+    def tickers(self) -> list[str]:
+        return list(self._tickers)
+
+    def get(self, ticker: str) -> TickerPrices | None:
+        if not ticker:
+            return None
+        return self._tickers.get(str(ticker).strip().upper())
+
+    # Ряд тикера по одной строке на дату — общий для статистики,
+    # индикаторов и сравнения, чтобы они считали одни и те же дни
+    def daily(self, ticker: str) -> TickerPrices | None:
+        prices = self.get(ticker)
+        if prices is None:
+            return None
+        key = str(ticker).strip().upper()
+        daily = self._daily.get(key)
+        if daily is None:
+            daily = self._daily[key] = prices.unique_dates()
+        return daily
+
+    # Цены тикера за период (границы включительно) или None.
+    # Пустой end_date означает "до конца данных".
+    def range(self, ticker, start_date, end_date) -> TickerPrices | None:
+        prices = self.get(ticker)
+        if prices is None:
+            return None
+        try:
+            start_day = date_to_day(start_date)
+            end_day = (
+                date_to_day(end_date)
+                if end_date
+                else int(prices.dates[-1]) if len(prices) else start_day
+            )
+        except ValueError:
+            return None
+        return prices.slice(*prices.bounds(start_day, end_day))
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // _ALIGN) * _ALIGN
+
+
+# JSON-заголовок бинарного файла или None для чужого формата/версии
+def read_binary_header(buffer) -> dict | None:
+    if len(buffer) < _HEADER.size:
+        return None
+    magic, version, length = _HEADER.unpack_from(buffer, 0)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        return None
+    start = _HEADER.size
+    return json.loads(bytes(buffer[start:start + length]))
+
+
+def _source_fingerprint(path: str) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+# Бинарный файл актуален для CSV (если CSV нет — берем что есть)
+def _binary_is_fresh(binary_path: str, data_path: str) -> bool:
+    try:
+        with open(binary_path, "rb") as f:
+            head = f.read(_HEADER.size)
+            magic, version, length = _HEADER.unpack(head)
+            if magic != BINARY_MAGIC or version != BINARY_VERSION:
+                return False
+            header = json.loads(f.read(length))
+    except (OSError, ValueError, struct.error):
+        return False
+    if not os.path.exists(data_path):
+        return True
+    return header.get("source") == _source_fingerprint(data_path)
+
+
+# Загрузка цен: бинарный файл через mmap, при его отсутствии или
+# устаревании — пересборка из CSV
+def load_store(
+    data_path: str = DATA_PATH,
+    binary_path: str = BINARY_PATH,
+) -> PriceStore:
+    if not _binary_is_fresh(binary_path, data_path):
+        if not os.path.exists(data_path):
+            raise FileNotFoundError(f"Не найден файл данных: {data_path}")
+        store = PriceStore.from_csv(data_path)
+        try:
+            store.write_binary(binary_path, _source_fingerprint(data_path))
+        except OSError as e:
+            print(f"Не удалось записать {binary_path}: {e}")
+            return store
+    return PriceStore.from_binary(binary_path)
+
+
+_store: PriceStore | None = None
+_store_lock = threading.Lock()
+
+
+# Общий экземпляр хранилища процесса (загружается при первом обращении;
+# все процессы отображают в память один и тот же файл цен)
+def get_store() -> PriceStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = load_store()
+    return _store
@@ -0,0 +1,430 @@
+from __future__ import annotations
+
+import calendar
+import datetime as dt
+import re
+
+# Данные только за 2024 год
+YEAR = 2024
+
+# Алиасы компаний -> тикер (используются парсером на правилах и
+# нормализацией запросов для кэша)
+COMPANY_ALIASES = {
+    'apple': 'AAPL', 'эпл': 'AAPL',
+    'microsoft': 'MSFT', 'майкрософт': 'MSFT',
+    'google': 'GOOGL', 'гугл': 'GOOGL',
+    'nvidia': 'NVDA', 'нвидиа': 'NVDA',
+    'amd': 'AMD', 'амд': 'AMD',
+    'adobe': 'ADBE', 'адоб': 'ADBE',
+    'cisco': 'CSCO', 'циско': 'CSCO',
+    'salesforce': 'CRM',
+    'uber': 'UBER', 'убер': 'UBER',
+    'zoom': 'ZM', 'зум': 'ZM',
+    'logitech': 'LOGI', 'лоджитек': 'LOGI',
+    'philips': 'PHG', 'филипс': 'PHG',
+    'zi': 'ZI'
+}
+# Дополнительные написания и сами тикеры, которые понимает матчер
+EXTRA_ALIASES = {
+    'эппл': 'AAPL', 'нвидия': 'NVDA', 'сейлсфорс': 'CRM',
+    'логитек': 'LOGI', 'zoominfo': 'ZI', 'зуминфо': 'ZI',
+    **{ticker.lower(): ticker for ticker in COMPANY_ALIASES.values()},
+}
+ALL_ALIASES = {**EXTRA_ALIASES, **COMPANY_ALIASES}
+
+# Основа названия месяца -> номер месяца (у мая основы нет, поэтому
+# перечислены формы)
+MONTH_STEMS = {
+    'январ': 1, 'феврал': 2, 'март': 3, 'апрел': 4,
+    'май': 5, 'мая': 5, 'мае': 5,
+    'июн': 6, 'июл': 7, 'август': 8, 'сентябр': 9, 'октябр': 10,
+    'ноябр': 11, 'декабр': 12,
+}
+
+ORDINAL_STEMS = {
+    'перв': 1, 'втор': 2, 'трет': 3, 'четверт': 4, 'четвёрт': 4,
+}
+
+INTENT_KEYWORDS = {
+    'graph': ('график', 'покажи', 'chart', 'graph'),
+    'analysis': ('анализ', 'аналитик', 'analysis'),
+    'stats': ('статистик', 'stats'),
+    'compare': ('сравни', 'сравнен', 'compare', 'vs'),
+    'top': ('топ', 'top', 'лидер', 'рейтинг'),
+}
+# Приоритет типов запроса, если в сообщении есть несколько
+INTENT_PRIORITY = ('top', 'compare', 'graph', 'analysis', 'stats')
+# Запросы сразу по нескольким тикерам
+MULTI_TICKER_TYPES = ('top', 'compare')
+
+# Критерий ранжирования в сравнении и топе. "лучшие"/"худшие" сами
+# по себе означают топ.
+RANK_KEYWORDS = {
+    'рост': 'growth', 'вырос': 'growth', 'лучш': 'growth',
+    'падени': 'decline', 'упал': 'decline', 'худш': 'decline',
+    'волатильн': 'volatility', 'объем': 'volume', 'объём': 'volume',
+}
+_TOP_RANK_WORDS = ('лучш', 'худш')
+
+# Служебные слова, которые не влияют на смысл запроса. Любое другое
+# нераспознанное слово снижает уверенность разбора правилами.
+STOPWORDS = frozenset((
+    'за', 'по', 'с', 'со', 'от', 'до', 'в', 'во', 'на', 'и', 'а', 'мне',
+    'пожалуйста', 'сделай', 'дай', 'год', 'года', 'году', 'весь',
+    'акции', 'акций', 'акциям', 'компании', 'цена', 'цены', 'курс',
+    'бумаги', 'период',
+    'for', 'of', 'in', 'me', 'please', 'stock', 'price',
+))
+
+
+def _month_range(month: int) -> tuple[str, str]:
+    last_day = calendar.monthrange(YEAR, month)[1]
+    return (
+        f"{YEAR}-{month:02d}-01",
+        f"{YEAR}-{month:02d}-{last_day:02d}",
+    )
+
+
+MONTH_RANGES = {month: _month_range(month) for month in range(1, 13)}
+QUARTER_RANGES = [
+    (_month_range(q * 3 + 1)[0], _month_range(q * 3 + 3)[1])
+    for q in range(4)
+]
+HALF_RANGES = [
+    (_month_range(1)[0], _month_range(6)[1]),
+    (_month_range(7)[0], _month_range(12)[1]),
+]
+YEAR_RANGE = (_month_range(1)[0], _month_range(12)[1])
+
+
+def _alternation(words) -> str:
+    # Длинные варианты раньше коротких, чтобы "майкрософт" не
+    # распознавался как "май"
+    return "|".join(sorted(words, key=len, reverse=True))
+
+
+def _escaped(words):
+    return [re.escape(word) for word in words]
+
+
+_MONTHS = _alternation(MONTH_STEMS)
+_INTENT_BY_WORD = {
+    word: kind for kind, words in INTENT_KEYWORDS.items() for word in words
+}
+
+# Сообщение режется на слова одним регулярным выражением (даты
+# вида 2024-03-01 и 01.03.2024 — одно слово)
+_WORD_RE = re.compile(
+    r"\d{4}-\d{1,2}-\d{1,2}"
+    r"|\d{1,2}\.\d{1,2}(?:\.\d{2,4})?"
+    r"|[0-9a-zа-яё]+(?:-[а-яё]+)?"
+)
+
+# Один автомат на все словари: тикеры, даты, месяцы, кварталы,
+# полугодия, недели и ключевые слова типа запроса. Применяется к
+# слову целиком, результат классификации слова кэшируется.
+_WORD_CLASS_RE = re.compile(
+    r"(?:"
+    r"(?P<iso>\d{4})-(?P<iso_m>\d{1,2})-(?P<iso_d>\d{1,2})"
+    r"|(?P<dot_d>\d{1,2})\.(?P<dot_m>\d{1,2})(?:\.(?P<dot_y>\d{2,4}))?"
+    r"|(?P<qtag>q[1-4]|[1-4]q)"
+    r"|(?P<ticker>" + _alternation(_escaped(ALL_ALIASES)) + r")[a-zа-яё]*"
+    r"|(?P<year>\d{4})(?:года|году|год|г)?"
+    r"|(?P<month>" + _MONTHS + r")[а-яё]*"
+    r"|(?P<num>\d{1,2})(?:-?(?:ая|ое|ый|ой|ий|го|й|я|е))?"
+    r"|(?P<ordinal>" + _alternation(ORDINAL_STEMS) + r"|последн)[а-яё]*"
+    r"|(?P<roman>iv|i{1,3})"
+    r"|(?P<quarter>квартал|кв)[а-яё]*"
+    r"|(?P<half>полугоди|полгода)[а-яё]*"
+    r"|(?P<week>недел)[а-яё]*"
+    r"|(?P<rank>" + _alternation(RANK_KEYWORDS) + r")[а-яё]*"
+    r"|(?P<intent>" + _alternation(_escaped(_INTENT_BY_WORD)) + r")[а-яё]*"
+    r")$"
+)
+_UNKNOWN = ('unknown', None)
+
+_ROMAN = {'i': 1, 'ii': 2, 'iii': 3, 'iv': 4}
+_WORD_CACHE_LIMIT = 100_000
+_word_kinds: dict[str, tuple | None] = {}
+
+
+def _date(year: int, month: int, day: int) -> str | None:
+    try:
+        return dt.date(year, month, day).isoformat()
+    except ValueError:
+        return None
+
+
+# Класс слова: (вид, значение) или None, если слово ничего не значит
+def _classify(word: str):
+    m = _WORD_CLASS_RE.match(word)
+    if m is None:
+        return None if word in STOPWORDS else _UNKNOWN
+
+    kind = m.lastgroup
+    if kind == 'ticker':
+        alias = m['ticker']
+        # Короткие латинские алиасы (zi, zm, amd) — только целым
+        # словом, у кириллических допускаем падежные окончания
+        if len(alias) <= 3 and alias.isascii() and len(word) != len(alias):
+            return None
+        return 'ticker', ALL_ALIASES[alias]
+    if kind == 'intent':
+        return 'intent', _INTENT_BY_WORD[m['intent']]
+    if kind == 'rank':
+        stem = m['rank']
+        kind = 'top_rank' if stem in _TOP_RANK_WORDS else 'rank'
+        return kind, RANK_KEYWORDS[stem]
+    if kind == 'month':
+        return 'month', MONTH_STEMS[m['month']]
+    if kind == 'num':
+        return 'number', int(m['num'])
+    if kind == 'ordinal':
+        stem = m['ordinal']
+        if stem == 'последн':
+            return 'last', None
+        return 'number', ORDINAL_STEMS[stem]
+    if kind in ('quarter', 'half', 'week'):
+        return kind, None
+    if kind == 'qtag':
+        return 'quarter_n', int(m['qtag'].strip('q'))
+    if kind == 'roman':
+        return 'number', _ROMAN[m['roman']]
+    if kind == 'year':
+        return 'year', int(m['year'])
+    if kind == 'iso_d':
+        day = _date(int(m['iso']), int(m['iso_m']), int(m['iso_d']))
+        return ('date', day) if day else None
+    if kind in ('dot_m', 'dot_y'):
+        year = int(m['dot_y']) if m['dot_y'] else YEAR
+        if year < 100:
+            year += 2000
+        day = _date(year, int(m['dot_m']), int(m['dot_d']))
+        return ('date', day) if day else None
+    return None
+
+
+def _word_kind(word: str):
+    kind = _classify(word)
+    if len(_word_kinds) < _WORD_CACHE_LIMIT:
+        _word_kinds[word] = kind
+    return kind
+
+
+_UNSEEN = object()
+
+
+# Результат разбора сообщения правилами
+class QueryMatch:
+
+    __slots__ = (
+        'tickers', 'start_date', 'end_date', 'period_source', 'intents',
+        'unknown_words', 'top_n', 'rank_by',
+    )
+
+    def __init__(self):
+        self.tickers: list[str] = []
+        self.start_date: str | None = None
+        self.end_date: str | None = None
+        # explicit | quarter | half | week | month | year | None
+        self.period_source: str | None = None
+        self.intents: list[str] = []
+        # Нераспознанные слова, кроме служебных
+        self.unknown_words = 0
+        # Для топа и сравнения: сколько тикеров и по какому критерию
+        self.top_n: int | None = None
+        self.rank_by: str | None = None
+
+    @property
+    def ticker(self) -> str | None:
+        return self.tickers[0] if self.tickers else None
+
+    @property
+    def request_type(self) -> str:
+        # Несколько компаний в одном сообщении — это сравнение
+        if len(self.tickers) > 1 and 'top' not in self.intents:
+            return 'compare'
+        for kind in INTENT_PRIORITY:
+            if kind in self.intents:
+                return kind
+        return "unknown"
+
+    # Уверенность разбора правилами от 0 до 1: однозначно найдены
+    # тикер(ы), тип запроса и явный период, а лишних слов нет
+    def confidence(self) -> float:
+        score = 1.0
+        request_type = self.request_type
+        if request_type == 'compare':
+            if len(self.tickers) < 2:
+                score *= 0.5
+        elif request_type != 'top':
+            if len(self.tickers) != 1:
+                score *= 0.5 if self.tickers else 0.2
+            if len(self.intents) != 1:
+                score *= 0.7 if self.intents else 0.5
+        if self.period_source is None:
+            score *= 0.6
+        return score * 0.8 ** min(self.unknown_words, 4)
+
+    def as_dict(self) -> dict:
+        start_date, end_date = self.start_date, self.end_date
+        if start_date is None:
+            start_date, end_date = YEAR_RANGE
+        tickers = self.tickers
+        return {
+            "ticker": tickers[0] if tickers else None,
+            "tickers": list(tickers),
+            "start_date": start_date,
+            "end_date": end_date,
+            "request_type": self.request_type,
+            "top_n": self.top_n,
+            "rank_by": self.rank_by,
+        }
+
+
+# Число-порядковое рядом с токеном (сначала слева, потом справа)
+def _nearest_number(tokens, index, limit):
+    for step in (-1, 1, -2, 2):
+        j = index + step
+        if 0 <= j < len(tokens):
+            kind, value = tokens[j]
+            if kind == 'number' and 1 <= value <= limit:
+                return value
+            if kind == 'last':
+                return limit
+    return None
+
+
+# "5 лидеров", "3 лучших": число прямо перед словом топа — его размер.
+# Возвращает позицию слова топа для "топ-5" (число после).
+def _top_size(result, tokens, number_at, position):
+    if number_at == position - 1 and result.top_n is None:
+        result.top_n = tokens.pop()[1]
+    return position
+
+
+# Разбор сообщения за один проход: слова классифицируются
+# предкомпилированным автоматом (с кэшем по слову), затем из найденных
+# токенов собираются тикеры, тип запроса и период
+def match_query(user_message: str) -> QueryMatch:
+    result = QueryMatch()
+    tickers = result.tickers
+    intents = result.intents
+
+    tokens = []
+    dates = []
+    months = []
+    year = None
+    number_at = -2
+    top_at = -2
+    words = _WORD_RE.findall(user_message.lower())
+    for position, word in enumerate(words):
+        token = _word_kinds.get(word, _UNSEEN)
+        if token is _UNSEEN:
+            token = _word_kind(word)
+        if token is None:
+            continue
+        kind, value = token
+        if kind == 'ticker':
+            if value not in tickers:
+                tickers.append(value)
+        elif kind == 'intent':
+            if value not in intents:
+                intents.append(value)
+            if value == 'top':
+                top_at = _top_size(result, tokens, number_at, position)
+        elif kind == 'rank' or kind == 'top_rank':
+            result.rank_by = value
+            if kind == 'top_rank':
+                if 'top' not in intents:
+                    intents.append('top')
+                top_at = _top_size(result, tokens, number_at, position)
+        elif kind == 'month':
+            # "5 марта" — конкретный день, а не месяц целиком
+            if number_at == position - 1:
+                day = _date(YEAR, value, tokens[-1][1])
+                if day:
+                    dates.append(day)
+                    tokens.pop()
+                    continue
+            months.append(value)
+        elif kind == 'date':
+            dates.append(value)
+        elif kind == 'year':
+            year = value
+        elif kind == 'unknown':
+            result.unknown_words += 1
+        else:
+            if kind == 'number':
+                # "топ-5", "топ 5"
+                if top_at == position - 1 and result.top_n is None:
+                    result.top_n = value
+                    continue
+                number_at = position
+            tokens.append(token)
+
+    # Другой год — берем его целиком (данных за него нет, и бот честно
+    # об этом скажет вместо ответа за 2024)
+    if year is not None and year != YEAR and not dates:
+        result.start_date = f"{year}-01-01"
+        result.end_date = f"{year}-12-31"
+        result.period_source = 'year'
+        return result
+
+    if dates or months or tokens:
+        _resolve_period(result, tokens, dates, months)
+    if result.period_source is None and year is not None:
+        result.start_date, result.end_date = YEAR_RANGE
+        result.period_source = 'year'
+    return result
+
+
+def _resolve_period(result, tokens, dates, months):
+    # Явные даты важнее всего: одна — день, две и более — диапазон
+    if dates:
+        result.start_date, result.end_date = min(dates), max(dates)
+        result.period_source = 'explicit'
+        return
+
+    for i, (kind, value) in enumerate(tokens):
+        if kind == 'quarter_n':
+            result.start_date, result.end_date = QUARTER_RANGES[value - 1]
+            result.period_source = 'quarter'
+            return
+        if kind == 'half':
+            number = _nearest_number(tokens, i, 2)
+            if number:
+                result.start_date, result.end_date = HALF_RANGES[number - 1]
+                result.period_source = 'half'
+                return
+        if kind == 'quarter':
+            number = _nearest_number(tokens, i, 4)
+            if number:
+                result.start_date, result.end_date = QUARTER_RANGES[
+                    number - 1
+                ]
+                result.period_source = 'quarter'
+                return
+
+    # Месяцы: один — месяц целиком, "с апреля по август" — диапазон
+    if months:
+        result.start_date = _month_range(months[0])[0]
+        result.end_date = _month_range(months[-1])[1]
+        if result.end_date < result.start_date:
+            result.end_date = _month_range(months[0])[1]
+        result.period_source = 'month'
+        return
+
+    # ISO-неделя: "12 неделя", "неделя 12"
+    for i, (kind, value) in enumerate(tokens):
+        if kind == 'week':
+            number = _nearest_number(tokens, i, 53)
+            if number:
+                try:
+                    monday = dt.date.fromisocalendar(YEAR, number, 1)
+                except ValueError:
+                    continue
+                result.start_date = monday.isoformat()
+                result.end_date = (monday + dt.timedelta(days=6)).isoformat()
+                result.period_source = 'week'
+                return
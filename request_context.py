@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import time
+
+
+# Контекст одного сообщения: результат разбора и уже посчитанные
+# артефакты (статистика, график, аналитика). Каждый артефакт
+# вычисляется один раз, сколько бы шагов ответа его ни использовали.
+class RequestContext:
+
+    # started — время прихода сообщения (time.perf_counter()), если
+    # до создания контекста оно уже ждало в очереди
+    def __init__(self, user_message: str, chat_id=None, started=None):
+        self.user_message = user_message
+        self.chat_id = chat_id
+        self.started = time.perf_counter() if started is None else started
+        self.parsed: dict = {}
+        self._artifacts: dict = {}
+
+    @property
+    def ticker(self):
+        return self.parsed.get('ticker')
+
+    @property
+    def tickers(self):
+        return self.parsed.get('tickers') or []
+
+    @property
+    def top_n(self):
+        return self.parsed.get('top_n')
+
+    @property
+    def rank_by(self):
+        return self.parsed.get('rank_by')
+
+    @property
+    def start_date(self):
+        return self.parsed.get('start_date')
+
+    @property
+    def end_date(self):
+        return self.parsed.get('end_date')
+
+    @property
+    def request_type(self):
+        return self.parsed.get('request_type', 'unknown')
+
+    def get(self, name: str, default=None):
+        return self._artifacts.get(name, default)
+
+    def set(self, name: str, value):
+        self._artifacts[name] = value
+
+    # Значение артефакта; compute — функция без аргументов, возвращающая
+    # awaitable, вызывается только при первом обращении
+    async def artifact(self, name: str, compute):
+        if name not in self._artifacts:
+            self._artifacts[name] = await compute()
+        return self._artifacts[name]
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
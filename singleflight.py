@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import os
+import time
+
+import metrics
+
+CHAT_DEBOUNCE_SECONDS = float(os.getenv("CHAT_DEBOUNCE_SECONDS", "3"))
+CHAT_MAX_INFLIGHT = int(os.getenv("CHAT_MAX_INFLIGHT", "2"))
+
+
+# Single-flight: одновременные одинаковые вычисления (ключ — кортеж
+# вида ("chart", ticker, start, end)) выполняются один раз, остальные
+# вызывающие ждут результат первого. Первый элемент ключа — группа
+# для метрик.
+class SingleFlight:
+
+    def __init__(self):
+        self._calls: dict[tuple, asyncio.Task] = {}
+
+    async def do(self, key: tuple, func, *args, **kwargs):
+        group = key[0]
+        task = self._calls.get(key)
+        if task is None:
+            metrics.counter("singleflight_leaders_total", group=group).inc()
+            # Вычисление — отдельная задача: отмена одного из ждущих
+            # не отменяет работу для остальных
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+        else:
+            metrics.counter("singleflight_shared_total", group=group).inc()
+        return await asyncio.shield(task)
+
+    def _forget(self, key: tuple, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+
+# Защита от всплесков в одном чате: повтор того же запроса в течение
+# окна отбрасывается (ответ на первый уже в пути), а одновременно
+# обрабатывается не больше max_inflight сообщений чата.
+class ChatGate:
+
+    def __init__(
+        self,
+        window: float = CHAT_DEBOUNCE_SECONDS,
+        max_inflight: int = CHAT_MAX_INFLIGHT,
+    ):
+        self.window = window
+        self.max_inflight = max_inflight
+        self._seen: dict[tuple, float] = {}
+        self._slots: dict[object, list] = {}
+        self._debounced = metrics.counter("chat_debounced_total")
+
+    def is_duplicate(self, chat_id, key: str) -> bool:
+        now = time.monotonic()
+        if len(self._seen) > 10000:
+            self._seen = {
+                k: t for k, t in self._seen.items() if now - t < self.window
+            }
+        seen_at = self._seen.get((chat_id, key))
+        if seen_at is not None and now - seen_at < self.window:
+            self._debounced.inc()
+            return True
+        self._seen[(chat_id, key)] = now
+        return False
+
+    # Слот обработки сообщения чата; семафоры чатов живут, пока
+    # ими кто-то пользуется
+    @contextlib.asynccontextmanager
+    async def slot(self, chat_id):
+        entry = self._slots.get(chat_id)
+        if entry is None:
+            entry = [asyncio.Semaphore(self.max_inflight), 0]
+            self._slots[chat_id] = entry
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._slots[chat_id]
+
+
+flights = SingleFlight()
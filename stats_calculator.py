@@ -1,82 +1,100 @@
-import sqlite3
-
-import pandas as pd
-
-# Рассчет статистику по акциям за период
-def calculate_stock_stats(ticker, start_date, end_date):
-
-    try:
-        conn = sqlite3.connect('stocks.db')
-
-        query = """
-        SELECT Date, Open, High, Low, Close, Volume
-        FROM stock_prices
-        WHERE Ticker = ? AND Date BETWEEN ? AND ?
-        ORDER BY Date
-        """
-
-        df = pd.read_sql_query(
-            query,
-            conn,
-            params=[ticker, start_date, end_date],
-        )
-        conn.close()
-
-        if df.empty:
-            return None, "❌ Данные не найдены"
-
-        # Основная статистика
-        stats = {
-            'period_start': df['Date'].iloc[0],
-            'period_end': df['Date'].iloc[-1],
-            'start_price': df['Close'].iloc[0],
-            'end_price': df['Close'].iloc[-1],
-            'price_change': df['Close'].iloc[-1] - df['Close'].iloc[0],
-            'price_change_percent': (
-                (df['Close'].iloc[-1] - df['Close'].iloc[0])
-                / df['Close'].iloc[0]
-            ) * 100,
-            'average_price': df['Close'].mean(),
-            'min_price': df['Close'].min(),
-            'max_price': df['Close'].max(),
-            'volatility': df['Close'].std(),
-            'total_volume': df['Volume'].sum(),
-            'days_count': len(df)
-        }
-
-        return stats, "✅ Статистика рассчитана"
-
-    except Exception as e:
-        print(f"Ошибка расчета статистики: {e}")
-        return None, f"❌ Ошибка расчета: {e}"
-
-# Форматирование статистики в красивое сообщение
-def format_stats_message(stats, ticker):
-
-    if not stats:
-        return "❌ Не удалось рассчитать статистику"
-
-    message = f"📊 Статистика {ticker}\n\n"
-    message += f"Период: {stats['period_start']} - {stats['period_end']}\n"
-    message += (
-        f"Изменение цены: ${stats['price_change']:.2f} "
-        f"({stats['price_change_percent']:.1f}%)\n"
-    )
-    message += f"Начальная цена: ${stats['start_price']:.2f}\n"
-    message += f"Конечная цена: ${stats['end_price']:.2f}\n"
-    message += f"Минимум: ${stats['min_price']:.2f}\n"
-    message += f"Максимум: ${stats['max_price']:.2f}\n"
-    message += f"Средняя цена: ${stats['average_price']:.2f}\n"
-    message += f"Волатильность: ${stats['volatility']:.2f}\n"
-    message += f"Общий объем: {stats['total_volume']:,}\n"
-    message += f"Торговых дней: {stats['days_count']}"
-
-    # Определение тренда
-    if stats['price_change'] > 0:
-        message += "\n\n📈 Тренд: РОСТ 🟢"
-    elif stats['price_change'] < 0:
-        message += "\n\n📉 Тренд: ПАДЕНИЕ 🔴"
-    else:
-        message += "\n\n➡️ Тренд: СТАБИЛЬНЫЙ ⚪"
-
-    return message
+import math
+
+from indicators import get_indicators
+from price_store import date_to_day, get_store
+from stats_index import get_index
+
+# Рассчет статистику по акциям за период
+def calculate_stock_stats(ticker, start_date, end_date):
+
+    try:
+        store = get_store()
+        index = get_index(store, ticker)
+        if index is None:
+            return None, "❌ Данные не найдены"
+
+        # Пустой end_date — до конца данных
+        start_day = date_to_day(start_date)
+        end_day = (
+            date_to_day(end_date) if end_date else int(index.prices.dates[-1])
+        )
+
+        # Основная статистика (O(1) по префиксным суммам)
+        stats = index.stats_for_days(start_day, end_day)
+        if stats is None:
+            return None, "❌ Данные не найдены"
+
+        # Индикаторы посчитаны по всему ряду один раз, здесь — срез
+        indicators = get_indicators(store, ticker)
+        stats['indicators'] = indicators.summary_for_days(start_day, end_day)
+
+        return stats, "✅ Статистика рассчитана"
+
+    except Exception as e:
+        print(f"Ошибка расчета статистики: {e}")
+        return None, f"❌ Ошибка расчета: {e}"
+
+# Форматирование статистики в красивое сообщение
+def format_stats_message(stats, ticker):
+
+    if not stats:
+        return "❌ Не удалось рассчитать статистику"
+
+    message = f"📊 Статистика {ticker}\n\n"
+    message += f"Период: {stats['period_start']} - {stats['period_end']}\n"
+    message += (
+        f"Изменение цены: ${stats['price_change']:.2f} "
+        f"({stats['price_change_percent']:.1f}%)\n"
+    )
+    message += f"Начальная цена: ${stats['start_price']:.2f}\n"
+    message += f"Конечная цена: ${stats['end_price']:.2f}\n"
+    message += f"Минимум: ${stats['min_price']:.2f}\n"
+    message += f"Максимум: ${stats['max_price']:.2f}\n"
+    message += f"Средняя цена: ${stats['average_price']:.2f}\n"
+    message += f"Волатильность: ${stats['volatility']:.2f}\n"
+    message += f"Общий объем: {stats['total_volume']:,}\n"
+    message += f"Торговых дней: {stats['days_count']}"
+
+    indicators = stats.get('indicators')
+    if indicators:
+        message += "\n\n" + format_indicators(indicators)
+
+    # Определение тренда
+    if stats['price_change'] > 0:
+        message += "\n\n📈 Тренд: РОСТ 🟢"
+    elif stats['price_change'] < 0:
+        message += "\n\n📉 Тренд: ПАДЕНИЕ 🔴"
+    else:
+        message += "\n\n➡️ Тренд: СТАБИЛЬНЫЙ ⚪"
+
+    return message
+
+
+
+# Значение индикатора (не определенные из-за короткой истории — "н/д")
+def _value(indicators, key, template):
+    value = indicators.get(key)
+    if value is None or math.isnan(value):
+        return "н/д"
+    return template.format(value)
+
+
+# Индикаторы на конец периода
+def format_indicators(indicators):
+
+    def show(key, template="{:.2f}"):
+        return _value(indicators, key, template)
+
+    return (
+        "📐 Индикаторы на конец периода\n"
+        f"SMA 20 / 50: {show('sma_20', '${:.2f}')} / "
+        f"{show('sma_50', '${:.2f}')}\n"
+        f"RSI 14: {show('rsi', '{:.1f}')}\n"
+        f"MACD: {show('macd')}, сигнал {show('macd_signal')}, "
+        f"гистограмма {show('macd_hist', '{:+.2f}')}\n"
+        f"Боллинджер: {show('bollinger_lower', '${:.2f}')} - "
+        f"{show('bollinger_upper', '${:.2f}')}\n"
+        f"ATR 14: {show('atr', '${:.2f}')}\n"
+        f"Макс. просадка: {show('max_drawdown_percent', '{:.1f}%')}\n"
+        f"Шарп: {show('sharpe')}, бета к индексу: {show('beta')}"
+    )
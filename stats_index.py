@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import weakref
+
+import numpy as np
+
+from price_store import PriceStore, TickerPrices
+
+
+# Sparse table для min/max за O(1): levels[k][i] — экстремум на
+# отрезке [i, i + 2**k)
+class SparseTable:
+
+    def __init__(self, values: np.ndarray, reduce):
+        self._reduce = reduce
+        self.levels = [np.asarray(values, dtype=np.float64)]
+        width = 1
+        while width * 2 <= len(values):
+            prev = self.levels[-1]
+            self.levels.append(reduce(prev[:-width], prev[width:]))
+            width *= 2
+
+    # Экстремум на [lo, hi), hi > lo
+    def query(self, lo: int, hi: int):
+        k = (hi - lo).bit_length() - 1
+        level = self.levels[k]
+        return self._reduce(level[lo], level[hi - (1 << k)])
+
+
+# Предрасчитанный индекс тикера: префиксные суммы Close, Close² и
+# Volume дают std и объем за O(1), sparse table — min/max.
+# Close сдвинуты на первую цену, чтобы сумма квадратов не теряла
+# точность при вычитании. Среднее — прямой суммой по срезу: разность
+# префиксных сумм уводит его в последний знак (19.874999... вместо
+# 19.875), и округление до центов расходится с pandas.
+class StatsIndex:
+
+    def __init__(self, prices: TickerPrices):
+        self.prices = prices
+        close = prices.close
+        self.shift = close[0] if len(close) else 0.0
+        shifted = close - self.shift
+        self.close_sum = np.concatenate(([0.0], np.cumsum(shifted)))
+        self.close_sq_sum = np.concatenate(
+            ([0.0], np.cumsum(shifted * shifted))
+        )
+        self.volume_sum = np.concatenate(([0.0], np.cumsum(prices.volume)))
+        self.min_table = SparseTable(close, np.minimum)
+        self.max_table = SparseTable(close, np.maximum)
+
+    # Статистика строк [lo, hi) в формате calculate_stock_stats
+    def stats(self, lo: int, hi: int) -> dict | None:
+        n = hi - lo
+        if n <= 0:
+            return None
+
+        close = self.prices.close
+        s1 = self.close_sum[hi] - self.close_sum[lo]
+        s2 = self.close_sq_sum[hi] - self.close_sq_sum[lo]
+        mean_shifted = s1 / n
+
+        if n > 1:
+            # Выборочная дисперсия (ddof=1), как у pandas .std()
+            variance = max((s2 - s1 * mean_shifted) / (n - 1), 0.0)
+            volatility = np.sqrt(np.float64(variance))
+        else:
+            volatility = np.float64(np.nan)
+
+        start_price = close[lo]
+        end_price = close[hi - 1]
+        return {
+            'period_start': self.prices.label(lo),
+            'period_end': self.prices.label(hi - 1),
+            'start_price': start_price,
+            'end_price': end_price,
+            'price_change': end_price - start_price,
+            'price_change_percent': (
+                (end_price - start_price) / start_price
+            ) * 100,
+            'average_price': close[lo:hi].sum() / n,
+            'min_price': self.min_table.query(lo, hi),
+            'max_price': self.max_table.query(lo, hi),
+            'volatility': volatility,
+            'total_volume': np.float64(
+                self.volume_sum[hi] - self.volume_sum[lo]
+            ),
+            'days_count': n,
+        }
+
+    def stats_for_days(self, start_day: int, end_day: int) -> dict | None:
+        return self.stats(*self.prices.bounds(start_day, end_day))
+
+
+# Индексы строятся лениво, по одному на тикер хранилища (по ряду
+# store.daily — одна строка на дату)
+_indexes: weakref.WeakKeyDictionary[PriceStore, dict[str, StatsIndex]] = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_index(store: PriceStore, ticker: str) -> StatsIndex | None:
+    prices = store.daily(ticker)
+    if prices is None or len(prices) == 0:
+        return None
+    ticker = str(ticker).strip().upper()
+    by_ticker = _indexes.setdefault(store, {})
+    index = by_ticker.get(ticker)
+    if index is None:
+        index = StatsIndex(prices)
+        by_ticker[ticker] = index
+    return index
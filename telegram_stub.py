@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import httpx
+
+# Локальная заглушка Telegram Bot API и отправитель фейковых
+# обновлений для проверки режима webhook без Telegram.
+# Запуск заглушки: python telegram_stub.py serve --port 8086, затем
+# TELEGRAM_API_BASE=http://127.0.0.1:8086 BOT_MODE=webhook \
+#     WEBHOOK_SECRET=... WEBHOOK_PORT=8443 python bot.py
+# Отправка обновлений:
+#     python telegram_stub.py send --secret "$WEBHOOK_SECRET" --webhook \
+#         http://127.0.0.1:8443/telegram "график AAPL за март"
+
+_PATH_RE = re.compile(r"^/bot(?P<token>[^/]+)/(?P<method>\w+)")
+_MULTIPART_FIELD_RE = re.compile(
+    rb'name="(?P<name>[^"]+)"\r\n\r\n(?P<value>[^\r]*)\r\n'
+)
+
+BOT_USER = {
+    "id": 1,
+    "is_bot": True,
+    "first_name": "Stub",
+    "username": "stub_bot",
+}
+
+
+def fake_update(update_id: int, chat_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    }
+
+
+# latency — задержка ответа, с; flood_chat_rate — сколько сообщений
+# и правок в секунду принимается в чат, сверх — 429 с retry_after,
+# как у флуд-контроля Telegram (None — без ограничения)
+class TelegramStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address=("127.0.0.1", 0),
+        latency: float = 0.0,
+        flood_chat_rate: int | None = None,
+    ):
+        super().__init__(address, _StubHandler)
+        self.latency = latency
+        self.flood_chat_rate = flood_chat_rate
+        self.calls: list[tuple[str, dict]] = []
+        self.flood_errors = 0
+        self._sent_at: dict[str, deque] = defaultdict(deque)
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "TelegramStubServer":
+        self._thread = threading.Thread(
+            target=self.serve_forever,
+            name="telegram-stub",
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    # Секунды до снятия ограничения или 0, если сообщение принято
+    def flood_wait(self, method: str, params: dict) -> int:
+        if not self.flood_chat_rate or not method.startswith(
+            ("send", "edit")
+        ) or method == "sendChatAction":
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            sent = self._sent_at[str(params.get("chat_id"))]
+            while sent and now - sent[0] >= 1:
+                sent.popleft()
+            if len(sent) >= self.flood_chat_rate:
+                self.flood_errors += 1
+                return 1
+            sent.append(now)
+            return 0
+
+    def record(self, method: str, params: dict):
+        with self._lock:
+            self.calls.append((method, params))
+            return next(self._message_ids)
+
+    def result_for(self, method: str, params: dict):
+        message_id = self.record(method, params)
+        if method == "getMe":
+            return BOT_USER
+        if method == "sendChatAction" or not method.startswith(
+            ("send", "edit")
+        ):
+            return True
+
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id") or 0), "type": "private"},
+            "from": BOT_USER,
+        }
+        if method == "sendPhoto":
+            message["photo"] = [{
+                "file_id": f"stub-photo-{message_id}",
+                "file_unique_id": f"stub-{message_id}",
+                "width": 1200,
+                "height": 600,
+            }]
+            message["caption"] = params.get("caption", "")
+        else:
+            message["text"] = params.get("text", "")
+        return message
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        match = _PATH_RE.match(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if not match:
+            self._send(404, {"ok": False, "description": "Not Found"})
+            return
+
+        params = _parse_params(self.headers.get("Content-Type", ""), body)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        retry_after = self.server.flood_wait(match.group("method"), params)
+        if retry_after:
+            self._send(429, {
+                "ok": False,
+                "error_code": 429,
+                "description": "Too Many Requests: retry after "
+                f"{retry_after}",
+                "parameters": {"retry_after": retry_after},
+            })
+            return
+        result = self.server.result_for(match.group("method"), params)
+        self._send(200, {"ok": True, "result": result})
+
+    do_GET = do_POST
+
+    def _send(self, status: int, response: dict):
+        data = json.dumps(response, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _parse_params(content_type: str, body: bytes) -> dict:
+    if not body:
+        return {}
+    if "json" in content_type:
+        return json.loads(body)
+    if "multipart" in content_type:
+        return {
+            m.group("name").decode(): m.group("value").decode(
+                "utf-8",
+                "replace",
+            )
+            for m in _MULTIPART_FIELD_RE.finditer(body)
+        }
+    return {
+        key: values[0]
+        for key, values in parse_qs(body.decode("utf-8")).items()
+    }
+
+
+# Отправка фейковых обновлений в webhook бота: каждое сообщение из
+# texts уходит от каждого из chats чатов
+def send_updates(webhook_url, texts, chats=1, secret="", first_id=1):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    statuses = []
+    update_id = first_id
+    with httpx.Client(timeout=30) as client:
+        for text in texts:
+            for chat_id in range(1, chats + 1):
+                response = client.post(
+                    webhook_url,
+                    json=fake_update(update_id, chat_id, text),
+                    headers=headers,
+                )
+                statuses.append(response.status_code)
+                update_id += 1
+    return statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка Telegram Bot API")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="запустить заглушку Bot API")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8086)
+
+    send = commands.add_parser("send", help="отправить обновления в webhook")
+    send.add_argument("--webhook", default="http://127.0.0.1:8443/telegram")
+    send.add_argument("--secret", default="")
+    send.add_argument("--chats", type=int, default=1)
+    send.add_argument("texts", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "send":
+        statuses = send_updates(
+            args.webhook,
+            args.texts,
+            args.chats,
+            args.secret,
+        )
+        print(f"Ответы webhook: {statuses}")
+        return
+
+    server = TelegramStubServer((args.host, args.port))
+    print(f"Заглушка Telegram Bot API слушает {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# LRU-кэш с TTL для JSON-сериализуемых значений. Если задан db_path,
+# записи дублируются в sqlite и загружаются обратно при старте, так
+# что кэш переживает рестарт процесса.
+class TTLCache:
+
+    def __init__(
+        self,
+        max_items: int,
+        ttl: float,
+        db_path: str | None = None,
+        table: str = "cache",
+    ):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.table = table
+        self._items: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        if db_path:
+            self._open(db_path)
+
+    def _open(self, db_path: str):
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires REAL NOT NULL)"
+        )
+        now = time.time()
+        with conn:
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE expires <= ?",
+                (now,),
+            )
+            rows = conn.execute(
+                f"SELECT key, value, expires FROM {self.table} "
+                "ORDER BY expires DESC LIMIT ?",
+                (self.max_items,),
+            ).fetchall()
+        for key, value, expires in reversed(rows):
+            self._items[key] = (expires, json.loads(value))
+        self._conn = conn
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires <= time.time():
+                del self._items[key]
+                self._delete(key)
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl: float | None = None):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._items[key] = (expires, value)
+            self._items.move_to_end(key)
+            evicted = []
+            while len(self._items) > self.max_items:
+                evicted.append(self._items.popitem(last=False)[0])
+
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute(
+                        f"INSERT OR REPLACE INTO {self.table} "
+                        "(key, value, expires) VALUES (?, ?, ?)",
+                        (key, json.dumps(value, ensure_ascii=False), expires),
+                    )
+                    self._conn.executemany(
+                        f"DELETE FROM {self.table} WHERE key = ?",
+                        [(k,) for k in evicted],
+                    )
+
+    def _delete(self, key: str):
+        if self._conn is not None:
+            with self._conn:
+                self._conn.execute(
+                    f"DELETE FROM {self.table} WHERE key = ?",
+                    (key,),
+                )
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
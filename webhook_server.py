@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import hmac
+import json
+import logging
+import os
+import signal
+
+from telegram import Update
+
+import metrics
+
+# Режим webhook: Telegram присылает обновления POST-запросами, поэтому
+# несколько реплик бота могут стоять за балансировщиком (в отличие от
+# getUpdates, который допускает только одного получателя).
+# WEBHOOK_URL — публичный адрес реплик; путь WEBHOOK_PATH дописывается.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8443")))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Обязателен: без него любой, кто достучится до порта, мог бы
+# присылать поддельные обновления от имени любого чата
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# setWebhook достаточно вызвать одной реплике
+WEBHOOK_REGISTER = os.getenv("WEBHOOK_REGISTER", "1") == "1"
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# Больше необработанных обновлений не берем: 503, Telegram повторит
+# доставку позже (возможно, на другую реплику)
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "1000"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "25"))
+# Отдельный порт /metrics (0 — выключен), по умолчанию только локально.
+# Публичный сервер webhook метрики не отдает.
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+_MAX_BODY = 1 << 20
+_IDLE_TIMEOUT = 60.0
+_TEXT = "text/plain; charset=utf-8"
+_PROMETHEUS = "text/plain; version=0.0.4; charset=utf-8"
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    503: "Service Unavailable",
+}
+
+
+# HTTP-сервер приема обновлений на asyncio: проверяет секрет, кладет
+# обновление в update_queue приложения и сразу отвечает 200. Обработка
+# идет параллельно (concurrent_updates приложения). /healthz отдает 503
+# во время остановки, чтобы балансировщик снял реплику.
+class WebhookServer:
+
+    def __init__(
+        self,
+        app,
+        path: str = WEBHOOK_PATH,
+        secret: str = WEBHOOK_SECRET,
+        max_pending: int = WEBHOOK_MAX_PENDING,
+    ):
+        if not secret:
+            raise ValueError("WEBHOOK_SECRET не задан")
+        self.app = app
+        self.path = path
+        self.secret = secret
+        self.max_pending = max_pending
+        self.draining = False
+        self._server: asyncio.AbstractServer | None = None
+        self._results = {
+            result: metrics.counter("webhook_updates_total", result=result)
+            for result in ("accepted", "rejected", "shed", "invalid")
+        }
+
+    async def start(self, host: str = WEBHOOK_LISTEN, port: int = 0):
+        self._server = await asyncio.start_server(
+            self._handle_connection,
+            host,
+            port,
+        )
+        return self
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    # Перестаем принимать обновления; уже принятые дорабатывает
+    # app.stop()
+    def stop_accepting(self):
+        self.draining = True
+        if self._server is not None:
+            self._server.close()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await asyncio.wait_for(
+                    _read_request(reader),
+                    _IDLE_TIMEOUT,
+                )
+                if request is None:
+                    break
+                method, target, headers, body = request
+                status, text = await self._dispatch(
+                    method,
+                    target,
+                    headers,
+                    body,
+                )
+                keep_alive = (
+                    not self.draining
+                    and headers.get("connection", "").lower() != "close"
+                )
+                writer.write(_response(status, text, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+            with contextlib.suppress(Exception):
+                await writer.wait_closed()
+
+    async def _dispatch(self, method, target, headers, body):
+        path = target.split("?", 1)[0]
+        if path == "/healthz":
+            return (503, "draining") if self.draining else (200, "ok")
+        if path != self.path:
+            return 404, "not found"
+        if method != "POST":
+            return 405, "method not allowed"
+
+        token = headers.get("x-telegram-bot-api-secret-token", "")
+        if not hmac.compare_digest(
+            token.encode("latin-1"),
+            self.secret.encode("utf-8"),
+        ):
+            self._results["rejected"].inc()
+            return 403, "forbidden"
+        if self.draining or self.app.update_queue.qsize() >= self.max_pending:
+            self._results["shed"].inc()
+            return 503, "busy"
+
+        # Тело — JSON-объект; список, строка или число (как и объект с
+        # полями не того типа) — некорректное обновление, а не обрыв
+        # соединения
+        try:
+            payload = json.loads(body)
+            if not isinstance(payload, dict):
+                raise TypeError("ожидался JSON-объект")
+            update = Update.de_json(payload, self.app.bot)
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            logging.warning(f"Некорректное обновление webhook: {e}")
+            self._results["invalid"].inc()
+            return 400, "bad update"
+
+        await self.app.update_queue.put(update)
+        self._results["accepted"].inc()
+        return 200, "ok"
+
+
+# Запрос HTTP/1.1: (метод, путь, заголовки, тело) или None, если
+# клиент закрыл соединение
+async def _read_request(reader: asyncio.StreamReader):
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError:
+        return None
+    except asyncio.LimitOverrunError:
+        raise ValueError("слишком длинные заголовки")
+
+    lines = head.decode("latin-1").split("\r\n")
+    method, target, _ = lines[0].split(" ", 2)
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get("content-length") or 0)
+    if length > _MAX_BODY:
+        raise ValueError("слишком большое тело запроса")
+    body = await reader.readexactly(length) if length else b""
+    return method, target, headers, body
+
+
+def _response(
+    status: int,
+    text: str,
+    keep_alive: bool,
+    content_type: str = _TEXT,
+) -> bytes:
+    body = text.encode("utf-8")
+    head = (
+        f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        "\r\n"
+    )
+    return head.encode("latin-1") + body
+
+
+# Отдельный HTTP-сервер метрик для режима polling: GET /metrics в
+# формате Prometheus, одно соединение — один запрос
+async def start_metrics_server(
+    host: str = METRICS_LISTEN,
+    port: int = METRICS_PORT,
+) -> asyncio.AbstractServer:
+    return await asyncio.start_server(_serve_metrics, host, port)
+
+
+async def _serve_metrics(reader, writer):
+    try:
+        request = await asyncio.wait_for(_read_request(reader), _IDLE_TIMEOUT)
+        if request is not None:
+            path = request[1].split("?", 1)[0]
+            if path == "/metrics":
+                response = _response(
+                    200,
+                    metrics.render_prometheus(),
+                    False,
+                    _PROMETHEUS,
+                )
+            else:
+                response = _response(404, "not found", False)
+            writer.write(response)
+            await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+        with contextlib.suppress(Exception):
+            await writer.wait_closed()
+
+
+# Полный цикл работы в режиме webhook: инициализация приложения,
+# регистрация webhook, прием обновлений до SIGTERM/SIGINT и плавная
+# остановка — новые обновления получают 503, принятые дорабатываются
+# не дольше WEBHOOK_DRAIN_TIMEOUT секунд.
+async def run_webhook(
+    app,
+    host: str = WEBHOOK_LISTEN,
+    port: int = WEBHOOK_PORT,
+    url: str = WEBHOOK_URL,
+):
+    # Без секрета не стартуем (ValueError) еще до инициализации
+    server = WebhookServer(app)
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+
+    await server.start(host, port)
+    await app.start()
+    if WEBHOOK_REGISTER and url:
+        await app.bot.set_webhook(
+            url=url.rstrip("/") + server.path,
+            secret_token=server.secret,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    logging.info(f"Webhook слушает {host}:{server.port}{server.path}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    logging.info("Остановка: дорабатываю принятые обновления...")
+    server.stop_accepting()
+    try:
+        await asyncio.wait_for(app.stop(), WEBHOOK_DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        logging.warning(
+            f"Не все обновления обработаны за {WEBHOOK_DRAIN_TIMEOUT} с"
+        )
+    if app.post_stop:
+        await app.post_stop(app)
+    try:
+        await app.shutdown()
+    except RuntimeError as e:
+        logging.warning(f"Приложение остановлено не полностью: {e}")
+    if app.post_shutdown:
+        await app.post_shutdown(app)
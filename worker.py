@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import os
+import pickle
+import signal
+import socket
+import time
+import traceback
+
+from dotenv import load_dotenv
+
+from job_queue import (
+    JOB_POLL_MAX,
+    JOB_POLL_MIN,
+    JOB_QUEUE_DB,
+    JobQueue,
+    resolve_func,
+)
+
+# Пул процессов-воркеров очереди задач. Цены — mmap общего файла
+# prices.bin: страницы в памяти одни на все процессы, отдельный сервис
+# воркеров не держит своей копии данных.
+# Отдельный сервис: python worker.py --processes 4, бот с
+# CPU_BACKEND=queue и JOB_WORKERS=0 на той же машине.
+
+
+# Имя воркера в очереди (колонка worker у забранных задач)
+def worker_name(pid: int) -> str:
+    return f"{socket.gethostname()}:{pid}"
+
+
+# Цикл одного воркера: забрать задачу, выполнить, записать результат
+def work(db_path: str, stop_event):
+    # Остановку воркеров координирует родительский процесс
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    queue = JobQueue(db_path)
+    name = worker_name(os.getpid())
+    idle = JOB_POLL_MIN
+    while not stop_event.is_set():
+        job = queue.claim(name)
+        if job is None:
+            stop_event.wait(idle)
+            idle = min(idle * 2, JOB_POLL_MAX)
+            continue
+
+        idle = JOB_POLL_MIN
+        job_id, path, payload = job
+        try:
+            args, kwargs = pickle.loads(payload)
+            result = resolve_func(path)(*args, **kwargs)
+        except Exception:
+            queue.finish(job_id, error=traceback.format_exc(limit=5))
+        else:
+            queue.finish(job_id, result=result)
+
+
+# Запущенные процессы-воркеры
+class WorkerPool:
+
+    def __init__(self, processes: int, db_path: str = JOB_QUEUE_DB):
+        # Готовим данные и тяжелые импорты до fork
+        from chart_generator import generate_stock_chart  # noqa: F401
+        from price_store import get_store
+        from stats_calculator import calculate_stock_stats  # noqa: F401
+
+        get_store()
+        # Файл очереди до fork не открываем: SQLite держит состояние
+        # блокировок на процесс, и в WAL-режиме дочерние процессы
+        # перестают видеть чужие записи
+
+        self.context = multiprocessing.get_context("fork")
+        self.db_path = db_path
+        self.stop_event = self.context.Event()
+        self.processes = [self._start(i) for i in range(processes)]
+
+    def _start(self, i: int):
+        process = self.context.Process(
+            target=work,
+            args=(self.db_path, self.stop_event),
+            name=f"job-worker-{i}",
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    # Перезапуск завершившихся (упавших) воркеров; их незавершенные
+    # задачи сразу возвращаются в очередь, не дожидаясь
+    # JOB_REQUEUE_SECONDS.
+    # Возвращает число перезапущенных процессов.
+    def restart_dead(self, queue: JobQueue) -> int:
+        restarted = 0
+        for i, process in enumerate(self.processes):
+            if process.is_alive() or self.stop_event.is_set():
+                continue
+            process.join(0)
+            queue.requeue_worker(worker_name(process.pid))
+            self.processes[i] = self._start(i)
+            restarted += 1
+        return restarted
+
+    def stop(self, timeout: float = 5.0):
+        self.stop_event.set()
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+
+# Обслуживание очереди (раз в секунду): перезапуск упавших воркеров
+# пула, если он есть, возврат зависших задач (в том числе воркеров
+# других машин) и удаление старых строк, которые никто не забрал.
+# Возвращает (перезапущено воркеров, возвращено зависших задач).
+def maintain_queue(pool: WorkerPool | None, queue: JobQueue):
+    restarted = pool.restart_dead(queue) if pool is not None else 0
+    return restarted, queue.requeue_stale()
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Воркеры очереди задач")
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=int(os.getenv("JOB_WORKERS", "0")) or os.cpu_count() or 1,
+    )
+    parser.add_argument("--db", default=JOB_QUEUE_DB)
+    args = parser.parse_args()
+
+    pool = WorkerPool(args.processes, args.db)
+    print(f"Запущено воркеров: {args.processes}, очередь {args.db}")
+
+    stopping = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    queue = JobQueue(args.db)
+    while not stopping:
+        time.sleep(1)
+        restarted, requeued = maintain_queue(pool, queue)
+        if restarted or requeued:
+            print(
+                f"Перезапущено воркеров: {restarted}, "
+                f"возвращено зависших задач: {requeued}"
+            )
+    pool.stop()
+
+
+if __name__ == "__main__":
+    main()